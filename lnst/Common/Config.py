@@ -13,7 +13,6 @@ olichtne@redhat.com (Ondrej Lichtner)
 import os
 import sys
 import re
-import subprocess
 from lnst.Common.Utils import bool_it
 from lnst.Common.NetUtils import verify_mac_address
 from lnst.Common.Colours import get_preset_conf
@@ -25,41 +24,96 @@ DefaultRPCPort = 9999
 class ConfigError(LnstError):
     pass
 
+def _read_git_ref(git_dir, ref):
+    ref_path = os.path.join(git_dir, ref)
+    if os.path.isfile(ref_path):
+        with open(ref_path) as f:
+            return f.read().strip()
+
+    packed_path = os.path.join(git_dir, "packed-refs")
+    if os.path.isfile(packed_path):
+        with open(packed_path) as f:
+            for line in f:
+                if line.startswith("#") or line.startswith("^"):
+                    continue
+                vals = line.split()
+                if len(vals) == 2 and vals[1] == ref:
+                    return vals[0]
+    return None
+
+def get_git_version(path):
+    """
+    Returns the commit hash checked out in the git repository containing
+    path (the same as 'git rev-parse HEAD') or None
+
+    Reads the .git directory instead of running git.
+    """
+    path = os.path.abspath(path)
+    while True:
+        git_dir = os.path.join(path, ".git")
+        if os.path.exists(git_dir):
+            break
+        parent = os.path.dirname(path)
+        if parent == path:
+            return None
+        path = parent
+
+    try:
+        if os.path.isfile(git_dir):
+            #worktrees and submodules use a 'gitdir: <path>' file
+            with open(git_dir) as f:
+                line = f.read().strip()
+            if not line.startswith("gitdir:"):
+                return None
+            git_dir = os.path.join(path, line[len("gitdir:"):].strip())
+
+        with open(os.path.join(git_dir, "HEAD")) as f:
+            head = f.read().strip()
+        if not head.startswith("ref:"):
+            return head
+        ref = head[len("ref:"):].strip()
+
+        commit = _read_git_ref(git_dir, ref)
+        if commit is None:
+            #a worktree keeps the shared refs in the common directory
+            common_path = os.path.join(git_dir, "commondir")
+            if os.path.isfile(common_path):
+                with open(common_path) as f:
+                    common_dir = os.path.join(git_dir, f.read().strip())
+                commit = _read_git_ref(common_dir, ref)
+        return commit
+    except IOError:
+        return None
+
+_version = []
+
+def get_version():
+    """
+    Returns the git commit hash when running from git, LNSTMajorVersion
+    otherwise, computed on the first call only
+    """
+    if len(_version) == 0:
+        version = get_git_version(os.path.dirname(__file__))
+        if not version:
+            version = LNSTMajorVersion
+        _version.append(version)
+    return _version[0]
+
 class Config():
     options = None
     _scheme = None
 
     def __init__(self):
         self._options = dict()
-        self.version = self._get_version()
         self._init_options()
 
+    @property
+    def version(self):
+        return get_version()
+
     def _init_options(self):
         raise NotImplementedError()
 
-    def _get_version(self):
-        # Check if I'm in git
-        cwd = os.getcwd()
-        abspath = os.path.abspath(__file__)
-        dname = os.path.dirname(abspath)
-        os.chdir(dname)
-        with open(os.devnull, 'w') as null:
-            cmd = ['git', 'rev-parse', 'HEAD']
-            try:
-                proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=null)
-                data = proc.communicate()
-            except:
-                os.chdir(cwd)
-                return LNSTMajorVersion
-            # git command passed
-            if data[0] != '':
-                version = data[0].strip()
-            # git command failed
-            else:
-                version = LNSTMajorVersion
-        os.chdir(cwd)
-        return version
-
     def colours_scheme(self):
         self._options['colours'] = dict()
         self._options['colours']["disable_colours"] = {\
@@ -228,6 +282,31 @@ class Config():
             raise ConfigError(msg)
         return int(option)
 
+    def optionInt(self, option, cfg_path):
+        try:
+            return int(option)
+        except ValueError:
+            msg = "Option expects an integer, got '%s'." % option
+            raise ConfigError(msg)
+
+    def optionFloat(self, option, cfg_path):
+        try:
+            return float(option)
+        except ValueError:
+            msg = "Option expects a number, got '%s'." % option
+            raise ConfigError(msg)
+
+    def optionSize(self, option, cfg_path):
+        size_re = "^\s*([0-9]+)\s*([kKmMgG]?)\s*$"
+        size_match = re.match(size_re, option)
+        if not size_match:
+            msg = "Option expects a size with an optional K, M or G "\
+                    "suffix, got '%s'." % option
+            raise ConfigError(msg)
+
+        units = {"": 1, "k": 1024, "m": 1024**2, "g": 1024**3}
+        return int(size_match.group(1)) * units[size_match.group(2).lower()]
+
     def optionPath(self, option, cfg_path):
         exp_path = os.path.expanduser(option)
         abs_path = os.path.join(os.path.dirname(cfg_path), exp_path)
@@ -1,5 +1,6 @@
 """
-Defines the DeviceRef class.
+Defines the DeviceRef class and the functions encoding Device objects in
+messages of the Controller-Slave communication protocol.
 
 Copyright 2017 Red Hat, Inc.
 Licensed under the GNU General Public License, version 2 as
@@ -10,6 +11,9 @@ __author__ = """
 olichtne@redhat.com (Ondrej Lichtner)
 """
 
+import cPickle
+from cStringIO import StringIO
+
 class DeviceRef(object):
     """Device reference transferable over network
 
@@ -17,3 +21,42 @@ class DeviceRef(object):
     """
     def __init__(self, if_index):
         self.if_index = int(if_index)
+
+def device_persistent_id(device_cls):
+    """returns a pickle persistent id function for device objects
+
+    Instances of device_cls and DeviceRef objects are stored as their
+    if_index, the function is only called by the pickler for objects that
+    aren't of builtin types so plain data doesn't pay for it.
+    """
+    def persistent_id(obj):
+        if isinstance(obj, device_cls) or isinstance(obj, DeviceRef):
+            return obj.if_index
+        return None
+    return persistent_id
+
+def encode_payload(obj, persistent_id=None):
+    """pickles obj with the binary protocol
+
+    Args:
+        persistent_id -- function created by device_persistent_id, devices
+            found anywhere in obj (including Param values and test module
+            objects) are encoded without copying or walking obj beforehand
+    """
+    buf = StringIO()
+    pickler = cPickle.Pickler(buf, cPickle.HIGHEST_PROTOCOL)
+    if persistent_id is not None:
+        pickler.inst_persistent_id = persistent_id
+    pickler.dump(obj)
+    return buf.getvalue()
+
+def decode_payload(data, resolve=DeviceRef):
+    """unpickles data created by encode_payload
+
+    Args:
+        resolve -- function called with the if_index of every encoded device,
+            its return value replaces the device, by default DeviceRef
+    """
+    unpickler = cPickle.Unpickler(StringIO(data))
+    unpickler.persistent_load = resolve
+    return unpickler.load()
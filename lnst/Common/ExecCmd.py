@@ -10,10 +10,28 @@ __author__ = """
 jpirko@redhat.com (Jiri Pirko)
 """
 
+import os
+import time
+import uuid
+import errno
+import fcntl
+import pipes
+import signal
+import select
 import logging
 import subprocess
 from lnst.Common.LnstError import LnstError
 
+#timeout used by exec_cmd calls that don't specify one, None or 0 disables it
+_default_timeout = None
+
+def set_default_timeout(timeout):
+    global _default_timeout
+    _default_timeout = timeout
+
+def get_default_timeout():
+    return _default_timeout
+
 class ExecCmdFail(LnstError):
     _cmd = None
     _retval = None
@@ -45,6 +63,19 @@ class ExecCmdFail(LnstError):
             stderr = " [%s]" % self._stderr
         return "Command execution failed%s%s" % (retval, stderr)
 
+class ExecCmdTimeout(ExecCmdFail):
+    def __init__(self, cmd=None, timeout=None, outs=["", ""],
+                 report_stderr=False):
+        super(ExecCmdTimeout, self).__init__(cmd, None, outs, report_stderr)
+        self._timeout = timeout
+
+    def __str__(self):
+        stderr = ""
+        if self._report_stderr:
+            stderr = " [%s]" % self._stderr
+        return "Command execution timed out after %ss%s" % (self._timeout,
+                                                            stderr)
+
 def log_output(log_func, out_type, out):
     log_func("%s:\n"
              "----------------------------\n"
@@ -52,12 +83,120 @@ def log_output(log_func, out_type, out):
              "----------------------------"
              % (out_type, out))
 
-def exec_cmd(cmd, die_on_err=True, log_outputs=True, report_stderr=False, json=False):
-    cmd = cmd.rstrip(" ")
-    logging.debug("Executing: \"%s\"" % cmd)
-    subp = subprocess.Popen(cmd, shell=True, stdout=subprocess.PIPE,
-                            stderr=subprocess.PIPE, close_fds=True)
-    (data_stdout, data_stderr) = subp.communicate()
+class _OutputCollector(object):
+    """Collects the output of a stream
+
+    Passes complete lines to the callback, all lines of one read in a single
+    call, and keeps at most max_output bytes, the tail of the output is kept
+    as that usually holds the error.
+    """
+    #a line longer than this is passed to the callback in parts
+    _max_partial = 65536
+
+    def __init__(self, out_type, callback=None, max_output=None):
+        self._out_type = out_type
+        self._callback = callback
+        self._max_output = max_output
+        self._chunks = []
+        self._size = 0
+        self._partial = ""
+        self.truncated = False
+
+    def add(self, data):
+        self._chunks.append(data)
+        self._size += len(data)
+        if self._max_output and self._size > 2 * self._max_output:
+            self._trim()
+
+        if self._callback is not None:
+            data = self._partial + data
+            end = data.rfind("\n") + 1
+            if end == 0 and len(data) >= self._max_partial:
+                end = len(data)
+            self._partial = data[end:]
+            if end > 0:
+                self._callback(self._out_type, data[:end])
+
+    def flush(self):
+        if self._callback is not None and self._partial:
+            self._callback(self._out_type, self._partial)
+        self._partial = ""
+
+    def _trim(self):
+        data = "".join(self._chunks)
+        if len(data) > self._max_output:
+            data = data[-self._max_output:]
+            self.truncated = True
+        self._chunks = [data]
+        self._size = len(data)
+
+    def get(self):
+        if self._max_output:
+            self._trim()
+        return "".join(self._chunks)
+
+def _set_nonblocking(fd):
+    flags = fcntl.fcntl(fd, fcntl.F_GETFL)
+    fcntl.fcntl(fd, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+
+def _kill_group(subp):
+    try:
+        os.killpg(subp.pid, signal.SIGKILL)
+    except OSError as e:
+        if e.errno != errno.ESRCH:
+            raise
+
+def _read_outputs(streams, deadline, stop=None):
+    """reads the streams until EOF, the deadline or stop() returning True
+
+    Args:
+        streams -- dictionary of file object: _OutputCollector
+        deadline -- time.time() value or None
+        stop -- function called after every read
+
+    Returns False if the deadline expired.
+    """
+    fds = dict([(f.fileno(), collector)
+                for f, collector in streams.items()])
+    while len(fds) > 0:
+        if stop is not None and stop():
+            return True
+
+        if deadline is None:
+            wait = None
+        else:
+            wait = deadline - time.time()
+            if wait <= 0:
+                return False
+
+        try:
+            rl, _, _ = select.select(fds.keys(), [], [], wait)
+        except select.error as e:
+            if e.args[0] == errno.EINTR:
+                continue
+            raise
+
+        for fd in rl:
+            try:
+                data = os.read(fd, 65536)
+            except OSError as e:
+                if e.errno in [errno.EAGAIN, errno.EINTR]:
+                    continue
+                raise
+            if data:
+                fds[fd].add(data)
+            else:
+                del fds[fd]
+    return True
+
+def _finish(cmd, retval, outputs, die_on_err, log_outputs, report_stderr,
+            json, timeout=None):
+    for collector in outputs:
+        collector.flush()
+        if collector.truncated:
+            logging.debug("%s of \"%s\" was truncated" %
+                          (collector._out_type, cmd))
+    data_stdout, data_stderr = [collector.get() for collector in outputs]
 
     '''
     When we should not die on error, do not print anything and let
@@ -68,8 +207,16 @@ def exec_cmd(cmd, die_on_err=True, log_outputs=True, report_stderr=False, json=F
             log_output(logging.debug, "Stdout", data_stdout)
         if data_stderr:
             log_output(logging.debug, "Stderr", data_stderr)
-    if subp.returncode and die_on_err:
-        err = ExecCmdFail(cmd, subp.returncode, [data_stdout, data_stderr], report_stderr)
+
+    if retval is None:
+        err = ExecCmdTimeout(cmd, timeout, [data_stdout, data_stderr],
+                             report_stderr)
+        if die_on_err:
+            logging.error(err)
+            raise err
+        logging.warning(err)
+    elif retval and die_on_err:
+        err = ExecCmdFail(cmd, retval, [data_stdout, data_stderr], report_stderr)
         logging.error(err)
         raise err
 
@@ -78,3 +225,196 @@ def exec_cmd(cmd, die_on_err=True, log_outputs=True, report_stderr=False, json=F
         data_stdout = json.loads(data_stdout)
 
     return data_stdout, data_stderr
+
+def exec_cmd(cmd, die_on_err=True, log_outputs=True, report_stderr=False,
+             json=False, timeout=None, output_cb=None, max_output=None):
+    """runs the command in a shell and returns its (stdout, stderr)
+
+    Args:
+        timeout -- seconds after which the process group of the command is
+            killed, the exception raised is ExecCmdTimeout. None uses the
+            default set by set_default_timeout, 0 disables the timeout.
+            When die_on_err is False the output collected so far is returned.
+        output_cb -- function called with ("Stdout"|"Stderr", lines) as
+            soon as complete lines of the output are read, the lines of one
+            read are passed together
+        max_output -- maximal number of bytes kept of each output, the
+            beginning is dropped
+    """
+    cmd = cmd.rstrip(" ")
+    logging.debug("Executing: \"%s\"" % cmd)
+
+    if timeout is None:
+        timeout = _default_timeout
+
+    if timeout:
+        #own process group, the whole pipeline is killed on timeout
+        preexec_fn = os.setpgrp
+    else:
+        preexec_fn = None
+
+    subp = subprocess.Popen(cmd, shell=True, stdout=subprocess.PIPE,
+                            stderr=subprocess.PIPE, close_fds=True,
+                            preexec_fn=preexec_fn)
+
+    outputs = [_OutputCollector("Stdout", output_cb, max_output),
+               _OutputCollector("Stderr", output_cb, max_output)]
+    if not timeout and output_cb is None and max_output is None:
+        (data_stdout, data_stderr) = subp.communicate()
+        outputs[0].add(data_stdout)
+        outputs[1].add(data_stderr)
+        retval = subp.returncode
+    else:
+        deadline = time.time() + timeout if timeout else None
+        finished = _read_outputs({subp.stdout: outputs[0],
+                                  subp.stderr: outputs[1]}, deadline)
+        if not finished:
+            _kill_group(subp)
+        subp.stdout.close()
+        subp.stderr.close()
+        subp.wait()
+        retval = subp.returncode if finished else None
+
+    return _finish(cmd, retval, outputs, die_on_err, log_outputs,
+                   report_stderr, json, timeout)
+
+class ExecCmdShell(object):
+    """Runs commands in one persistent /bin/sh
+
+    Saves the fork and exec of a new shell for every command of a sequence,
+    each command only costs a fork of the running shell. The run method
+    has the same interface and return values as exec_cmd.
+
+    Commands can't read stdin. After a timeout the shell is killed together
+    with the command and a new one is started for the next command.
+
+    Example:
+        with ExecCmdShell() as shell:
+            shell.run("ip link set eth1 up")
+            out, _ = shell.run("ethtool -i eth1")
+    """
+    def __init__(self):
+        self._subp = None
+        self._marker = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.close()
+
+    def _start(self):
+        self._marker = "__lnst_exec_%s__" % uuid.uuid4().hex
+        self._subp = subprocess.Popen(["/bin/sh"], stdin=subprocess.PIPE,
+                                      stdout=subprocess.PIPE,
+                                      stderr=subprocess.PIPE, close_fds=True,
+                                      preexec_fn=os.setpgrp)
+        _set_nonblocking(self._subp.stdout.fileno())
+        _set_nonblocking(self._subp.stderr.fileno())
+
+    def close(self):
+        if self._subp is None:
+            return
+        try:
+            self._subp.stdin.close()
+        except IOError:
+            pass
+        _kill_group(self._subp)
+        self._subp.stdout.close()
+        self._subp.stderr.close()
+        self._subp.wait()
+        self._subp = None
+
+    def run(self, cmd, die_on_err=True, log_outputs=True,
+            report_stderr=False, json=False, timeout=None, output_cb=None,
+            max_output=None):
+        cmd = cmd.rstrip(" ")
+        logging.debug("Executing: \"%s\"" % cmd)
+
+        if timeout is None:
+            timeout = _default_timeout
+
+        if self._subp is None or self._subp.poll() is not None:
+            self._start()
+
+        #a subshell, so syntax errors or exit don't end the helper shell,
+        #the markers end the output of the command on both streams
+        marker = self._marker
+        script = "( eval %s ) </dev/null\n" \
+                 "printf '\\n%s %%d\\n' $?\n" \
+                 "printf '\\n%s\\n' >&2\n" % (pipes.quote(cmd), marker,
+                                              marker)
+        try:
+            self._subp.stdin.write(script)
+            self._subp.stdin.flush()
+        except IOError:
+            self.close()
+            raise ExecCmdFail(cmd, None, ["", "helper shell died"],
+                              report_stderr)
+
+        stdout = _MarkerCollector("Stdout", output_cb, max_output, marker)
+        stderr = _MarkerCollector("Stderr", output_cb, max_output, marker)
+        deadline = time.time() + timeout if timeout else None
+        finished = _read_outputs({self._subp.stdout: stdout,
+                                  self._subp.stderr: stderr}, deadline,
+                                 lambda: stdout.done and stderr.done)
+
+        if not finished:
+            retval = None
+            self.close()
+        elif not (stdout.done and stderr.done):
+            self.close()
+            raise ExecCmdFail(cmd, None, ["", "helper shell died"],
+                              report_stderr)
+        else:
+            retval = stdout.retval
+
+        return _finish(cmd, retval, [stdout, stderr], die_on_err,
+                       log_outputs, report_stderr, json, timeout)
+
+class _MarkerCollector(_OutputCollector):
+    """Collects output of an ExecCmdShell command up to the end marker"""
+    def __init__(self, out_type, callback, max_output, marker):
+        super(_MarkerCollector, self).__init__(out_type, callback, max_output)
+        self._marker = "\n" + marker
+        self._pending = ""
+        self.done = False
+        self.retval = None
+
+    def add(self, data):
+        data = self._pending + data
+        self._pending = ""
+
+        pos = data.find(self._marker)
+        if pos >= 0:
+            end = data.find("\n", pos + len(self._marker))
+            if end < 0:
+                self._pending = data
+                return
+            status = data[pos + len(self._marker):end].strip()
+            if status:
+                self.retval = int(status)
+            data = data[:pos]
+            self.done = True
+        else:
+            #the end of the data could be the beginning of the marker
+            keep = len(self._marker) - 1
+            self._pending = data[-keep:]
+            data = data[:-keep]
+
+        if data:
+            super(_MarkerCollector, self).add(data)
+
+def exec_cmds(cmds, die_on_err=True, log_outputs=True, report_stderr=False,
+              timeout=None):
+    """runs the commands one by one in a single helper shell
+
+    Returns the list of (stdout, stderr) tuples, stops at the first failed
+    command if die_on_err is True.
+    """
+    results = []
+    with ExecCmdShell() as shell:
+        for cmd in cmds:
+            results.append(shell.run(cmd, die_on_err, log_outputs,
+                                     report_stderr, timeout=timeout))
+    return results
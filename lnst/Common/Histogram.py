@@ -0,0 +1,144 @@
+"""
+Defines the LogHistogram class, a log-bucketed histogram of integer values
+in the style of HdrHistogram. The value range is split into power-of-two
+magnitudes, each of which is split linearly into a fixed number of
+sub-buckets, which bounds the relative error of every recorded value while
+keeping the histogram small and mergeable.
+
+Copyright 2017 Red Hat, Inc.
+Licensed under the GNU General Public License, version 2 as
+published by the Free Software Foundation; see COPYING for details.
+"""
+
+from lnst.Common.LnstError import LnstError
+
+class HistogramError(LnstError):
+    pass
+
+class LogHistogram(object):
+    """Log-bucketed histogram of non-negative integer values
+
+    Values below 2**sub_bucket_bits are recorded exactly, larger values are
+    recorded with a relative error of at most 2**-(sub_bucket_bits - 1).
+
+    Histograms with the same sub_bucket_bits can be merged, the dictionary
+    returned by to_dict is meant for transferring the raw histogram (e.g. as
+    part of a Job result) and can be loaded back with from_dict.
+    """
+    def __init__(self, sub_bucket_bits=7):
+        if sub_bucket_bits < 1:
+            raise HistogramError("sub_bucket_bits must be positive")
+        self._sub_bits = sub_bucket_bits
+        self._counts = {}
+        self._total = 0
+        self._sum = 0
+        self._min = None
+        self._max = None
+
+    @property
+    def total(self):
+        return self._total
+
+    @property
+    def min(self):
+        return self._min
+
+    @property
+    def max(self):
+        return self._max
+
+    @property
+    def mean(self):
+        if self._total == 0:
+            return None
+        return self._sum / float(self._total)
+
+    def _bucket_shift(self, value):
+        shift = value.bit_length() - self._sub_bits
+        if shift < 0:
+            return 0
+        return shift
+
+    def bucket_bounds(self, value):
+        """returns the (lowest, highest) value equivalent to value"""
+        shift = self._bucket_shift(value)
+        low = (value >> shift) << shift
+        return low, low + (1 << shift) - 1
+
+    def record(self, value, count=1):
+        value = int(value)
+        if value < 0:
+            raise HistogramError("Negative values can't be recorded")
+
+        low, _ = self.bucket_bounds(value)
+        self._counts[low] = self._counts.get(low, 0) + count
+        self._total += count
+        self._sum += value * count
+        if self._min is None or value < self._min:
+            self._min = value
+        if self._max is None or value > self._max:
+            self._max = value
+
+    def merge(self, other):
+        if other._sub_bits != self._sub_bits:
+            raise HistogramError("Can't merge histograms with different "
+                                 "precision")
+        for low, count in other._counts.items():
+            self._counts[low] = self._counts.get(low, 0) + count
+        self._total += other._total
+        self._sum += other._sum
+        for value in [other._min, other._max]:
+            if value is None:
+                continue
+            if self._min is None or value < self._min:
+                self._min = value
+            if self._max is None or value > self._max:
+                self._max = value
+
+    def percentile(self, percentile):
+        """returns the highest equivalent value of the given percentile
+
+        Args:
+            percentile -- float in the range [0, 100]
+        """
+        if self._total == 0:
+            return None
+        if percentile < 0 or percentile > 100:
+            raise HistogramError("Percentile must be in the range [0, 100]")
+
+        target = max(1, int(round(self._total * percentile / 100.0)))
+        seen = 0
+        for low in sorted(self._counts.keys()):
+            seen += self._counts[low]
+            if seen >= target:
+                _, high = self.bucket_bounds(low)
+                return min(high, self._max)
+        return self._max
+
+    def buckets(self):
+        """returns a sorted list of (lowest, highest, count) tuples"""
+        res = []
+        for low in sorted(self._counts.keys()):
+            _, high = self.bucket_bounds(low)
+            res.append((low, high, self._counts[low]))
+        return res
+
+    def to_dict(self):
+        return {"sub_bucket_bits": self._sub_bits,
+                "total": self._total,
+                "sum": self._sum,
+                "min": self._min,
+                "max": self._max,
+                "buckets": [[low, count]
+                            for low, _, count in self.buckets()]}
+
+    @classmethod
+    def from_dict(cls, d):
+        hist = cls(d["sub_bucket_bits"])
+        for low, count in d["buckets"]:
+            hist._counts[low] = hist._counts.get(low, 0) + count
+        hist._total = d["total"]
+        hist._sum = d["sum"]
+        hist._min = d["min"]
+        hist._max = d["max"]
+        return hist
@@ -10,90 +10,246 @@ __author__ = """
 olichtne@redhat.com (Ondrej Lichtner)
 """
 
-import re
-from socket import inet_pton, AF_INET, AF_INET6
+import struct
+from functools import total_ordering
+from socket import inet_pton, inet_ntop, AF_INET, AF_INET6
 from lnst.Common.LnstError import LnstError
 
+#iteration over larger subnets (e.g. an IPv6 /64) would never finish
+MAX_ITER_ADDRESSES = 1 << 24
+
+@total_ordering
 class BaseIpAddress(object):
-    def __init__(self, addr):
-        self.addr, self.prefixlen = self._parse_addr(addr)
+    """IP address with a prefix length
+
+    The address is stored as an integer, which makes comparisons, hashing
+    and arithmetic cheap. The string form is only created when needed.
+
+    Addresses compare equal when their family, address and prefix length
+    are equal. They are ordered by family, address and prefix length.
+    'in' tests subnet containment, iteration yields every address of the
+    subnet (at most MAX_ITER_ADDRESSES) and adding an integer returns the
+    address that many addresses further with the same prefix length.
+
+    The objects are immutable, prefixlen is a read-only property, so they
+    can be used as dictionary keys.
+
+    Args:
+        addr -- string "address[/prefixlen]" or integer address
+        prefixlen -- overrides the prefix length of addr, defaults to the
+            full length of the address
+    """
+    family = None
+    _bits = None
+
+    def __init__(self, addr, prefixlen=None):
+        if isinstance(addr, (int, long)):
+            if addr < 0 or addr >> self._bits:
+                raise LnstError("Address out of range.")
+            self._int = addr
+            parsed_prefixlen = self._bits
+        else:
+            self._int, parsed_prefixlen = self._parse_addr(addr)
+        #string form, created on first use
+        self._addr = None
+
+        if prefixlen is None:
+            prefixlen = parsed_prefixlen
+        self._prefixlen = self._check_prefixlen(prefixlen)
 
-        self.family = None
+    def _check_prefixlen(self, prefixlen):
+        try:
+            prefixlen = int(prefixlen)
+        except (TypeError, ValueError):
+            raise LnstError("Invalid prefix length.")
+        if prefixlen < 0 or prefixlen > self._bits:
+            raise LnstError("Invalid prefix length.")
+        return prefixlen
+
+    @property
+    def prefixlen(self):
+        return self._prefixlen
+
+    @property
+    def addr(self):
+        """string form of the address without the prefix length"""
+        if self._addr is None:
+            self._addr = self._int_to_str(self._int)
+        return self._addr
+
+    @property
+    def netmask(self):
+        """integer network mask of the prefix length"""
+        full = (1 << self._bits) - 1
+        return full ^ (full >> self.prefixlen)
+
+    @property
+    def network(self):
+        """first address of the subnet with the same prefix length"""
+        return type(self)(self._int & self.netmask, self.prefixlen)
+
+    @property
+    def broadcast(self):
+        """last address of the subnet with the same prefix length"""
+        hostmask = ((1 << self._bits) - 1) ^ self.netmask
+        return type(self)(self._int | hostmask, self.prefixlen)
+
+    @property
+    def num_addresses(self):
+        """number of addresses in the subnet"""
+        return 1 << (self._bits - self.prefixlen)
+
+    def __int__(self):
+        return self._int
+
+    def __long__(self):
+        return long(self._int)
 
     def __str__(self):
-        return str(self.addr)
+        return self.addr
+
+    def __repr__(self):
+        return "%s('%s/%d')" % (type(self).__name__, self.addr,
+                                self.prefixlen)
+
+    def _key(self):
+        return (self.family, self._int, self.prefixlen)
 
     def __eq__(self, other):
-        if self.addr != other.addr or\
-           self.prefixlen != other.prefixlen:
+        if not isinstance(other, BaseIpAddress):
+            return NotImplemented
+        return self._key() == other._key()
+
+    def __ne__(self, other):
+        if not isinstance(other, BaseIpAddress):
+            return NotImplemented
+        return self._key() != other._key()
+
+    def __lt__(self, other):
+        if not isinstance(other, BaseIpAddress):
+            return NotImplemented
+        return self._key() < other._key()
+
+    def __hash__(self):
+        return hash(self._key())
+
+    def __contains__(self, other):
+        """subnet containment, other can be an address or a string
+
+        Other values, including strings that aren't addresses, are never
+        contained.
+        """
+        if not isinstance(other, (BaseIpAddress, basestring)):
             return False
-        else:
-            return True
+        try:
+            other = IpAddress(other)
+        except LnstError:
+            return False
+        if other.family != self.family or other.prefixlen < self.prefixlen:
+            return False
+        mask = self.netmask
+        return other._int & mask == self._int & mask
+
+    def __iter__(self):
+        """iterates over all addresses of the subnet
+
+        Subnets with more than MAX_ITER_ADDRESSES addresses raise LnstError,
+        use integer offsets to walk them.
+        """
+        if self.num_addresses > MAX_ITER_ADDRESSES:
+            raise LnstError("Subnet %s/%d is too large to iterate over." %
+                            (self.addr, self.prefixlen))
+        return self._iter_addresses()
+
+    def _iter_addresses(self):
+        num = self._int & self.netmask
+        last = num + self.num_addresses
+        while num < last:
+            yield type(self)(num, self.prefixlen)
+            num += 1
+
+    def __add__(self, offset):
+        return type(self)(self._int + offset, self.prefixlen)
+
+    def __sub__(self, other):
+        if isinstance(other, BaseIpAddress):
+            return self._int - other._int
+        return type(self)(self._int - other, self.prefixlen)
+
+    def __getstate__(self):
+        return {"_int": self._int, "prefixlen": self.prefixlen}
+
+    def __setstate__(self, state):
+        self._int = state["_int"]
+        self._prefixlen = state["prefixlen"]
+        self._addr = None
+
+    def _parse_prefix(self, addr, name):
+        parts = addr.split('/')
+        if len(parts) == 1:
+            return parts[0], self._bits
+        elif len(parts) == 2:
+            try:
+                return parts[0], int(parts[1])
+            except ValueError:
+                pass
+        raise LnstError("Invalid %s format." % name)
+
+    def _parse_addr(self, addr):
+        raise NotImplementedError()
 
-    @staticmethod
-    def _parse_addr(addr):
+    def _int_to_str(self, num):
         raise NotImplementedError()
 
 class Ip4Address(BaseIpAddress):
-    def __init__(self, addr):
-        super(Ip4Address, self).__init__(addr)
-
-        self.family = AF_INET
-
-    @staticmethod
-    def _parse_addr(addr):
-        addr = addr.split('/')
-        if len(addr) == 1:
-            addr = addr[0]
-            prefixlen = 32
-        elif len(addr) == 2:
-            addr, prefixlen = addr
-            prefixlen = int(prefixlen)
-        else:
-            raise LnstError("Invalid IPv4 format.")
+    family = AF_INET
+    _bits = 32
 
+    def _parse_addr(self, addr):
+        addr, prefixlen = self._parse_prefix(addr, "IPv4")
         try:
-            inet_pton(AF_INET, addr)
+            num = struct.unpack("!I", inet_pton(AF_INET, addr))[0]
         except:
             raise LnstError("Invalid IPv4 format.")
+        return num, prefixlen
 
-        return addr, prefixlen
+    def _int_to_str(self, num):
+        return inet_ntop(AF_INET, struct.pack("!I", num))
 
 class Ip6Address(BaseIpAddress):
-    def __init__(self, addr):
-        super(Ip6Address, self).__init__(addr)
-
-        self.family = AF_INET6
-
-    @staticmethod
-    def _parse_addr(addr):
-        addr = addr.split('/')
-        if len(addr) == 1:
-            addr = addr[0]
-            prefixlen = 128
-        elif len(addr) == 2:
-            addr, prefixlen = addr
-            prefixlen = int(prefixlen)
-        else:
-            raise LnstError("Invalid IPv6 format.")
+    family = AF_INET6
+    _bits = 128
 
+    def _parse_addr(self, addr):
+        addr, prefixlen = self._parse_prefix(addr, "IPv6")
         try:
-            type(inet_pton(AF_INET6, addr))
+            high, low = struct.unpack("!QQ", inet_pton(AF_INET6, addr))
         except:
             raise LnstError("Invalid IPv6 format.")
+        return (high << 64) | low, prefixlen
+
+    def _int_to_str(self, num):
+        return inet_ntop(AF_INET6, struct.pack("!QQ", num >> 64,
+                                               num & 0xffffffffffffffff))
 
-        return addr, prefixlen
+def IpAddress(addr, prefixlen=None):
+    """Factory method to create a BaseIpAddress object
 
-def IpAddress(addr):
-    """Factory method to create a BaseIpAddress object"""
+    Args:
+        addr -- BaseIpAddress object, returned unchanged when prefixlen isn't
+            specified, or string, the family is decided by its format
+        prefixlen -- prefix length overriding the one of addr
+    """
     if isinstance(addr, BaseIpAddress):
-        return addr
+        if prefixlen is None:
+            return addr
+        return type(addr)(int(addr), prefixlen)
     #TODO add switches for host, interface etc...
-    elif isinstance(addr, str):
-        try:
-            return Ip4Address(addr)
-        except:
-            return Ip6Address(addr)
+    elif isinstance(addr, basestring):
+        if ":" in addr:
+            return Ip6Address(addr, prefixlen)
+        else:
+            return Ip4Address(addr, prefixlen)
     else:
         raise LnstError("Value must be a BaseIpAddress or string object."
                         "Not {}".format(type(addr)))
@@ -67,10 +67,14 @@ class TransmitHandler(logging.Handler):
         logging.Handler.__init__(self)
         self.target = target
         self._origin_name = None
+        self._job_id = None
 
     def set_origin_name(self, name):
         self._origin_name = name
 
+    def set_job_id(self, job_id):
+        self._job_id = job_id
+
     def emit(self, record):
         r = dict(record.__dict__)
         r['msg'] = record.getMessage()
@@ -78,6 +82,8 @@ class TransmitHandler(logging.Handler):
         r['exc_info'] = None
         if self._origin_name != None:
             r['origin_name'] = self._origin_name
+        if self._job_id != None:
+            r['job_id'] = self._job_id
 
         data = {"type": "log", "record": r}
 
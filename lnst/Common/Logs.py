@@ -9,7 +9,7 @@ published by the Free Software Foundation; see COPYING for details.
 __autor__ = """
 jzupka@redhat.com (Jiri Zupka)
 """
-import os, sys, shutil
+import os, sys, shutil, re, gzip, threading
 from logging import Formatter
 import logging.handlers
 import traceback
@@ -92,6 +92,224 @@ class MultilineFormatter(Formatter): # addr:17 level:7
 
         return self._fmt % values
 
+class RotatingLogHandler(logging.FileHandler):
+    """FileHandler that rotates the file by size and indexes the records
+
+    When the file grows over max_bytes it's renamed to <name>.<seq> and
+    compressed to <name>.<seq>.gz in a background thread. The sequence
+    numbers only grow, so they are stable references for the index.
+    backup_count limits the number of kept rotated files, 0 keeps all.
+
+    The index <name>.idx has a tab separated line for every run of
+    consecutive records with the same slave, level and job id logged in
+    the same second: start and end time, slave, level, job id, sequence
+    number of the file, offset and length of the run. See extract_logs.
+    """
+    def __init__(self, filename, max_bytes=0, backup_count=0):
+        self._max_bytes = max_bytes
+        self._backup_count = backup_count
+        self._seq = max([0] + _rotated_seqs(filename)) + 1
+        self._index = None
+        self._pending = None
+        self._compressor = None
+        self._owner = os.getpid()
+        logging.FileHandler.__init__(self, filename)
+
+    def _open(self):
+        stream = logging.FileHandler._open(self)
+        #append mode doesn't move the position before the first write
+        stream.seek(0, os.SEEK_END)
+        return stream
+
+    def emit(self, record):
+        try:
+            if self.stream is None:
+                self.stream = self._open()
+            if self._max_bytes and self.stream.tell() >= self._max_bytes:
+                self._rotate()
+
+            offset = self.stream.tell()
+            logging.FileHandler.emit(self, record)
+            length = self.stream.tell() - offset
+            if length > 0:
+                self._index_record(record, offset, length)
+        except (KeyboardInterrupt, SystemExit):
+            raise
+        except:
+            self.handleError(record)
+
+    def _index_record(self, record, offset, length):
+        key = (record.__dict__.get("address", "-"), record.levelname,
+               str(record.__dict__.get("job_id", "-")), self._seq,
+               int(record.created))
+        pending = self._pending
+        if pending is not None and pending[0] == key and \
+           pending[3] + pending[4] == offset:
+            pending[2] = record.created
+            pending[4] += length
+            return
+
+        self._write_index()
+        self._pending = [key, record.created, record.created, offset, length]
+
+    def _write_index(self):
+        if self._pending is None:
+            return
+        if self._index is None:
+            self._index = open(self.baseFilename + ".idx", "a")
+
+        (slave, level, job_id, seq, _), start, end, offset, length = \
+                self._pending
+        self._index.write("%.3f\t%.3f\t%s\t%s\t%s\t%d\t%d\t%d\n" %
+                          (start, end, slave, level, job_id, seq, offset,
+                           length))
+        self._index.flush()
+        self._pending = None
+
+    def _rotate(self):
+        self._write_index()
+        self.stream.close()
+        self.stream = None
+
+        rotated = "%s.%d" % (self.baseFilename, self._seq)
+        os.rename(self.baseFilename, rotated)
+        expired = None
+        if self._backup_count:
+            expired = self._seq - self._backup_count
+        self._seq += 1
+
+        self._wait_compressor()
+        self._compressor = threading.Thread(target=_compress_log,
+                                            args=(rotated, expired),
+                                            name="LogCompressor")
+        self._compressor.daemon = True
+        self._compressor.start()
+
+        self.stream = self._open()
+
+    def _wait_compressor(self):
+        if self._compressor is not None:
+            self._compressor.join()
+            self._compressor = None
+
+    def close(self):
+        self.acquire()
+        try:
+            #a forked process doesn't own the index or the compressor
+            if os.getpid() == self._owner:
+                self._write_index()
+                self._wait_compressor()
+            if self._index is not None:
+                self._index.close()
+                self._index = None
+        finally:
+            self.release()
+        logging.FileHandler.close(self)
+
+def _rotated_seqs(filename):
+    folder, name = os.path.split(filename)
+    pattern = re.compile(r"^%s\.([0-9]+)(\.gz)?$" % re.escape(name))
+    seqs = []
+    for f in os.listdir(folder or "."):
+        match = pattern.match(f)
+        if match:
+            seqs.append(int(match.group(1)))
+    return seqs
+
+def _compress_log(path, expired_seq=None):
+    try:
+        tmp_path = path + ".gz.tmp"
+        with open(path, "rb") as src:
+            dst = gzip.open(tmp_path, "wb", 6)
+            try:
+                shutil.copyfileobj(src, dst)
+            finally:
+                dst.close()
+        os.rename(tmp_path, path + ".gz")
+        os.remove(path)
+
+        if expired_seq is not None:
+            base = path.rsplit(".", 1)[0]
+            for seq in _rotated_seqs(base):
+                if seq <= expired_seq:
+                    for suffix in ["", ".gz"]:
+                        if os.path.exists("%s.%d%s" % (base, seq, suffix)):
+                            os.remove("%s.%d%s" % (base, seq, suffix))
+    except (IOError, OSError) as e:
+        #the uncompressed file is kept and still readable by extract_logs
+        sys.stderr.write("Compression of log %s failed: %s\n" % (path, e))
+
+def _open_log_segment(path, seq, last_seq):
+    for name, opener in [("%s.%d.gz" % (path, seq), gzip.open),
+                         ("%s.%d" % (path, seq), open)]:
+        if os.path.exists(name):
+            return opener(name, "rb")
+    if seq == last_seq and os.path.exists(path):
+        return open(path, "rb")
+    return None
+
+def extract_logs(path, out, job_id=None, slave=None, level=None, since=None,
+                 until=None):
+    """writes the records of a log file matching all given filters to out
+
+    Only the parts of the log files referenced by the matching index entries
+    are read, rotated files without a matching entry aren't decompressed.
+
+    Args:
+        path -- path of the log file, e.g. <recipe log dir>/debug
+        out -- file object the records are written to
+        job_id -- id of the job that logged the records
+        slave -- id of the slave, "-" matches records of the local host
+        level -- minimal level name or number
+        since, until -- time.time() values limiting the time window
+
+    Returns the number of matching index entries.
+    """
+    if isinstance(level, basestring):
+        level = logging.getLevelName(level.upper())
+
+    entries = []
+    last_seq = 0
+    with open(path + ".idx", "r") as index:
+        for line in index:
+            fields = line.rstrip("\n").split("\t")
+            if len(fields) != 8:
+                continue
+            start, end = float(fields[0]), float(fields[1])
+            seq, offset, length = [int(i) for i in fields[5:]]
+            last_seq = max(last_seq, seq)
+
+            if job_id is not None and fields[4] != str(job_id):
+                continue
+            if slave is not None and fields[2] != slave:
+                continue
+            if level is not None and \
+               logging.getLevelName(fields[3]) < level:
+                continue
+            if since is not None and end < since:
+                continue
+            if until is not None and start > until:
+                continue
+            entries.append((seq, offset, length))
+
+    segment = None
+    segment_seq = None
+    try:
+        for seq, offset, length in sorted(entries):
+            if seq != segment_seq:
+                if segment is not None:
+                    segment.close()
+                segment = _open_log_segment(path, seq, last_seq)
+                segment_seq = seq
+            if segment is None:
+                continue
+            segment.seek(offset)
+            out.write(segment.read(length))
+    finally:
+        if segment is not None:
+            segment.close()
+    return len(entries)
+
 class LoggingCtl:
     log_folder = ""
     display_handler = None
@@ -101,7 +319,8 @@ class LoggingCtl:
     transmit_handler = None
     _id_seq = 0
 
-    def __init__(self, debug=False, log_dir=None, log_subdir="", colours=True):
+    def __init__(self, debug=False, log_dir=None, log_subdir="", colours=True,
+                 max_bytes=0, backup_count=0):
         #clear any previously set handlers
         logger = logging.getLogger('')
         for i in list(logger.handlers):
@@ -113,6 +332,9 @@ class LoggingCtl:
                 logger.removeHandler(i)
 
         self._origin_name = None
+        self._job_id = None
+        self._max_bytes = max_bytes
+        self._backup_count = backup_count
 
         if log_dir != None:
             self.log_folder = os.path.abspath(os.path.join(log_dir, log_subdir))
@@ -163,19 +385,20 @@ class LoggingCtl:
 
         (recipe_info, recipe_debug) = self._create_file_handler(
                                                         self.recipe_log_path)
-        logger = logging.getLogger()
         #remove handlers of the previous recipe
-        logger.removeHandler(self.recipe_handlers[0])
-        logger.removeHandler(self.recipe_handlers[1])
+        self.unset_recipe()
 
+        logger = logging.getLogger()
         self.recipe_handlers = (recipe_info, recipe_debug)
         logger.addHandler(recipe_info)
         logger.addHandler(recipe_debug)
 
     def unset_recipe(self):
         logger = logging.getLogger()
-        logger.removeHandler(self.recipe_handlers[0])
-        logger.removeHandler(self.recipe_handlers[1])
+        for handler in self.recipe_handlers:
+            if handler is not None:
+                logger.removeHandler(handler)
+                handler.close()
         self.recipe_handlers = (None, None)
 
     def add_slave(self, slave_id):
@@ -196,8 +419,9 @@ class LoggingCtl:
         logger = logging.getLogger(slave_id)
         logger.propagate = False
 
-        logger.removeHandler(self.slaves[slave_id][0])
-        logger.removeHandler(self.slaves[slave_id][1])
+        for handler in self.slaves[slave_id]:
+            logger.removeHandler(handler)
+            handler.close()
 
         del self.slaves[slave_id]
 
@@ -214,6 +438,7 @@ class LoggingCtl:
         self.transmit_handler = TransmitHandler(target)
 
         self.transmit_handler.set_origin_name(self._origin_name)
+        self.transmit_handler.set_job_id(self._job_id)
 
         logger = logging.getLogger()
         logger.addHandler(self.transmit_handler)
@@ -247,11 +472,13 @@ class LoggingCtl:
         os.makedirs(path)
 
     def _create_file_handler(self, folder_path):
-        file_debug = logging.FileHandler(os.path.join(folder_path, 'debug'))
+        file_debug = RotatingLogHandler(os.path.join(folder_path, 'debug'),
+                                        self._max_bytes, self._backup_count)
         file_debug.setFormatter(MultilineFormatter())
         file_debug.setLevel(logging.DEBUG)
 
-        file_info = logging.FileHandler(os.path.join(folder_path, 'info'))
+        file_info = RotatingLogHandler(os.path.join(folder_path, 'info'),
+                                       self._max_bytes, self._backup_count)
         file_info.setFormatter(MultilineFormatter())
         file_info.setLevel(logging.INFO)
 
@@ -265,5 +492,11 @@ class LoggingCtl:
         if self.transmit_handler != None:
             self.transmit_handler.set_origin_name(name)
 
+    def set_job_id(self, job_id):
+        """tags the records sent over the connection with the job id"""
+        self._job_id = job_id
+        if self.transmit_handler != None:
+            self.transmit_handler.set_job_id(job_id)
+
     def print_log_dir(self):
         logging.info("Logs are stored in '%s'" % self.log_folder)
@@ -406,10 +406,12 @@ class NetTestCommandExec(NetTestCommandGeneric):
         try:
             if "from" in self._command:
                 stdout, stderr = self.exec_from(self._command["from"],
-                                                self._command["command"])
+                                                self._command["command"],
+                                                timeout=0)
             else:
                 json = True if "json" in self._command else False
-                stdout, stderr = self.exec_cmd(self._command["command"], json=json)
+                stdout, stderr = self.exec_cmd(self._command["command"], json=json,
+                                               timeout=0)
             res_data = {"stdout": stdout, "stderr": stderr}
             self.set_pass(res_data)
         except ExecCmdFail as e:
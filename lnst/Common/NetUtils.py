@@ -14,6 +14,8 @@ import re
 import socket
 import subprocess
 from pyroute2 import IPRoute
+from lnst.Common.LnstError import LnstError
+from lnst.Common.IpAddress import IpAddress
 
 
 def normalize_hwaddr(hwaddr):
@@ -97,56 +99,93 @@ def get_corespond_local_ip(query_ip):
 
 
 class AddressPool:
+    """Hands out consecutive addresses from the start-end range
+
+    Addresses are kept as integers, so single addresses as well as
+    contiguous ranges are allocated in constant time.
+    """
     def __init__(self, start, end):
-        self._next = self._addr_to_byte_string(start)
-        self._final = self._addr_to_byte_string(end)
-
-    def _inc_byte_string(self, byte_string):
-        if len(byte_string):
-            byte_string[-1] += 1
-            if byte_string[-1] > 255:
-                del byte_string[-1]
-                self._inc_byte_string(byte_string)
-                byte_string.append(0)
-
-    def _addr_to_byte_string(self, addr):
+        self._next = self._addr_to_int(start)
+        self._final = self._addr_to_int(end)
+
+    def _addr_to_int(self, addr):
         pass
 
-    def _byte_string_to_addr(self, byte_string):
+    def _int_to_addr(self, num):
         pass
 
+    def available(self):
+        """returns the number of addresses left"""
+        return max(0, self._final - self._next + 1)
+
     def get_addr(self):
         if self._next > self._final:
             msg = "Pool exhausted, no free addresses available"
             raise Exception(msg)
 
-        addr_str = self._byte_string_to_addr(self._next)
-        self._inc_byte_string(self._next)
+        addr_str = self._int_to_addr(self._next)
+        self._next += 1
 
         return addr_str
 
+    def _alloc(self, count):
+        if count < 1:
+            raise Exception("Invalid number of addresses %s" % count)
+        if self._next + count - 1 > self._final:
+            msg = "Pool exhausted, %d free addresses not available" % count
+            raise Exception(msg)
+
+        first = self._next
+        self._next += count
+        return first
+
+    def get_range(self, count):
+        """allocates count consecutive addresses
+
+        Returns the tuple of the first and the last address of the range.
+        """
+        first = self._alloc(count)
+        return self._int_to_addr(first), self._int_to_addr(first + count - 1)
+
+    def get_addrs(self, count):
+        """allocates count consecutive addresses and returns their list"""
+        first = self._alloc(count)
+        return [self._int_to_addr(first + i) for i in xrange(count)]
+
+    def split(self, count):
+        """allocates count consecutive addresses as a new pool"""
+        first, last = self.get_range(count)
+        return self.__class__(first, last)
+
 
 class MacPool(AddressPool):
-    def _addr_to_byte_string(self, addr):
+    def _addr_to_int(self, addr):
         if not verify_mac_address(addr):
             raise Exception("Invalid MAC address")
 
-        bs = [int(byte, 16) for byte in addr.split(":")]
-
-        return bs
+        return int(addr.replace(":", ""), 16)
 
-    def _byte_string_to_addr(self, byte_string):
-        return ':'.join(map(lambda x: "%02x" % x, byte_string))
+    def _int_to_addr(self, num):
+        digits = "%012x" % num
+        return ':'.join([digits[i:i+2] for i in range(0, 12, 2)])
 
 
 class IpPool(AddressPool):
-    def _addr_to_byte_string(self, addr):
-        if not verify_ip_address(addr):
+    """Pool of IPv4 or IPv6 addresses, returned as strings"""
+    def __init__(self, start, end):
+        try:
+            start = IpAddress(start)
+            end = IpAddress(end)
+        except LnstError:
             raise Exception("Invalid IP address")
+        if start.family != end.family:
+            raise Exception("IP addresses of different families")
 
-        bs = [int(byte) for byte in addr.split(".")]
+        self._addr_cls = type(start)
+        AddressPool.__init__(self, start, end)
 
-        return bs
+    def _addr_to_int(self, addr):
+        return int(addr)
 
-    def _byte_string_to_addr(self, byte_string):
-        return '.'.join(map(str, byte_string))
+    def _int_to_addr(self, num):
+        return str(self._addr_cls(num))
@@ -12,11 +12,73 @@ rpazdera@redhat.com (Radek Pazdera)
 
 import subprocess
 import os
+import re
+import glob
+import gzip
+import stat
+import struct
+import logging
+from lnst.Common.ExecCmd import exec_cmd
+
+#pcap magic numbers and their timestamp resolution
+PCAP_MAGICS = {0xa1b2c3d4: 1e-6,
+               0xa1b23c4d: 1e-9}
+
+PCAP_HDR_LEN = 24
+PCAP_REC_HDR_LEN = 16
+
+def pcap_records(file_path):
+    """ Generator of the records of a (possibly gzipped) pcap
+        file. Yields tuples (global_header, timestamp, record),
+        where record includes the record header. A truncated
+        last record (file still being written) is ignored.
+    """
+    if file_path.endswith(".gz"):
+        f = gzip.open(file_path, "rb")
+    else:
+        f = open(file_path, "rb")
+
+    try:
+        hdr = f.read(PCAP_HDR_LEN)
+        if len(hdr) < PCAP_HDR_LEN:
+            return
+
+        for endian in ["<", ">"]:
+            magic = struct.unpack(endian + "I", hdr[:4])[0]
+            if magic in PCAP_MAGICS:
+                break
+        else:
+            logging.warning("%s is not a pcap file" % file_path)
+            return
+        resolution = PCAP_MAGICS[magic]
+        rec_hdr_fmt = endian + "IIII"
+
+        while True:
+            rec_hdr = f.read(PCAP_REC_HDR_LEN)
+            if len(rec_hdr) < PCAP_REC_HDR_LEN:
+                return
+            ts_sec, ts_frac, incl_len, _ = struct.unpack(rec_hdr_fmt,
+                                                         rec_hdr)
+            data = f.read(incl_len)
+            if len(data) < incl_len:
+                return
+            yield hdr, ts_sec + ts_frac * resolution, rec_hdr + data
+    except IOError as e:
+        #gzip raises IOError for a file that's still being compressed
+        logging.debug("Stopped reading %s: %s" % (file_path, str(e)))
+    finally:
+        f.close()
 
 class PacketCapture:
     """ Capture/handle traffic that goes through a specific
         network interface. Capturing backend of this class
         is provided by tcpdump(8).
+
+        In ring mode tcpdump writes into a bounded ring of
+        files of a fixed size that are compressed as soon
+        as they're rotated out, so the capture can run for
+        an unlimited time. Packets from a time window can be
+        extracted from the ring with extract().
     """
 
     _cmd = ""
@@ -26,16 +88,36 @@ class PacketCapture:
     _file    = None
     _filter  = None
 
+    _ring_file_size = None
+    _ring_file_count = None
+
     def set_interface(self, devname):
         self._devname = devname
 
     def set_output_file(self, file_path):
+        """ In ring mode the file path is used as the prefix
+            of the ring files.
+        """
         self._file = file_path
 
     def set_filter(self, filt):
         self._filter = filt
 
+    def set_ring(self, file_size, file_count):
+        """ Enable ring mode
+
+            file_size -- size of a single ring file in MB
+            file_count -- number of files in the ring
+        """
+        self._ring_file_size = int(file_size)
+        self._ring_file_count = int(file_count)
+
+    def is_ring(self):
+        return self._ring_file_count is not None
+
     def start(self):
+        if self.is_ring():
+            self._create_rotate_helper()
         self._run()
 
     def stop(self):
@@ -50,8 +132,13 @@ class PacketCapture:
         output_file = self._file
         pcap_filter = self._filter
 
-        self._cmd = "tcpdump -p -i %s -w %s %s" % \
-                            (interface, output_file, pcap_filter)
+        self._cmd = "tcpdump -p -i %s -w %s" % (interface, output_file)
+        if self.is_ring():
+            self._cmd += " -C %d -W %d -z %s" % (self._ring_file_size,
+                                                 self._ring_file_count,
+                                                 self._rotate_helper_path())
+        if pcap_filter:
+            self._cmd += " %s" % pcap_filter
 
     def _execute_tcpdump(self):
         """ Start tcpdump in the background """
@@ -63,3 +150,88 @@ class PacketCapture:
     def _run(self):
         self._compose_cmd()
         self._execute_tcpdump()
+
+    def _rotate_helper_path(self):
+        return self._file + ".rotate"
+
+    def _create_rotate_helper(self):
+        """ tcpdump -z accepts only a command name, so gzip is
+            wrapped in a script that overwrites the compressed
+            file from the previous pass of the ring.
+        """
+        path = self._rotate_helper_path()
+        with open(path, "w") as f:
+            f.write("#!/bin/sh\nexec gzip -f \"$1\"\n")
+        os.chmod(path, stat.S_IRWXU | stat.S_IRGRP | stat.S_IXGRP |
+                       stat.S_IROTH | stat.S_IXOTH)
+
+    def get_files(self):
+        """ Returns capture files ordered from the oldest """
+        if not self.is_ring():
+            return [self._file]
+
+        ring_re = re.compile(re.escape(self._file) + r"\d+(\.gz)?$")
+        files = [f for f in glob.glob(self._file + "*") if ring_re.match(f)]
+        return sorted(files, key=lambda f: os.stat(f).st_mtime)
+
+    def extract(self, output_file, start=None, end=None, filt=None):
+        """ Write the captured packets from the time window
+            [start, end] (unix timestamps, None means unbounded)
+            that match the BPF filter into a gzipped pcap file.
+
+            Returns the number of packets written before
+            applying the BPF filter.
+        """
+        merged_file = output_file + ".merged"
+        filtered_file = output_file + ".filtered"
+        count = 0
+        global_hdr = None
+        try:
+            with open(merged_file, "wb") as out:
+                for fname in self.get_files():
+                    for hdr, ts, record in pcap_records(fname):
+                        if global_hdr is None:
+                            global_hdr = hdr
+                            out.write(hdr)
+                        elif hdr != global_hdr:
+                            logging.warning("Skipping %s, incompatible pcap "
+                                            "header" % fname)
+                            break
+                        if start is not None and ts < start:
+                            continue
+                        if end is not None and ts > end:
+                            continue
+                        out.write(record)
+                        count += 1
+
+            if filt and global_hdr is not None:
+                exec_cmd("tcpdump -r %s -w %s %s" % (merged_file,
+                                                     filtered_file, filt))
+                os.rename(filtered_file, merged_file)
+
+            with open(merged_file, "rb") as src:
+                dst = gzip.open(output_file, "wb")
+                try:
+                    while True:
+                        data = src.read(1024*1024)
+                        if not data:
+                            break
+                        dst.write(data)
+                finally:
+                    dst.close()
+        finally:
+            for fname in [merged_file, filtered_file]:
+                if os.path.exists(fname):
+                    os.unlink(fname)
+        return count
+
+    def cleanup(self):
+        """ Remove all files of the capture """
+        files = self.get_files()
+        if self.is_ring():
+            files.append(self._rotate_helper_path())
+        for fname in files:
+            try:
+                os.unlink(fname)
+            except OSError:
+                pass
@@ -78,20 +78,24 @@ class StrParam(Param):
 class IpParam(Param):
     @Param.val.setter
     def val(self, value):
-        #runtime import this because the Device class arrives on the Slave
-        #during recipe execution, not during Slave init
-        from lnst.Devices.Device import Device
         if isinstance(value, BaseIpAddress):
             self._val = value
-        elif isinstance(value, str):
+        elif isinstance(value, basestring):
             self._val = IpAddress(value)
-        elif isinstance(value, Device):
+        elif self._is_device(value):
             self.val = value.ips[0]
         else:
             raise ParamError("Value must be a BaseIpAddress, string or Device object."
                              "Not {}".format(type(value)))
         self.set = True
 
+    @staticmethod
+    def _is_device(value):
+        #runtime import this because the Device class arrives on the Slave
+        #during recipe execution, not during Slave init
+        from lnst.Devices.Device import Device
+        return isinstance(value, Device)
+
 class DeviceParam(Param):
     @Param.val.setter
     def val(self, value):
@@ -111,25 +115,21 @@ class DeviceParam(Param):
         return newone
 
 class Parameters(object):
-    def __getattribute__(self, name):
+    def __getattr__(self, name):
         """
-        Overriding the default __getattribute__ method is important for being
-        able to deepcopy a Parameters object while also allowing to return None
-        for undefined Parameter names. This is because the copy module relies
-        on an exception being raised for certain private attributes and
-        returning None would break it.
+        Only called when the normal attribute lookup fails, this allows
+        returning None for undefined Parameter names without slowing down the
+        access to defined Parameters. Private attributes still raise
+        AttributeError because the copy module relies on it to be able to
+        deepcopy a Parameters object.
         """
-        if name[:2] == "__" or name[:1] == "_":
-            return object.__getattribute__(self, name)
-
-        try:
-            return object.__getattribute__(self, name)
-        except:
-            return None
+        if name[:1] == "_":
+            raise AttributeError(name)
+        return None
 
     def __iter__(self):
-        for attr in dir(self):
-            val = getattr(self, attr)
+        #Params are always instance attributes, sorted as dir() used to be
+        for attr, val in sorted(self.__dict__.items()):
             if isinstance(val, Param):
                 yield (attr, val)
 
@@ -150,8 +150,6 @@ class Parameters(object):
 
     def __str__(self):
         result = ""
-        for attr in dir(self):
-            val = getattr(self, attr)
-            if isinstance(val, Param):
-                result += "%s = %s\n" % (attr, str(val))
+        for attr, val in self:
+            result += "%s = %s\n" % (attr, str(val))
         return result
@@ -1,5 +1,5 @@
 """
-ShellProcess class.
+ProcessManager class.
 
 Copyright 2011 Red Hat, Inc.
 Licensed under the GNU General Public License, version 2 as
@@ -9,86 +9,139 @@ published by the Free Software Foundation; see COPYING for details.
 __autor__ = """
 jzupka@redhat.com (Jiri Zupka)
 """
-import os, signal, thread, logging
+import os, signal, time, errno, logging, threading
 
 class ProcessManager:
+    """Reaps registered child processes and calls their exit handlers
+
+    A single reaper thread polls all registered pids with WNOHANG, so only
+    the registered children are reaped and other users of os.waitpid
+    (subprocess, multiprocessing) aren't affected. A SIGCHLD handler isn't
+    used as it would interrupt sleep and select calls of the main thread.
+
+    Exit handlers are called from the reaper thread. Statuses of the
+    registered pids have to be read with ProcessManager.waitpid.
+    """
     class SubProcess:
         def __init__(self, pid, handler):
             self.pid = pid
-            self.lock = thread.allocate_lock()
-            self.lock.acquire()
             self.handler = handler
             self.enabled = True
             self.status = None
-            thread.start_new_thread(self.waitpid, (self.pid, self.lock,
-                                                   self.handler))
+            self.finished = threading.Event()
 
         def isAlive(self):
-            return self.lock.locked()
+            return not self.finished.is_set()
 
         def kill(self):
             os.kill(self.pid, signal.SIGTERM)
 
-        def waitpid(self, pid, lock, handler):
-            _pid, status = ProcessManager.std_waitpid(pid, 0)
+        def poll(self):
+            """reaps the process if it exited, returns True if it did"""
+            try:
+                pid, status = os.waitpid(self.pid, os.WNOHANG)
+            except OSError as e:
+                if e.errno != errno.ECHILD:
+                    raise
+                logging.debug("Process pid %s was reaped elsewhere" %
+                              self.pid)
+                pid, status = self.pid, 0
+
+            if pid == 0:
+                return False
             self.status = status
-            status = os.WEXITSTATUS(status)
-            lock.release()
-            if self.enabled:
-                ProcessManager.lock.acquire()
-                if handler is not None:
-                    try:
-                        handler(status)
-                    except:
-                        import sys, traceback
-                        type, value, tb = sys.exc_info()
-                        logging.error(''.join(traceback.format_exception(type, value, tb)))
-                        os.kill(os.getpid(), signal.SIGTERM)
-                else:
-                    print "Process pid %s exit with exitcode %s" % (pid, status)
-                ProcessManager.lock.release()
-            thread.exit()
+            self.finished.set()
+            return True
+
+        def dispatch(self):
+            if not self.enabled:
+                return
+
+            status = os.WEXITSTATUS(self.status)
+            if self.handler is not None:
+                try:
+                    self.handler(status)
+                except:
+                    import sys, traceback
+                    type, value, tb = sys.exc_info()
+                    logging.error(''.join(traceback.format_exception(type, value, tb)))
+                    os.kill(os.getpid(), signal.SIGTERM)
+            else:
+                print "Process pid %s exit with exitcode %s" % (self.pid, status)
 
     pids = {}
-    lock = thread.allocate_lock()
-    std_waitpid = None
+    lock = threading.Lock()
+    poll_interval = 0.05
+    _wakeup = threading.Condition(lock)
+    _reaper = None
+    _owner = None
+
+    @classmethod
+    def _check_fork(cls):
+        """resets the state inherited by a forked child"""
+        if cls._owner == os.getpid():
+            return
+        cls._owner = os.getpid()
+        cls.pids = {}
+        cls.lock = threading.Lock()
+        cls._wakeup = threading.Condition(cls.lock)
+        cls._reaper = None
 
     @classmethod
     def register_pid(cls, pid, handler=None):
-        cls.pids[pid] = ProcessManager.SubProcess(pid, handler)
+        cls._check_fork()
+        with cls.lock:
+            cls.pids[pid] = ProcessManager.SubProcess(pid, handler)
+            if cls._reaper is None:
+                cls._reaper = threading.Thread(target=cls._reap_loop,
+                                               name="ProcessManager")
+                cls._reaper.daemon = True
+                cls._reaper.start()
+            cls._wakeup.notify()
 
     @classmethod
     def remove_pid(cls, pid):
+        cls._check_fork()
         if pid in cls.pids:
             cls.pids[pid].enabled = False
 
     @classmethod
     def kill_all(cls):
-        for pid in cls.pids:
-            cls.pids[pid].kill()
+        cls._check_fork()
+        for proc in cls.pids.values():
+            if proc.isAlive():
+                proc.kill()
+
+    @classmethod
+    def _reap_loop(cls):
+        while True:
+            with cls.lock:
+                running = [proc for proc in cls.pids.values()
+                           if proc.isAlive()]
+                if len(running) == 0:
+                    cls._wakeup.wait()
+                    continue
+
+            exited = [proc for proc in running if proc.poll()]
+            for proc in exited:
+                proc.dispatch()
+
+            if len(exited) == 0:
+                time.sleep(cls.poll_interval)
 
     @classmethod
-    def waitpid(cls, pid, wait):
+    def waitpid(cls, pid, options):
+        """os.waitpid replacement aware of the registered pids"""
+        cls._check_fork()
         if pid not in cls.pids:
-            return ProcessManager.std_waitpid(pid, wait)
-        if not wait:
-            cls.pids[pid].lock.acquire()
-            cls.pids[pid].lock.release()
-            status = cls.pids[pid].status
-            del cls.pids[pid]
-            return pid, status
-        else:
-            status = cls.pids[pid].status
-            if status is not None:
-                del cls.pids[pid]
-            else:
-                pid = 0
-            return pid, status
+            return os.waitpid(pid, options)
 
+        proc = cls.pids[pid]
+        if not options & os.WNOHANG:
+            proc.finished.wait()
+        elif not proc.finished.is_set():
+            return 0, 0
 
-lock = thread.allocate_lock()
-lock.acquire()
-if os.waitpid != ProcessManager.waitpid:
-    ProcessManager.std_waitpid = os.waitpid
-    os.waitpid = ProcessManager.waitpid
-lock.release()
\ No newline at end of file
+        with cls.lock:
+            cls.pids.pop(pid, None)
+        return pid, proc.status
@@ -20,6 +20,7 @@ import cPickle
 import hashlib
 import hmac
 from lnst.Common.Utils import not_imported
+from lnst.Common.DeviceRef import DeviceRef, encode_payload, decode_payload
 from lnst.Common.LnstError import LnstError
 
 DH_GROUP = {"p": int("0xFFFFFFFFFFFFFFFFC90FDAA22168C234C4C6628B80DC1CD1"\
@@ -127,10 +128,14 @@ def cryptography_imports():
         raise SecSocketException("Library 'cryptography' missing "\
                                  "can't establish secure channel.")
 
+CHANGE_CIPHER_SPEC_MSG = encode_payload({"type": "change_cipher_spec"})
+
 class SecureSocket(object):
     def __init__(self, soc):
         self._role = None
         self._socket = soc
+        self._persistent_id = None
+        self._resolve = DeviceRef
 
         self._master_secret = ""
 
@@ -150,15 +155,27 @@ class SecureSocket(object):
                                 "mac_key": None,
                                 "seq_num": 0}
 
+    def set_device_encoding(self, persistent_id=None, resolve=DeviceRef):
+        """sets how devices in the messages are encoded
+
+        Args:
+            persistent_id -- see lnst.Common.DeviceRef.device_persistent_id,
+                devices of sent messages are encoded by it
+            resolve -- function translating the if_index of devices of
+                received messages
+        """
+        self._persistent_id = persistent_id
+        self._resolve = resolve
+
     def send_msg(self, msg):
-        pickled_msg = cPickle.dumps(msg)
+        pickled_msg = encode_payload(msg, self._persistent_id)
         return self.send(pickled_msg)
 
     def recv_msg(self):
         pickled_msg = self.recv()
         if pickled_msg == "":
             raise SecSocketException("Disconnected")
-        msg = cPickle.loads(pickled_msg)
+        msg = decode_payload(pickled_msg, self._resolve)
         return msg
 
     def _add_mac_sign(self, data):
@@ -172,7 +189,7 @@ class SecureSocket(object):
                              hashlib.sha256)
         signed_msg = {"data": data,
                       "signature": signature.digest()}
-        return cPickle.dumps(signed_msg)
+        return cPickle.dumps(signed_msg, cPickle.HIGHEST_PROTOCOL)
 
     def _del_mac_sign(self, signed_data):
         if not self._current_read_spec["mac_key"]:
@@ -232,7 +249,7 @@ class SecureSocket(object):
         encrypted_msg = {"iv": iv,
                          "enc_data": encrypted_data}
 
-        return cPickle.dumps(encrypted_msg)
+        return cPickle.dumps(encrypted_msg, cPickle.HIGHEST_PROTOCOL)
 
     def _del_encrypt(self, data):
         if not self._current_read_spec["enc_key"]:
@@ -292,14 +309,16 @@ class SecureSocket(object):
                 return ""
             else:
                 length += c
-        data = ""
-
-        while len(data) < length:
-            c = self._socket.recv(length - len(data))
+        chunks = []
+        received = 0
+        while received < length:
+            c = self._socket.recv(length - received)
             if c == "":
                 return ""
             else:
-                data += c
+                chunks.append(c)
+                received += len(c)
+        data = "".join(chunks)
 
         msg = self._uprotect_data(data)
         if msg is None:
@@ -307,19 +326,15 @@ class SecureSocket(object):
         return self._handle_internal(msg)
 
     def _handle_internal(self, orig_msg):
-        try:
-            msg = cPickle.loads(orig_msg)
-        except:
-            return orig_msg
-        if "type" in msg and msg["type"] == "change_cipher_spec":
+        #compared as encoded, unpickling every message twice is expensive
+        if orig_msg == CHANGE_CIPHER_SPEC_MSG:
             self._change_read_cipher_spec()
             return self.recv()
         else:
             return orig_msg
 
     def _send_change_cipher_spec(self):
-        change_cipher_spec_msg = {"type": "change_cipher_spec"}
-        self.send_msg(change_cipher_spec_msg)
+        self.send(CHANGE_CIPHER_SPEC_MSG)
         self._change_write_cipher_spec()
         return
 
@@ -155,9 +155,9 @@ class ShellProcess:
             pid = 0
             status = 0
             if infinite:
-                pid, status = os.waitpid(self.pid, 0)
+                pid, status = ProcessManager.waitpid(self.pid, 0)
             else:
-                pid, status = os.waitpid(self.pid, os.WNOHANG)
+                pid, status = ProcessManager.waitpid(self.pid, os.WNOHANG)
             if pid == self.pid:
                 self.status = os.WEXITSTATUS(status)
         return self.status
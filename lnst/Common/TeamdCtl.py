@@ -0,0 +1,161 @@
+"""
+This module defines the TeamdCtl class that controls a running teamd
+instance through its Unix domain control socket, the same interface
+teamdctl uses, over a single persistent connection.
+
+Copyright 2017 Red Hat, Inc.
+Licensed under the GNU General Public License, version 2 as
+published by the Free Software Foundation; see COPYING for details.
+"""
+
+import os
+import re
+import json
+import errno
+import fcntl
+import select
+import socket
+import struct
+import termios
+import logging
+from lnst.Common.LnstError import LnstError
+
+TEAMD_RUN_DIR = "/var/run/teamd"
+
+REQUEST_PREFIX = "REQUEST"
+REPLY_SUCCESS_PREFIX = "REPLY_SUCCESS"
+REPLY_ERROR_PREFIX = "REPLY_ERROR"
+
+class TeamdCtlError(LnstError):
+    pass
+
+def compact_json(json_str):
+    """returns the JSON string on a single line
+
+    The control socket protocol is line based, so arguments can't contain
+    newlines.
+    """
+    if not json_str:
+        return "{}"
+    if not isinstance(json_str, basestring):
+        return json.dumps(json_str)
+    try:
+        return json.dumps(json.loads(json_str))
+    except ValueError:
+        return re.sub(r'\s+', ' ', json_str).strip()
+
+class TeamdCtl(object):
+    """Connection to the control socket of the teamd of one team device
+
+    The connection is opened on the first call and kept open, it's
+    reopened once if teamd closed it (e.g. after a restart).
+    """
+    def __init__(self, team_name, timeout=10):
+        self._team_name = team_name
+        self._timeout = timeout
+        self._sock = None
+
+    def get_socket_path(self):
+        return os.path.join(TEAMD_RUN_DIR, "%s.sock" % self._team_name)
+
+    def _connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+        try:
+            sock.connect(self.get_socket_path())
+        except socket.error as e:
+            sock.close()
+            raise TeamdCtlError("Unable to connect to teamd of %s: %s" %
+                                (self._team_name, str(e)))
+        self._sock = sock
+
+    def close(self):
+        if self._sock is not None:
+            self._sock.close()
+            self._sock = None
+
+    def _recv_msg(self):
+        rl, _, _ = select.select([self._sock], [], [], self._timeout)
+        if not rl:
+            raise TeamdCtlError("Timeout waiting for teamd of %s" %
+                                self._team_name)
+        #the whole reply is a single packet, read it at once
+        buf = fcntl.ioctl(self._sock.fileno(), termios.FIONREAD,
+                          struct.pack("i", 0))
+        size = struct.unpack("i", buf)[0]
+        return self._sock.recv(max(size, 4096))
+
+    def _request(self, method, args):
+        msg = "%s\n%s\n" % (REQUEST_PREFIX, method)
+        for arg in args:
+            arg = str(arg)
+            if "\n" in arg:
+                raise TeamdCtlError("teamd arguments can't contain newlines")
+            msg += "%s\n" % arg
+
+        if self._sock is None:
+            self._connect()
+        self._sock.sendall(msg)
+        reply = self._recv_msg()
+        if not reply:
+            raise socket.error(errno.ECONNRESET, "Connection closed by teamd")
+        return reply
+
+    def call(self, method, *args):
+        """calls a teamd control method and returns its reply string"""
+        try:
+            reply = self._request(method, args)
+        except socket.error as e:
+            logging.debug("teamd control connection of %s lost (%s), "
+                          "reconnecting" % (self._team_name, str(e)))
+            self.close()
+            try:
+                reply = self._request(method, args)
+            except socket.error as e:
+                self.close()
+                raise TeamdCtlError("teamd of %s is not responding: %s" %
+                                    (self._team_name, str(e)))
+
+        lines = reply.split("\n")
+        if lines[0] == REPLY_SUCCESS_PREFIX:
+            return "\n".join(lines[1:]).rstrip("\n")
+        elif lines[0] == REPLY_ERROR_PREFIX:
+            err = ": ".join([l for l in lines[1:] if l])
+            raise TeamdCtlError("teamd %s call %s failed: %s" %
+                                (self._team_name, method, err))
+        else:
+            raise TeamdCtlError("Invalid reply from teamd of %s" %
+                                self._team_name)
+
+    def _call_json(self, method, *args):
+        reply = self.call(method, *args)
+        try:
+            return json.loads(reply)
+        except ValueError:
+            raise TeamdCtlError("Invalid JSON reply from teamd of %s" %
+                                self._team_name)
+
+    def config_dump(self, actual=False):
+        if actual:
+            return self._call_json("ConfigDumpActual")
+        return self._call_json("ConfigDump")
+
+    def state_dump(self):
+        return self._call_json("StateDump")
+
+    def state_item_get(self, item):
+        return self.call("StateItemValueGet", item)
+
+    def state_item_set(self, item, value):
+        self.call("StateItemValueSet", item, value)
+
+    def port_add(self, port_name):
+        self.call("PortAdd", port_name)
+
+    def port_remove(self, port_name):
+        self.call("PortRemove", port_name)
+
+    def port_config_update(self, port_name, port_config):
+        self.call("PortConfigUpdate", port_name, compact_json(port_config))
+
+    def port_config_dump(self, port_name):
+        return self._call_json("PortConfigDump", port_name)
@@ -16,7 +16,6 @@ import re
 import os
 import hashlib
 import tempfile
-import subprocess
 import errno
 import ast
 import collections
@@ -167,13 +166,44 @@ def _is_newer_than(f, threshold):
     stat = os.stat(f)
     return stat.st_mtime > threshold
 
+#names of the running processes, shared by all check_process_running calls
+#made within _PROC_SCAN_MAX_AGE seconds
+_PROC_SCAN_MAX_AGE = 1.0
+_proc_scan = {"time": None, "names": []}
+
+def _running_process_names():
+    now = time.time()
+    if _proc_scan["time"] is not None and \
+       0 <= now - _proc_scan["time"] < _PROC_SCAN_MAX_AGE:
+        return _proc_scan["names"]
+
+    names = []
+    for pid in os.listdir("/proc"):
+        if not pid.isdigit():
+            continue
+        try:
+            with open("/proc/%s/comm" % pid) as f:
+                names.append(f.read().rstrip("\n"))
+        except IOError:
+            #the process exited in the meantime
+            continue
+
+    _proc_scan["time"] = now
+    _proc_scan["names"] = names
+    return names
+
 def check_process_running(process_name):
-    try:
-        proc = subprocess.check_call(["pgrep", process_name],
-                stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
-        return True
-    except subprocess.CalledProcessError:
-        return False
+    """
+    Returns True if a process name matches the process_name pattern
+
+    Same semantics as pgrep without options, but the process table is read
+    from /proc and reused for a second.
+    """
+    pattern = re.compile(process_name)
+    for name in _running_process_names():
+        if pattern.search(name):
+            return True
+    return False
 
 def mkdir_p(path):
     try:
@@ -292,17 +322,35 @@ def deprecated(func):
         return func(self, *args, **kwargs)
     return log
 
+def find_program(program):
+    """
+    Returns the path of the program as found in PATH (like which) or None
+    """
+    def is_exe(path):
+        return os.path.isfile(path) and os.access(path, os.X_OK)
+
+    if os.path.dirname(program):
+        if is_exe(program):
+            return program
+        return None
+
+    for path_dir in os.environ.get("PATH", os.defpath).split(os.pathsep):
+        path = os.path.join(path_dir, program)
+        if is_exe(path):
+            return path
+    return None
+
+_installed_programs = {}
+
 def is_installed(program):
     """
-    Returns True if program is detected by which, False otherwise
+    Returns True if program is found in PATH, False otherwise
+
+    The result is cached for the lifetime of the process.
     """
-    cmd = "which %s" % program
-    try:
-        subprocess.check_call(cmd, shell=True, stdout=subprocess.PIPE,
-                              stderr=subprocess.PIPE)
-        return True
-    except subprocess.CalledProcessError:
-        return False
+    if program not in _installed_programs:
+        _installed_programs[program] = find_program(program) is not None
+    return _installed_programs[program]
 
 def indent(string, spaces):
     ret_str = []
@@ -44,6 +44,16 @@ class CtlConfig(Config):
                 "additive" : False,
                 "action" : self.optionPath,
                 "name" : "log_dir"}
+        self._options['environment']['log_max_size'] = {\
+                "value" : 100 * 1024**2,
+                "additive" : False,
+                "action" : self.optionSize,
+                "name" : "log_max_size"}
+        self._options['environment']['log_backup_count'] = {\
+                "value" : 0,
+                "additive" : False,
+                "action" : self.optionInt,
+                "name" : "log_backup_count"}
         self._options['environment']['resource_dir'] = {\
                 "value" : "",
                 "additive" : False,
@@ -62,6 +72,19 @@ class CtlConfig(Config):
                 "name" : "allow_virtual"
                 }
 
+        self._options['environment']['pool_cache'] = {
+                "value" : True,
+                "additive" : False,
+                "action" : self.optionBool,
+                "name" : "pool_cache"
+                }
+        self._options['environment']['pool_cache_dir'] = {\
+                "value" : os.path.expanduser("~/.lnst/pool_cache"),
+                "additive" : False,
+                "action" : self.optionPath,
+                "name" : "pool_cache_dir"
+                }
+
         self._options['perfrepo'] = dict()
         self._options['perfrepo']['url'] = {\
                 "value" : "",
@@ -81,6 +104,68 @@ class CtlConfig(Config):
                 "action" : self.optionPlain,
                 "name" : "password"
                 }
+        self._options['perfrepo']['spool_dir'] = {\
+                "value" : os.path.expanduser("~/.lnst/perfrepo_spool"),
+                "additive" : False,
+                "action" : self.optionPath,
+                "name" : "spool_dir"
+                }
+        self._options['perfrepo']['retries'] = {\
+                "value" : 3,
+                "additive" : False,
+                "action" : self.optionInt,
+                "name" : "retries"
+                }
+        self._options['perfrepo']['retry_interval'] = {\
+                "value" : 1.0,
+                "additive" : False,
+                "action" : self.optionFloat,
+                "name" : "retry_interval"
+                }
+
+        self._options['results_store'] = dict()
+        self._options['results_store']['enabled'] = {\
+                "value" : False,
+                "additive" : False,
+                "action" : self.optionBool,
+                "name" : "enabled"
+                }
+        self._options['results_store']['path'] = {\
+                "value" : os.path.expanduser("~/.lnst/results.sqlite"),
+                "additive" : False,
+                "action" : self.optionPath,
+                "name" : "path"
+                }
+        self._options['results_store']['baseline_window'] = {\
+                "value" : 10,
+                "additive" : False,
+                "action" : self.optionInt,
+                "name" : "baseline_window"
+                }
+        self._options['results_store']['regression_test'] = {\
+                "value" : "zscore",
+                "additive" : False,
+                "action" : self.optionPlain,
+                "name" : "regression_test"
+                }
+        self._options['results_store']['zscore_limit'] = {\
+                "value" : 3.0,
+                "additive" : False,
+                "action" : self.optionFloat,
+                "name" : "zscore_limit"
+                }
+        self._options['results_store']['significance'] = {\
+                "value" : 0.05,
+                "additive" : False,
+                "action" : self.optionFloat,
+                "name" : "significance"
+                }
+        self._options['results_store']['tolerance'] = {\
+                "value" : 0.01,
+                "additive" : False,
+                "action" : self.optionFloat,
+                "name" : "tolerance"
+                }
 
         self._options['pools'] = dict()
 
@@ -28,6 +28,7 @@ from lnst.Controller.SlavePoolManager import SlavePoolManager
 from lnst.Controller.MachineMapper import MachineMapper
 from lnst.Controller.Host import Hosts, Host
 from lnst.Controller.Recipe import BaseRecipe
+from lnst.Controller.RecipeScheduler import RecipeScheduler
 
 class Controller(object):
     """The LNST Controller class
@@ -67,7 +68,10 @@ class Controller(object):
                 log_dir=config.get_option('environment','log_dir'),
                 log_subdir=datetime.datetime.now().
                            strftime("%Y-%m-%d_%H:%M:%S"),
-                colours=not config.get_option("colours", "disable_colours"))
+                colours=not config.get_option("colours", "disable_colours"),
+                max_bytes=config.get_option('environment', 'log_max_size'),
+                backup_count=config.get_option('environment',
+                                               'log_backup_count'))
 
         self._msg_dispatcher = MessageDispatcher(self._log_ctl)
 
@@ -115,25 +119,54 @@ class Controller(object):
                                      expand="match_%d" % i)
             i += 1
 
-            self._print_match_description(match)
-            self._map_match(match, req)
-            try:
-                recipe._set_hosts(self._hosts)
-                recipe.test()
-            except Exception as exc:
-                logging.error("Recipe execution terminated by unexpected exception")
-                log_exc_traceback()
-                raise
-            finally:
-                recipe._set_hosts(None)
-                for machine in self._machines.values():
-                    machine.restore_system_config()
-                self._cleanup_slaves()
+            self._run_match(recipe, match)
+
+    def run_queue(self, recipes, max_parallel=0, **kwargs):
+        """Execute a queue of Recipes, concurrently where possible
+
+        Recipes are started in the queue order as soon as the Mapper finds
+        them a match on machines that aren't used by the already running
+        Recipes. Each Recipe runs in its own process with its own log
+        directory, exceptions raised by a Recipe don't stop the queue.
 
-    def _map_match(self, match, requested):
+        Args:
+            recipes -- list of instantiated Recipe objects
+            max_parallel -- maximum number of Recipes running at the same
+                time, 0 (default) means no limit
+            kwargs -- optional keyword arguments passed to the configured
+                Mapper, multimatch is ignored
+        Returns:
+            list of RecipeRun objects describing the results, in the order
+            of the recipes argument
+        """
+        for recipe in recipes:
+            if not isinstance(recipe, BaseRecipe):
+                raise ControllerError("recipes must be BaseRecipe instances.")
+
+        scheduler = RecipeScheduler(self, max_parallel)
+        return scheduler.run(recipes, **kwargs)
+
+    def _run_match(self, recipe, match, pool=None):
+        self._print_match_description(match)
+        self._map_match(match, recipe.req, pool)
+        try:
+            recipe._set_hosts(self._hosts)
+            recipe.test()
+        except Exception as exc:
+            logging.error("Recipe execution terminated by unexpected exception")
+            log_exc_traceback()
+            raise
+        finally:
+            recipe._set_hosts(None)
+            for machine in self._machines.values():
+                machine.restore_system_config()
+            self._cleanup_slaves()
+
+    def _map_match(self, match, requested, pool=None):
         self._machines = {}
         self._hosts = Hosts()
-        pool = self._pools.get_machine_pool(match["pool_name"])
+        if pool is None:
+            pool = self._pools.get_machine_pool(match["pool_name"])
         for m_id, m in match["machines"].items():
             machine = self._machines[m_id] = pool[m["target"]]
 
@@ -147,11 +180,13 @@ class Controller(object):
 
             if match["virtual"]:
                 req_host = getattr(requested, m_id)
+                virt_devs = []
                 for name, dev in req_host:
                     new_virt_dev = VirtualDevice(network=dev.label,
                                                  driver=dev.params.driver,
                                                  hwaddr=dev.params.hwaddr)
-                    setattr(host, name, new_virt_dev)
+                    virt_devs.append((name, new_virt_dev))
+                host._add_virtual_devices(virt_devs)
 
     def _prepare_machine(self, machine):
         self._log_ctl.add_slave(machine.get_id())
@@ -166,7 +201,10 @@ class Controller(object):
             return
 
         for m_id, machine in self._machines.iteritems():
-            machine.cleanup()
+            try:
+                machine.cleanup()
+            finally:
+                machine.close_domain_ctl()
             #clean-up slave logger
             self._log_ctl.remove_slave(m_id)
 
@@ -31,8 +31,7 @@ class Hosts(object):
     in the test() method of a BaseRecipe class as the 'matched' attribute.
     """
     def __iter__(self):
-        for x in dir(self):
-            val = getattr(self, x)
+        for x, val in sorted(self.__dict__.items()):
             if isinstance(val, Host):
                 yield val
 
@@ -46,7 +45,6 @@ class Host(object):
         m1.bond0 = Bond() # to create a new bond device
         m1.run("ip a") # to run a shell command
     """
-    #TODO add packet capture options
     def __init__(self, host, **kwargs):
         self._host = host
         self.params = Parameters()
@@ -81,15 +79,7 @@ class Host(object):
             # msg = "Creating VirtualDevices in recipe execution is "\
                   # "not supported right now."
             # raise HostError(msg)
-            if name in self._device_mapping:
-                raise HostError("Device with name '%s' already assigned." % name)
-
-            value.host = self._host
-            self._host.add_tmp_device(value)
-            value.create()
-            self._host.wait_for_tmp_devices(DEFAULT_TIMEOUT)
-
-            self._device_mapping[name] = value
+            self._add_virtual_devices([(name, value)])
         elif isinstance(value, RemoteDevice):
             if name in self._device_mapping:
                 raise HostError("Device with name '%s' already assigned." % name)
@@ -101,6 +91,27 @@ class Host(object):
         else:
             super(Host, self).__setattr__(name, value)
 
+    def _add_virtual_devices(self, devices):
+        """creates several VirtualDevices at once
+
+        Args:
+            devices -- list of (name, VirtualDevice) tuples
+        All the devices are attached first, then the method waits for the
+        Slave to report all of them.
+        """
+        for name, dev in devices:
+            if name in self._device_mapping:
+                raise HostError("Device with name '%s' already assigned." % name)
+
+        for name, dev in devices:
+            dev.host = self._host
+            self._host.add_tmp_device(dev)
+        VirtualDevice.create_devices([dev for name, dev in devices])
+        self._host.wait_for_tmp_devices(DEFAULT_TIMEOUT)
+
+        for name, dev in devices:
+            self._device_mapping[name] = dev
+
     def _map_device(self, dev_id, how):
         hwaddr = how["hwaddr"]
         dev = self._host.get_dev_by_hwaddr(hwaddr)
@@ -158,3 +169,37 @@ class Host(object):
             #     add job result
 
         return job
+
+    def start_packet_capture(self, filt="", ring_file_size=None,
+                             ring_file_count=None):
+        """starts tcpdump on all devices of the Host
+
+        Args:
+            filt -- BPF filter of the captured packets
+            ring_file_size -- size in MB of one capture file, together with
+                ring_file_count enables the ring buffer mode in which only
+                the last ring_file_size * ring_file_count MB of (compressed)
+                traffic per device is kept on the Slave
+            ring_file_count -- number of files in the ring buffer
+        """
+        return self._host.start_packet_capture(filt, ring_file_size,
+                                               ring_file_count)
+
+    def stop_packet_capture(self):
+        self._host.stop_packet_capture()
+
+    def get_packet_capture(self, dev, local_path, start=None, end=None,
+                           filt=None):
+        """copies captured packets of a device to the Controller
+
+        Args:
+            dev (mandatory) -- Device whose packets are requested
+            local_path (mandatory) -- where to store the gzipped pcap file
+            start, end -- unix timestamps (Slave clock) limiting the time
+                window of the packets, None means unbounded
+            filt -- BPF filter applied to the retrieved packets
+        Returns:
+            local_path
+        """
+        return self._host.get_packet_capture(dev, local_path, start, end,
+                                             filt)
@@ -11,11 +11,39 @@ __author__ = """
 olichtne@redhat.com (Ondrej Lichtner)
 """
 
+import re
 import logging
 import signal
 from lnst.Common.JobError import JobError
 from lnst.Common.TestModule import BaseTestModule
 
+def wait_for_jobs(jobs, timeout=0, mode="all"):
+    """waits for several Jobs, possibly running on different Hosts, at once
+
+    Args:
+        jobs -- list of Job objects
+        timeout -- number of seconds to wait for, may be a float. Default is
+            0, means wait forever.
+        mode -- "all" (default) waits until all the Jobs finish, "any"
+            returns as soon as one of them finishes. Check the 'finished'
+            property to find out which.
+    Returns:
+        True if the Jobs finished, False if the method timed out.
+    Example:
+        client = m1.run(Netperf(...), bg=True)
+        server = m2.run(Netserver(...), bg=True)
+        wait_for_jobs([client, server], timeout=60, mode="any")
+    """
+    if timeout < 0:
+        raise JobError("Negative timeout value not allowed.")
+    if mode not in ["all", "any"]:
+        raise JobError("Unknown wait mode '%s'." % mode)
+
+    jobs = list(jobs)
+    if len(jobs) == 0:
+        return True
+    return jobs[0]._host.wait_for_jobs(jobs, timeout, mode)
+
 class Job(object):
     """Tester facing Job API
 
@@ -36,6 +64,7 @@ class Job(object):
         self._desc = desc
 
         self._res = None
+        self._output = {"stdout": [], "stderr": []}
 
         if isinstance(what, BaseTestModule):
             self._type = "module"
@@ -51,8 +80,11 @@ class Job(object):
         """standard output of the Job
 
         Type: string
-        Only applicable for Jobs running a shell command
+        Only applicable for Jobs running a shell command. While the Job is
+        running it's the output received so far.
         """
+        if self._res is None:
+            return self._get_output("stdout")
         try:
             return self._res["res_data"]["stdout"]
         except:
@@ -63,13 +95,81 @@ class Job(object):
         """standard error output of the Job
 
         Type: string
-        Only applicable for Jobs running a shell command
+        Only applicable for Jobs running a shell command. While the Job is
+        running it's the output received so far.
         """
+        if self._res is None:
+            return self._get_output("stderr")
         try:
             return self._res["res_data"]["stderr"]
         except:
             return ""
 
+    def _add_output(self, stream, seq, data):
+        chunks = self._output[stream]
+        if seq != len(chunks):
+            logging.warning("Job %d: %s chunk %d received, expected %d" %
+                            (self._id, stream, seq, len(chunks)))
+        chunks.append(data)
+
+    def _get_output(self, stream, seq=0):
+        return "".join(self._output[stream][seq:])
+
+    def read_output(self, stream="stdout", seq=0):
+        """returns the output received since the chunk number seq
+
+        Shell Jobs send their output to the Controller in numbered chunks
+        while they run. Only chunks that already arrived are returned, use
+        the wait or wait_for_output methods to receive more.
+
+        Args:
+            stream -- "stdout" or "stderr"
+            seq -- number of the first chunk to return
+        Returns:
+            tuple (data, next_seq), pass next_seq to the next call to get
+            only the new output.
+        Example:
+            seq = 0
+            while not job.wait(1):
+                data, seq = job.read_output(seq=seq)
+                print data,
+        """
+        if stream not in self._output:
+            raise JobError("Unknown output stream '%s'." % stream)
+        return self._get_output(stream, seq), len(self._output[stream])
+
+    def wait_for_output(self, pattern, stream="stdout", timeout=0):
+        """waits until the output of the running Job matches the pattern
+
+        Args:
+            pattern -- regular expression searched in the output, matches
+                spanning several chunks are only found within a line
+            stream -- "stdout" or "stderr"
+            timeout -- number of seconds to wait for, may be a float.
+                Default is 0, means wait forever.
+        Returns:
+            the match object, None if the Job finished or the method timed
+            out without a match.
+        """
+        if stream not in self._output:
+            raise JobError("Unknown output stream '%s'." % stream)
+        if timeout < 0:
+            raise JobError("Negative timeout value not allowed.")
+
+        regex = re.compile(pattern, re.MULTILINE)
+        state = {"seq": 0, "tail": "", "match": None}
+
+        def check():
+            data, state["seq"] = self.read_output(stream, state["seq"])
+            data = state["tail"] + data
+            state["match"] = regex.search(data)
+            #an incomplete line is searched again together with the new data
+            state["tail"] = data[data.rfind("\n") + 1:]
+            return state["match"] is not None or self.finished
+
+        self._host.wait_for(check, timeout)
+        return state["match"]
+
     @property
     def result(self):
         """result of the Job
@@ -112,10 +212,7 @@ class Job(object):
 
         Not relevant yet as network namespaces aren't supported yet.
         """
-        if self._cmd is not None:
-            return self._cmd["netns"]
-        else:
-            return None
+        return self._netns
 
     @property
     def id(self):
@@ -137,11 +234,10 @@ class Job(object):
         """waits for the Job to finish for the specified amount of time
 
         Args:
-            timeout -- integer value indicating how long to wait for.
+            timeout -- number of seconds to wait for, may be a float.
                 Default is 0, means wait forever. Don't use for infinitelly
                 running Jobs.
-                If non-zero LNST uses a timed SIGALARM signal to return from
-                this method.
+                Messages of all Slaves are processed while waiting.
         Returns:
             True if the Job finished, False if the Job is still running and
             the wait method just timed out.
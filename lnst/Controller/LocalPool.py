@@ -0,0 +1,148 @@
+"""
+This module defines the LocalPool class, the common part of pools whose
+Slaves are started by the Controller on the local host. The Slaves are
+described in a generated pool directory that can be passed to the Controller
+as the pools argument.
+
+Copyright 2017 Red Hat, Inc.
+Licensed under the GNU General Public License, version 2 as
+published by the Free Software Foundation; see COPYING for details.
+"""
+
+import os
+import time
+import errno
+import shutil
+import socket
+import tempfile
+from xml.dom.minidom import getDOMImplementation
+from lnst.Controller.Common import ControllerError
+
+class LocalPoolError(ControllerError):
+    pass
+
+def get_lnst_path():
+    """returns the directory containing the lnst package"""
+    return os.path.dirname(os.path.dirname(os.path.dirname(
+                                        os.path.abspath(__file__))))
+
+class LocalPool(object):
+    """Base class of pools of Slaves running on the local host
+
+    Derived classes implement _start_slaves, which starts the Slave
+    processes with _add_slave and describes them with _write_machine_file.
+
+    Example:
+        pool = DerivedPool(...)
+        pool.start()
+        try:
+            ctl = Controller(pools=[pool.get_pool_dir()])
+            ctl.run(MyRecipe())
+        finally:
+            pool.stop()
+    """
+    _work_dir_prefix = "lnst_pool_"
+
+    def __init__(self):
+        self._work_dir = None
+        self._slaves = []
+
+    def get_pool_dir(self):
+        return os.path.join(self._work_dir, "pool")
+
+    def get_work_dir(self):
+        return self._work_dir
+
+    def start(self, timeout=30):
+        self._work_dir = tempfile.mkdtemp(prefix=self._work_dir_prefix)
+        os.mkdir(self.get_pool_dir())
+
+        try:
+            self._start_slaves()
+            self._wait_for_slaves(timeout)
+        except:
+            self.stop()
+            raise
+
+    def stop(self):
+        for name, process, addr in self._slaves:
+            if process.poll() is None:
+                process.terminate()
+            process.wait()
+        self._slaves = []
+
+        self._cleanup()
+
+        if self._work_dir is not None:
+            shutil.rmtree(self._work_dir, ignore_errors=True)
+            self._work_dir = None
+
+    def _start_slaves(self):
+        raise NotImplementedError()
+
+    def _cleanup(self):
+        pass
+
+    def _add_slave(self, name, process, addr):
+        self._slaves.append((name, process, addr))
+
+    def _wait_for_slaves(self, timeout):
+        deadline = time.time() + timeout
+        for name, process, addr in self._slaves:
+            while True:
+                if process.poll() is not None:
+                    raise LocalPoolError("Slave %s exited with code %d" %
+                                         (name, process.returncode))
+                try:
+                    #same check the SlavePoolManager does
+                    s = socket.create_connection(addr)
+                    s.close()
+                    break
+                except socket.error as e:
+                    if e.errno not in [errno.ECONNREFUSED,
+                                       errno.ENETUNREACH]:
+                        raise
+                if time.time() > deadline:
+                    raise LocalPoolError("Timeout waiting for Slave %s" %
+                                         name)
+                time.sleep(0.05)
+
+    def _write_machine_file(self, m_id, params, interfaces):
+        """writes the pool file of a machine
+
+        Args:
+            m_id -- machine id, used as the file name
+            params -- list of (name, value) tuples of the machine params
+            interfaces -- list of (if_id, network label, params) tuples,
+                params are lists of (name, value) tuples
+        """
+        impl = getDOMImplementation()
+        doc = impl.createDocument(None, "slavemachine", None)
+        top_el = doc.documentElement
+
+        params_el = doc.createElement("params")
+        top_el.appendChild(params_el)
+        self._add_params(doc, params_el, params)
+
+        interfaces_el = doc.createElement("interfaces")
+        top_el.appendChild(interfaces_el)
+        for if_id, label, if_params in interfaces:
+            eth_el = doc.createElement("eth")
+            eth_el.setAttribute("id", if_id)
+            eth_el.setAttribute("label", label)
+            interfaces_el.appendChild(eth_el)
+
+            eth_params_el = doc.createElement("params")
+            eth_el.appendChild(eth_params_el)
+            self._add_params(doc, eth_params_el, if_params)
+
+        path = os.path.join(self.get_pool_dir(), "%s.xml" % m_id)
+        with open(path, "w") as f:
+            f.write(doc.toprettyxml())
+
+    def _add_params(self, doc, params_el, params):
+        for name, value in params:
+            param_el = doc.createElement("param")
+            param_el.setAttribute("name", name)
+            param_el.setAttribute("value", str(value))
+            params_el.appendChild(param_el)
@@ -14,9 +14,8 @@ rpazdera@redhat.com (Radek Pazdera)
 import logging
 import socket
 import sys
-import signal
+import json
 from lnst.Common.Utils import sha256sum
-from lnst.Common.Utils import check_process_running
 from lnst.Common.TestModule import BaseTestModule
 from lnst.Controller.Common import ControllerError
 from lnst.Controller.CtlSecSocket import CtlSecSocket
@@ -25,10 +24,6 @@ from lnst.Devices.Device import Device
 from lnst.Devices.RemoteDevice import RemoteDevice
 from lnst.Devices.VirtualDevice import VirtualDevice
 
-# conditional support for libvirt
-if check_process_running("libvirtd"):
-    from lnst.Controller.VirtDomainCtl import VirtDomainCtl
-
 class MachineError(ControllerError):
     pass
 
@@ -44,7 +39,8 @@ class Machine(object):
     """
 
     def __init__(self, m_id, hostname, msg_dispatcher, ctl_config,
-                 libvirt_domain=None, rpcport=None, security=None):
+                 libvirt_domain=None, rpcport=None, security=None,
+                 libvirt_snapshot=None):
         self._id = m_id
         self._hostname = hostname
         self._ctl_config = ctl_config
@@ -61,7 +57,13 @@ class Machine(object):
         self._network_bridges = None
         self._libvirt_domain = libvirt_domain
         if libvirt_domain:
+            # libvirt is imported only when needed
+            from lnst.Controller.VirtDomainCtl import VirtDomainCtl
             self._domain_ctl = VirtDomainCtl(libvirt_domain)
+        self._libvirt_snapshot = None
+        self._snapshot_fresh = False
+        if libvirt_snapshot and self._domain_ctl:
+            self._libvirt_snapshot = libvirt_snapshot
 
         if rpcport:
             self._port = rpcport
@@ -226,7 +228,13 @@ class Machine(object):
 
         Also sends Device classes from the controller and initializes the
         InterfaceManager on the Slave and builds the device database.
+        Snapshot backed machines are reverted to the snapshot first, unless
+        the cleanup after the previous recipe already did that.
         """
+        if self._libvirt_snapshot and not self._snapshot_fresh:
+            self._revert_to_snapshot()
+        self._snapshot_fresh = False
+
         self.rpc_call("set_recipe", recipe_name)
         self._send_device_classes()
         self.rpc_call("init_if_manager")
@@ -269,11 +277,17 @@ class Machine(object):
             return True
 
     def cleanup_devices(self):
-        self.rpc_call("destroy_devices")
-        for dev in self._device_database.values():
-            if isinstance(dev, VirtualDevice):
-                dev.destroy()
+        virt_devs = [dev for dev in self._device_database.values()
+                     if isinstance(dev, VirtualDevice)]
+        #the database is emptied even on errors, so the cleanup retried by
+        #Machine.cleanup doesn't detach the devices again
         self._device_database = {}
+        try:
+            self.rpc_call("destroy_devices")
+        finally:
+            if virt_devs:
+                #a guest not releasing a device shouldn't stop the cleanup
+                VirtualDevice.destroy_devices(virt_devs, strict=False)
 
     def cleanup(self):
         """ Clean the machine up
@@ -287,6 +301,10 @@ class Machine(object):
         if not self._msg_dispatcher.get_connection(self):
             return
 
+        if self._libvirt_snapshot:
+            self._revert_to_snapshot()
+            return
+
         try:
             #dump statistics
             # for iface in self._interfaces:
@@ -317,9 +335,23 @@ class Machine(object):
             self.cleanup_devices()
             raise
 
-    def _timeout_handler(self, signum, frame):
-        msg = "Timeout expired on machine %s" % self.get_id()
-        raise MachineError(msg)
+    def _revert_to_snapshot(self):
+        """ Restore a snapshot backed virtual machine
+
+            Instead of cleaning up the Slave through RPC calls, the domain
+            is reverted to the snapshot (taken with the Slave running) and
+            the Controller reconnects to the fresh Slave.
+        """
+        self._msg_dispatcher.disconnect_slave(self)
+        self._domain_ctl.revert_to_snapshot(self._libvirt_snapshot)
+
+        self._device_database = {}
+        self._tmp_device_database = []
+        self._namespaces = []
+        self._jobs = {}
+
+        self._init_connection()
+        self._snapshot_fresh = True
 
     def _get_base_classes(self, cls):
         new_bases = [cls] + list(cls.__bases__)
@@ -363,58 +395,72 @@ class Machine(object):
         return self.rpc_call("run_job", job._to_dict(), netns=job._netns)
 
     def wait_for_job(self, job, timeout):
-        res = True
-        if job.id not in self._jobs:
-            raise MachineError("No job '%s' running on Machine %s" %
-                               (job.id, self._id))
+        return self.wait_for_jobs([job], timeout)
 
-        prev_handler = signal.signal(signal.SIGALRM, self._timeout_handler)
-        signal.alarm(timeout)
+    def wait_for_jobs(self, jobs, timeout, mode="all"):
+        """waits for Jobs of this and other machines of the Controller
 
-        try:
-            if timeout > 0:
-                logging.info("Waiting for Job %d on Host %s for %d seconds." %
-                             (job.id, self._id, timeout))
-            elif timeout == 0:
-                logging.info("Waiting for Job %d on Host %s." %
-                             (job.id, self._id))
-            result = self._msg_dispatcher.wait_for_finish(self, job.id)
-        except MachineError as exc:
-            logging.error(str(exc))
-            res = False
-
-        signal.alarm(0)
-        signal.signal(signal.SIGALRM, prev_handler)
-
-        return res
+        All machines share the MessageDispatcher, so the Jobs can run on any
+        of them. mode is "all" or "any", see
+        MessageDispatcher.wait_for_finish.
+        """
+        for job in jobs:
+            if job.id not in job._host._jobs:
+                raise MachineError("No job '%s' running on Machine %s" %
+                                   (job.id, job._host.get_id()))
+
+        desc = ", ".join(["%d on Host %s" % (job.id, job._host.get_id())
+                          for job in jobs])
+        if timeout > 0:
+            logging.info("Waiting for Job %s for %s seconds." %
+                         (desc, timeout))
+        elif timeout == 0:
+            logging.info("Waiting for Job %s." % desc)
+
+        if not self._msg_dispatcher.wait_for_finish(jobs, timeout, mode):
+            logging.error("Timeout expired waiting for Job %s" % desc)
+            return False
+        return True
 
     def wait_for_tmp_devices(self, timeout):
-        res = False
-        prev_handler = signal.signal(signal.SIGALRM, self._timeout_handler)
-        signal.alarm(timeout)
-
-        try:
-            if timeout > 0:
-                logging.info("Waiting for Device creation Host %s for %d seconds." %
-                             (self._id, timeout))
-            elif timeout == 0:
-                logging.info("Waiting for Device creation on Host %s." %
-                             (self._id))
-
-            while len(self._tmp_device_database) > 0:
-                result = self._msg_dispatcher.handle_messages()
-        except MachineError as exc:
-            logging.error(str(exc))
-            res = False
-
-        signal.alarm(0)
-        signal.signal(signal.SIGALRM, prev_handler)
-        return res
+        if timeout > 0:
+            logging.info("Waiting for Device creation Host %s for %d seconds." %
+                         (self._id, timeout))
+        elif timeout == 0:
+            logging.info("Waiting for Device creation on Host %s." %
+                         (self._id))
+
+        if not self._msg_dispatcher.wait_for(
+                lambda: len(self._tmp_device_database) == 0, timeout):
+            logging.error("Timeout expired on machine %s" % self._id)
+            return False
+        return True
 
     def job_finished(self, msg):
         job_id = msg["job_id"]
         job = self._jobs[job_id]
-        job._res = msg["result"]
+        res = msg["result"]
+        if job._type == "shell":
+            #the output was streamed in job_output messages
+            res["res_data"] = {"stdout": job._get_output("stdout"),
+                               "stderr": job._get_output("stderr")}
+            if job._json:
+                try:
+                    res["res_data"]["stdout"] = \
+                            json.loads(res["res_data"]["stdout"])
+                except ValueError as e:
+                    logging.error("Job %d: unable to parse json output: %s" %
+                                  (job_id, str(e)))
+                    res["passed"] = False
+        job._res = res
+
+    def job_output(self, msg):
+        job = self._jobs[msg["job_id"]]
+        job._add_output(msg["stream"], msg["seq"], msg["data"])
+
+    def wait_for(self, condition, timeout):
+        """processes messages of all Slaves until condition() is True"""
+        return self._msg_dispatcher.wait_for(condition, timeout)
 
     def kill(self, job, signal):
         if job.id not in self._jobs:
@@ -433,6 +479,9 @@ class Machine(object):
     def get_libvirt_domain(self):
         return self._libvirt_domain
 
+    def get_libvirt_snapshot(self):
+        return self._libvirt_snapshot
+
     def get_mac_pool(self):
         if self._mac_pool:
             return self._mac_pool
@@ -443,6 +492,9 @@ class Machine(object):
         self._mac_pool = mac_pool
 
     def restore_system_config(self):
+        if self._libvirt_snapshot:
+            #reverting to the snapshot restores everything
+            return True
         self.rpc_call("restore_system_config")
         for netns in self._namespaces:
             self.rpc_call("restore_system_config", netns=netns)
@@ -463,23 +515,34 @@ class Machine(object):
 
         return self._domain_ctl
 
-    def start_packet_capture(self):
-        namespaces = set()
-        for iface in self._interfaces:
-            namespaces.add(iface.get_netns())
+    def close_domain_ctl(self):
+        """releases the libvirt event callbacks of a virtual machine"""
+        if self._domain_ctl:
+            self._domain_ctl.close()
 
-        tmp = {}
-        for netns in namespaces:
-            tmp.update(self.rpc_call("start_packet_capture", "", netns=netns))
-        return tmp
+    def start_packet_capture(self, filt="", ring_file_size=None,
+                             ring_file_count=None):
+        return self.rpc_call("start_packet_capture", filt, ring_file_size,
+                             ring_file_count)
 
     def stop_packet_capture(self):
-        namespaces = set()
-        for iface in self._interfaces:
-            namespaces.add(iface.get_netns())
+        self.rpc_call("stop_packet_capture")
 
-        for netns in namespaces:
-            self.rpc_call("stop_packet_capture", netns=netns)
+    def get_packet_capture(self, dev, local_path, start=None, end=None,
+                           filt=None):
+        """ Fetch captured packets of a device from the Slave
+
+            Only the packets within the [start, end] time window
+            (Slave unix timestamps) matching the optional BPF filter
+            are transferred, the local file is a gzipped pcap.
+        """
+        remote_path = self.rpc_call("get_packet_capture", dev.if_index,
+                                    start, end, filt)
+        try:
+            self.copy_file_from_machine(remote_path, local_path)
+        finally:
+            self.rpc_call("remove_capture_extract", remote_path)
+        return local_path
 
     def copy_file_to_machine(self, local_path, remote_path=None, netns=None):
         remote_path = self.rpc_call("start_copy_to", remote_path, netns=netns)
@@ -3,7 +3,7 @@ Defines the MessageDispatcher class used by the Controller to multiplex
 communication from all the connected Slave machines.
 
 In addition to that it defines functions used by the MessageDispatcher to
-transparently translate Device objects while communicating with the Slave.
+transparently encode Device objects while communicating with the Slave.
 
 Copyright 2017 Red Hat, Inc.
 Licensed under the GNU General Public License, version 2 as
@@ -14,73 +14,28 @@ __author__ = """
 olichtne@redhat.com (Ondrej Lichtner)
 """
 
+import time
 import logging
-import copy
 from lnst.Common.ConnectionHandler import send_data
 from lnst.Common.ConnectionHandler import ConnectionHandler
-from lnst.Common.TestModule import BaseTestModule
-from lnst.Common.Parameters import Parameters, DeviceParam
-from lnst.Common.DeviceRef import DeviceRef
+from lnst.Common.DeviceRef import device_persistent_id
+from lnst.Common.DeviceRef import encode_payload, decode_payload
 from lnst.Controller.Common import ControllerError
 from lnst.Devices.RemoteDevice import RemoteDevice
 
-def deviceref_to_remote_device(machine, obj):
-    if isinstance(obj, DeviceRef):
-        dev = machine.dev_db_get_if_index(obj.if_index)
-        return dev
-    elif isinstance(obj, dict):
-        new_dict = {}
-        for key, value in obj.items():
-            new_dict[key] = deviceref_to_remote_device(machine,
-                                                       value)
-        return new_dict
-    elif isinstance(obj, list):
-        new_list = []
-        for value in obj:
-            new_list.append(deviceref_to_remote_device(machine,
-                                                       value))
-        return new_list
-    elif isinstance(obj, tuple):
-        new_list = []
-        for value in obj:
-            new_list.append(deviceref_to_remote_device(machine,
-                                                       value))
-        return tuple(new_list)
-    else:
-        return obj
-
-def remote_device_to_deviceref(obj):
-    if isinstance(obj, RemoteDevice):
-        return DeviceRef(obj.if_index)
-    elif isinstance(obj, dict):
-        new_dict = {}
-        for key, value in obj.items():
-            new_dict[key] = remote_device_to_deviceref(value)
-        return new_dict
-    elif isinstance(obj, list):
-        new_list = []
-        for value in obj:
-            new_list.append(remote_device_to_deviceref(value))
-        return new_list
-    elif isinstance(obj, tuple):
-        new_list = []
-        for value in obj:
-            new_list.append(remote_device_to_deviceref(value))
-        return tuple(new_list)
-    elif isinstance(obj, DeviceParam):
-        new_param = DeviceParam()
-        new_param.val = remote_device_to_deviceref(obj.val)
-        return new_param
-    elif isinstance(obj, Parameters):
-        for param_name, param in obj:
-            setattr(obj, param_name, remote_device_to_deviceref(param))
-        return obj
-    elif isinstance(obj, BaseTestModule):
-        new_test = copy.deepcopy(obj)
-        new_test.params = remote_device_to_deviceref(new_test.params)
-        return new_test
-    else:
-        return obj
+remote_device_persistent_id = device_persistent_id(RemoteDevice)
+
+def encode_command(msg):
+    """encodes the arguments of a command message into its payload
+
+    RemoteDevice objects are encoded as their if_index by the pickler, the
+    arguments (e.g. test module objects) aren't copied.
+    """
+    args = msg.pop("args", [])
+    kwargs = msg.pop("kwargs", {})
+    msg["payload"] = encode_payload((args, kwargs),
+                                    remote_device_persistent_id)
+    return msg
 
 class ConnectionError(ControllerError):
     pass
@@ -93,14 +48,16 @@ class MessageDispatcher(ConnectionHandler):
 
     def add_slave(self, machine, connection):
         self._machines[machine] = machine
+        connection.set_device_encoding(remote_device_persistent_id)
         self.add_connection(machine, connection)
 
     def send_message(self, machine, data):
         soc = self.get_connection(machine)
 
         if data["type"] == "command":
-            data["args"] = remote_device_to_deviceref(data["args"])
-            data["kwargs"] = remote_device_to_deviceref(data["kwargs"])
+            encode_command(data)
+        elif data["type"] == "to_netns" and data["data"]["type"] == "command":
+            encode_command(data["data"])
 
         if send_data(soc, data) == False:
             msg = "Connection error from slave %s" % machine.get_id()
@@ -118,11 +75,9 @@ class MessageDispatcher(ConnectionHandler):
             for msg in messages:
                 if msg[1]["type"] == "result" and msg[0] == machine:
                     wait = False
-                    result = msg[1]["result"]
-
                     machine = self._machines[machine]
-                    result = deviceref_to_remote_device(machine,
-                                                        result)
+                    result = decode_payload(msg[1]["payload"],
+                                            machine.dev_db_get_if_index)
                 else:
                     self._process_message(msg)
 
@@ -135,32 +90,50 @@ class MessageDispatcher(ConnectionHandler):
 
         return result
 
-    def wait_for_finish(self, machine, job_id):
-        wait = True
-        while wait:
-            connected_slaves = self._connection_mapping.keys()
-
-            messages = self.check_connections()
-
-            remaining_slaves = self._connection_mapping.keys()
-
-            for msg in messages:
-                self._process_message(msg)
-                if msg[1]["type"] == "job_finished" and msg[0] == machine:
-                    wait = False
-
-            if connected_slaves != remaining_slaves:
-                disconnected_slaves = set(connected_slaves) -\
-                                      set(remaining_slaves)
-                msg = "Slaves " + str(list(disconnected_slaves)) + \
-                      " disconnected from the controller."
-                raise ConnectionError(msg)
+    def wait_for(self, condition, timeout=0):
+        """processes messages until condition() is True or timeout expires
+
+        Args:
+            condition -- function without arguments, checked before and
+                after every batch of processed messages
+            timeout -- seconds to wait for, may be a float, 0 waits forever
+
+        Returns True if the condition was met, False on timeout.
+        """
+        deadline = time.time() + timeout if timeout else None
+        while not condition():
+            if deadline is None:
+                wait = None
+            else:
+                wait = deadline - time.time()
+                if wait <= 0:
+                    return False
+            self.handle_messages(wait)
         return True
 
-    def handle_messages(self):
+    def wait_for_finish(self, jobs, timeout=0, mode="all"):
+        """processes messages until the Jobs finish
+
+        Args:
+            jobs -- list of Controller Job objects, they may run on
+                different machines
+            timeout -- seconds to wait for, may be a float, 0 waits forever
+            mode -- "all" waits for all of the Jobs, "any" for the first one
+
+        Returns True if the Jobs finished, False on timeout.
+        """
+        if mode == "all":
+            condition = lambda: all([job.finished for job in jobs])
+        elif mode == "any":
+            condition = lambda: any([job.finished for job in jobs])
+        else:
+            raise ControllerError("Unknown wait mode '%s'" % mode)
+        return self.wait_for(condition, timeout)
+
+    def handle_messages(self, timeout=None):
         connected_slaves = self._connection_mapping.keys()
 
-        messages = self.check_connections()
+        messages = self.check_connections(timeout)
 
         remaining_slaves = self._connection_mapping.keys()
 
@@ -193,6 +166,19 @@ class MessageDispatcher(ConnectionHandler):
         elif message[1]["type"] == "job_finished":
             machine = self._machines[message[0]]
             machine.job_finished(message[1])
+        elif message[1]["type"] == "job_output":
+            machine = self._machines[message[0]]
+            output = message[1]
+            machine.job_output(output)
+
+            #the Slave doesn't log job outputs, they're logged here
+            record = {"msg": "Job %d %s:\n%s" % (output["job_id"],
+                                                 output["stream"],
+                                                 output["data"].rstrip("\n")),
+                      "levelname": "DEBUG",
+                      "levelno": logging.DEBUG,
+                      "job_id": output["job_id"]}
+            self._log_ctl.add_client_log(machine.get_id(), record)
         else:
             msg = "Unknown message type: %s" % message[1]["type"]
             raise ConnectionError(msg)
@@ -200,4 +186,5 @@ class MessageDispatcher(ConnectionHandler):
     def disconnect_slave(self, machine):
         soc = self.get_connection(machine)
         self.remove_connection(soc)
+        soc.close()
         del self._machines[machine]
@@ -2,6 +2,11 @@
 This module defines NetTestResultSerializer class which serves for serializing
 results of command sequence to XML
 
+The results are appended to a stream file of JSON lines as they arrive. The
+summary, XML and HTML outputs are generated from the stream one command at a
+time, so their memory usage doesn't grow with the number of results and the
+results survive a crash of the Controller.
+
 Copyright 2011 Red Hat, Inc.
 Licensed under the GNU General Public License, version 2 as
 published by the Free Software Foundation; see COPYING for details.
@@ -13,133 +18,285 @@ jpirko@redhat.com (Jiri Pirko)
 
 import logging
 import datetime
-from xml.dom.minidom import getDOMImplementation
+import tempfile
+import json
+from StringIO import StringIO
 from lnst.Common.Colours import decorate_with_preset
-from lnst.Common.Config import lnst_config
 from lxml import etree
 
-def serialize_obj(obj, dom, el, upper_name="unnamed"):
+#number of commands transformed to HTML at once
+HTML_CHUNK_SIZE = 500
+
+def serialize_obj(obj, el, upper_name="unnamed"):
     if isinstance(obj, dict):
         for key in obj:
-            new_el = dom.createElement(key)
+            new_el = _sub_element(el, key)
             if isinstance(obj[key], dict):
-                new_el.setAttribute("type", "dict")
+                new_el.set("type", "dict")
             elif isinstance(obj[key], list):
-                new_el.setAttribute("type", "list")
-            el.appendChild(new_el)
-            serialize_obj(obj[key], dom, new_el, upper_name=key)
+                new_el.set("type", "list")
+            serialize_obj(obj[key], new_el, upper_name=key)
     elif isinstance(obj, list):
         for one in obj:
-            new_el = dom.createElement("%s_item" % upper_name)
+            new_el = _sub_element(el, "%s_item" % upper_name)
             if isinstance(one, dict):
-                new_el.setAttribute("type", "dict")
+                new_el.set("type", "dict")
             elif isinstance(one, list):
-                new_el.setAttribute("type", "list")
-            el.appendChild(new_el)
-            serialize_obj(one, dom, new_el)
+                new_el.set("type", "list")
+            serialize_obj(one, new_el)
     else:
-        text = dom.createTextNode(str(obj))
-        el.appendChild(text)
-
-def get_node_val(node):
-    content = []
-    for child in node.childNodes:
-        if child.nodeType == child.TEXT_NODE:
-            content.append(child.nodeValue)
-    return str(''.join(content).strip())
-
-class NetTestResultSerializer:
-    def __init__(self):
-        self._results = []
+        el.text = _text(obj)
+
+def _sub_element(el, name):
+    try:
+        return etree.SubElement(el, str(name))
+    except ValueError:
+        #not a valid XML name, e.g. a number
+        return etree.SubElement(el, "item", name=_text(name))
+
+def _text(obj):
+    if isinstance(obj, unicode):
+        return obj
+    return str(obj).decode("utf-8", "replace")
+
+def _json_default(obj):
+    return _sanitize(str(obj))
+
+def _sanitize(obj):
+    """decodes byte strings, invalid UTF-8 sequences are replaced"""
+    if isinstance(obj, str):
+        return obj.decode("utf-8", "replace")
+    elif isinstance(obj, dict):
+        return dict((_sanitize(key), _sanitize(value))
+                    for key, value in obj.items())
+    elif isinstance(obj, (list, tuple)):
+        return [_sanitize(item) for item in obj]
+    return obj
+
+class _EventReader(object):
+    """Reads the events of a result stream with a lookahead of one event"""
+    def __init__(self, path):
+        self._file = open(path, "r")
+        self._next = None
+        self._advance()
+
+    def _advance(self):
+        while True:
+            line = self._file.readline()
+            if line == "":
+                self._next = None
+                return
+            try:
+                self._next = json.loads(line)
+                return
+            except ValueError:
+                #partially written last line after a crash
+                continue
+
+    def peek(self):
+        return self._next
+
+    def next(self):
+        event = self._next
+        if event is not None:
+            self._advance()
+        return event
+
+    def close(self):
+        self._file.close()
+
+class NetTestResultSerializer(object):
+    """Collects results of recipes
+
+    Args:
+        stream_path -- file the results are streamed to, a temporary file is
+            used when not specified. The file can be loaded by the load()
+            class method, e.g. to generate the outputs of a crashed run.
+    """
+    def __init__(self, stream_path=None):
         self._start_time = datetime.datetime.now()
+        if stream_path is None:
+            self._stream = tempfile.NamedTemporaryFile(prefix="lnst_results_",
+                                                       suffix=".jsonl")
+        else:
+            self._stream = open(stream_path, "w")
+        self._stream_path = self._stream.name
+
+    @classmethod
+    def load(cls, stream_path):
+        """creates a read-only serializer of an existing stream file"""
+        serializer = cls.__new__(cls)
+        serializer._start_time = datetime.datetime.now()
+        serializer._stream = None
+        serializer._stream_path = stream_path
+        return serializer
+
+    def get_stream_path(self):
+        return self._stream_path
+
+    def _write_event(self, event):
+        if self._stream is None:
+            raise Exception("Result stream %s is read-only" %
+                            self._stream_path)
+        try:
+            line = json.dumps(event, default=_json_default)
+        except UnicodeDecodeError:
+            #command outputs don't have to be valid UTF-8
+            line = json.dumps(_sanitize(event), default=_json_default)
+        self._stream.write(line + "\n")
+        self._stream.flush()
 
     def add_recipe(self, name, match_num):
-        recipe_result = {"name": name,
-                         "result": "FAIL",
-                         "tasks": [],
-                         "pool_match": {},
-                         "match_num": match_num}
-        self._results.append(recipe_result)
+        self._write_event({"type": "recipe",
+                           "name": name,
+                           "match_num": match_num})
 
     def set_recipe_pool_match(self, match):
-        self._results[-1]["pool_match"] = match
+        self._write_event({"type": "pool_match", "match": match})
 
     def set_recipe_result(self, result):
+        event = {"type": "recipe_result"}
         if result and result["passed"]:
-            self._results[-1]["result"] = "PASS"
+            event["result"] = "PASS"
         else:
-            self._results[-1]["result"] = "FAIL"
+            event["result"] = "FAIL"
 
             if "err_msg" in result:
-                self._results[-1]["err_msg"] = result["err_msg"]
+                event["err_msg"] = result["err_msg"]
+        self._write_event(event)
 
     def add_task(self):
-        self._results[-1]["tasks"].append([])
+        self._write_event({"type": "task"})
 
     def add_cmd_result(self, command, cmd_res):
-        self._results[-1]["tasks"][-1].append((command, cmd_res))
+        self._write_event({"type": "command",
+                           "command": command,
+                           "result": cmd_res})
+
+    def _load_recipes(self):
+        """reads the recipe level data in a first pass over the stream
+
+        The recipe result and pool match arrive after the commands of the
+        recipe but all outputs need them first.
+        """
+        recipes = []
+        reader = _EventReader(self._stream_path)
+        try:
+            event = reader.next()
+            while event is not None:
+                if event["type"] == "recipe":
+                    recipes.append({"name": event["name"],
+                                    "result": "FAIL",
+                                    "pool_match": {},
+                                    "match_num": event["match_num"],
+                                    "host_len": []})
+                elif len(recipes) == 0:
+                    pass
+                elif event["type"] == "pool_match":
+                    recipes[-1]["pool_match"] = event["match"]
+                elif event["type"] == "recipe_result":
+                    recipes[-1]["result"] = event["result"]
+                    if "err_msg" in event:
+                        recipes[-1]["err_msg"] = event["err_msg"]
+                elif event["type"] == "task":
+                    recipes[-1]["host_len"].append(0)
+                elif event["type"] == "command" and recipes[-1]["host_len"]:
+                    #alignment of the host names in the summary of the task
+                    cmd = event["command"]
+                    if "host" in cmd and \
+                       len(cmd["host"]) > recipes[-1]["host_len"][-1]:
+                        recipes[-1]["host_len"][-1] = len(cmd["host"])
+                event = reader.next()
+        finally:
+            reader.close()
+        return recipes
+
+    def _iter_recipes(self):
+        """yields (recipe, tasks) pairs
+
+        tasks yields (task_id, commands) pairs and commands yields
+        (command, cmd_res) pairs, all of them read lazily from the stream.
+        """
+        recipes = self._load_recipes()
+        reader = _EventReader(self._stream_path)
+        try:
+            for recipe in recipes:
+                event = reader.next()
+                while event is not None and event["type"] != "recipe":
+                    event = reader.next()
+                yield recipe, self._iter_tasks(reader)
+        finally:
+            reader.close()
+
+    def _iter_tasks(self, reader):
+        task_id = 0
+        while reader.peek() is not None and \
+              reader.peek()["type"] != "recipe":
+            event = reader.next()
+            if event["type"] == "task":
+                task_id += 1
+                yield task_id, self._iter_commands(reader)
+
+    def _iter_commands(self, reader):
+        while reader.peek() is not None and \
+              reader.peek()["type"] not in ["recipe", "task"]:
+            event = reader.next()
+            if event["type"] == "command":
+                yield event["command"], event["result"]
 
     def print_summary(self):
-        output_pairs = []
+        self._print_pairs(self._summary_pairs)
 
-        for recipe in self._results:
+        current_time = datetime.datetime.now()
+        dif_time = current_time - self._start_time
+        days = dif_time.days
+        hours = dif_time.seconds/3600
+        minutes = dif_time.seconds/60 - hours*60
+        seconds = dif_time.seconds - hours*3600 - minutes*60
+        logging.info("Total test time: %d days, %d hours, %d minutes, "\
+                     "%d seconds" % (days, hours, minutes, seconds))
+
+    def _summary_pairs(self):
+        for recipe, tasks in self._iter_recipes():
             recipe_head = "%s match: %d" % (recipe["name"], recipe["match_num"])
-            output_pairs.append((recipe_head, recipe["result"]))
+            yield (recipe_head, recipe["result"])
 
             match = recipe["pool_match"]
             if match != {}:
-                output_pairs.append((4*" " + "Pool match description:", ""))
+                yield (4*" " + "Pool match description:", "")
                 if "virtual" in match and match["virtual"]:
-                    output_pairs.append((4*" " +\
-                                         "Setup is using virtual machines.",
-                                         ""))
+                    yield (4*" " + "Setup is using virtual machines.", "")
 
                 for m_id, m in sorted(match["machines"].iteritems()):
-                    output_pairs.append((4*" " + "host \"%s\" uses \"%s\"" %\
-                                        (m_id, m["target"]), ""))
+                    yield (4*" " + "host \"%s\" uses \"%s\"" %\
+                           (m_id, m["target"]), "")
                     for if_id, pool_if in m["interfaces"].iteritems():
                         pool_id = pool_if["target"]
                         if "driver" in pool_if:
                             driver = pool_if["driver"]
-                            output_pairs.append((6*" " + "interface \"%s\" "
-                                                        "matched to \"%s\" "
-                                                        "(driver: \"%s\")" %
-                                                        (if_id, pool_id,
-                                                            driver), ""))
+                            yield (6*" " + "interface \"%s\" "
+                                           "matched to \"%s\" "
+                                           "(driver: \"%s\")" %
+                                           (if_id, pool_id, driver), "")
                         else:
-                            output_pairs.append((6*" " + "interface \"%s\" "
-                                                        "matched to \"%s\" " %
-                                                        (if_id, pool_id), ""))
+                            yield (6*" " + "interface \"%s\" "
+                                           "matched to \"%s\" " %
+                                           (if_id, pool_id), "")
 
             if recipe["result"] == "FAIL" and \
                "err_msg" in recipe and recipe["err_msg"] != "":
                 err_msg = recipe["err_msg"]
-                output_pairs.append((4*" " + "error message: " + err_msg, ""))
-
-            seq_num = 1
-            for task in recipe["tasks"]:
-                output_pairs.append((4*" " + "task: %s" % seq_num,""))
+                yield (4*" " + "error message: " + err_msg, "")
 
-                seq_num += 1
+            for task_id, commands in tasks:
+                yield (4*" " + "task: %s" % task_id, "")
 
-                m_id_max = 0
-                for cmd, cmd_res in task:
-                    if "host" in cmd and\
-                        len(cmd["host"]) > m_id_max:
-                            m_id_max = len(cmd["host"])
-                for cmd, cmd_res in task:
+                m_id_max = recipe["host_len"][task_id - 1]
+                for cmd, cmd_res in commands:
+                    output_pairs = []
                     self._format_command(cmd, cmd_res, output_pairs, m_id_max)
-
-        self._print_pairs(output_pairs)
-
-        current_time = datetime.datetime.now()
-        dif_time = current_time - self._start_time
-        days = dif_time.days
-        hours = dif_time.seconds/3600
-        minutes = dif_time.seconds/60 - hours*60
-        seconds = dif_time.seconds - hours*3600 - minutes*60
-        logging.info("Total test time: %d days, %d hours, %d minutes, "\
-                     "%d seconds" % (days, hours, minutes, seconds))
+                    for pair in output_pairs:
+                        yield pair
 
     def _format_command(self, command, cmd_res, output_pairs, m_id_max):
         if cmd_res["passed"]:
@@ -167,10 +324,15 @@ class NetTestResultSerializer:
                 out = decorate_with_preset(line, "faded")
                 output_pairs.append((12*" " + out, ""))
 
-    def _print_pairs(self, output_pairs):
+    def _print_pairs(self, get_pairs):
+        """prints the pairs generated by get_pairs aligned
+
+        get_pairs is called twice, the first time to measure the pairs, so
+        they don't have to be kept in memory.
+        """
         max_left = 0
         max_right = 0
-        for left, right in output_pairs:
+        for left, right in get_pairs():
             if len(left) > max_left:
                 max_left = len(left)
             if len(right) > max_right:
@@ -189,7 +351,7 @@ class NetTestResultSerializer:
         coloured_summary = decorate_with_preset("SUMMARY", "highlight")
         logging.info(header.replace("SUMMARY", coloured_summary))
 
-        for left, right in output_pairs:
+        for left, right in get_pairs():
             if right != "":
                 space_fill = full_length - len(left) - len(right) - 1 - 2
                 if right == "PASS":
@@ -204,98 +366,158 @@ class NetTestResultSerializer:
             logging.info(" %s " % output)
         logging.info("="*(full_length))
 
-    def _generate_xml(self):
-        impl = getDOMImplementation()
-        doc = impl.createDocument(None, "results", None)
+    def _recipe_element(self, recipe):
+        """returns the recipe element with the recipe data, without tasks"""
+        recipe_el = etree.Element("recipe")
+        recipe_el.set("name", recipe["name"])
+        recipe_el.set("result", recipe["result"])
+        recipe_el.set("match_num", str(recipe["match_num"]))
 
-        top_el = doc.documentElement
+        match = recipe["pool_match"]
+        if match != {}:
+            match_el = etree.SubElement(recipe_el, "pool_match")
 
-        for recipe in self._results:
-            recipe_el = doc.createElement("recipe")
-            recipe_el.setAttribute("name", recipe["name"])
-            recipe_el.setAttribute("result", recipe["result"])
-            recipe_el.setAttribute("match_num", str(recipe["match_num"]))
+            if "virtual" in match and match["virtual"]:
+                match_el.set("virtual", "true")
+            else:
+                match_el.set("virtual", "false")
 
-            top_el.appendChild(recipe_el)
+            for m_id, m in match["machines"].iteritems():
+                m_el = etree.SubElement(match_el, "m_match")
+                m_el.set("host_id", str(m_id))
+                m_el.set("pool_id", str(m["target"]))
 
-            match = recipe["pool_match"]
-            if match != {}:
-                match_el = doc.createElement("pool_match")
-
-                if "virtual" in match and match["virtual"]:
-                    match_el.setAttribute("virtual", "true")
-                else:
-                    match_el.setAttribute("virtual", "false")
+                for if_id, pool_id in m["interfaces"].iteritems():
+                    if_el = etree.SubElement(m_el, "if_match")
+                    if_el.set("if_id", str(if_id))
+                    if_el.set("pool_if_id", str(pool_id))
 
-                for m_id, m in match["machines"].iteritems():
-                    m_el = doc.createElement("m_match")
-                    m_el.setAttribute("host_id", str(m_id))
-                    m_el.setAttribute("pool_id", str(m["target"]))
+        if recipe["result"] == "FAIL" and \
+           "err_msg" in recipe and recipe["err_msg"] != "":
+            err_el = etree.SubElement(recipe_el, "error_message")
+            err_el.text = _text(recipe["err_msg"])
+        return recipe_el
 
-                    for if_id, pool_id in m["interfaces"].iteritems():
-                        if_el = doc.createElement("if_match")
-                        if_el.setAttribute("if_id", str(if_id))
-                        if_el.setAttribute("pool_if_id", str(pool_id))
-                        m_el.appendChild(if_el)
+    def _command_element(self, cmd, cmd_res):
+        command_el = etree.Element("command")
 
-                    match_el.appendChild(m_el)
+        for key in cmd:
+            if key == "options":
+                continue
+            command_el.set(key, _text(cmd[key]))
 
+        result_el = etree.SubElement(command_el, "result")
 
-                recipe_el.appendChild(match_el)
-
-            if recipe["result"] == "FAIL" and \
-               "err_msg" in recipe and recipe["err_msg"] != "":
-                err_el = doc.createElement("error_message")
-                err_text = doc.createTextNode(recipe["err_msg"])
-                err_el.appendChild(err_text)
-                recipe_el.appendChild(err_el)
-
-            for task in recipe["tasks"]:
-                cmd_seq_el = doc.createElement("task")
-                recipe_el.appendChild(cmd_seq_el)
-
-                for cmd, cmd_res in task:
-                    command_el = doc.createElement("command")
-                    cmd_seq_el.appendChild(command_el)
-
-                    for key in cmd:
-                        if key == "options":
-                            continue
-                        command_el.setAttribute(key, str(cmd[key]))
-
-                    result_el = doc.createElement("result")
-                    command_el.appendChild(result_el)
-
-                    if cmd_res["passed"]:
-                        res = "PASS"
-                    else:
-                        res = "FAIL"
-                    result_el.setAttribute("result", res)
-
-                    if "msg" in cmd_res and cmd_res["msg"]:
-                        msg_el = doc.createElement("message")
-                        msg_text = doc.createTextNode(cmd_res["msg"])
-                        msg_el.appendChild(msg_text)
-                        result_el.appendChild(msg_el)
-
-                    if "res_data" in cmd_res and cmd_res["res_data"]:
-                        res_data_el = doc.createElement("result_data")
-                        serialize_obj(cmd_res["res_data"], doc, res_data_el)
-                        command_el.appendChild(res_data_el)
-        return doc
+        if cmd_res["passed"]:
+            res = "PASS"
+        else:
+            res = "FAIL"
+        result_el.set("result", res)
+
+        if "msg" in cmd_res and cmd_res["msg"]:
+            msg_el = etree.SubElement(result_el, "message")
+            msg_el.text = _text(cmd_res["msg"])
+
+        if "res_data" in cmd_res and cmd_res["res_data"]:
+            res_data_el = etree.SubElement(command_el, "result_data")
+            serialize_obj(cmd_res["res_data"], res_data_el)
+        return command_el
+
+    def write_result_xml(self, out):
+        """writes the XML results incrementally
+
+        Args:
+            out -- file path or file object
+        """
+        with etree.xmlfile(out, encoding="utf-8") as xf:
+            xf.write_declaration()
+            with xf.element("results"):
+                for recipe, tasks in self._iter_recipes():
+                    recipe_el = self._recipe_element(recipe)
+                    with xf.element("recipe", recipe_el.attrib):
+                        for child in recipe_el:
+                            xf.write(child)
+                        for task_id, commands in tasks:
+                            with xf.element("task", id=str(task_id)):
+                                for cmd, cmd_res in commands:
+                                    xf.write(self._command_element(cmd,
+                                                                   cmd_res))
 
     def get_result_xml(self):
-        doc = self._generate_xml()
-        return doc.toprettyxml()
+        out = StringIO()
+        self.write_result_xml(out)
+        return out.getvalue()
+
+    def write_result_html(self, out, xslt_url):
+        """writes the HTML results
+
+        If the XSLT document supports the 'fragment' parameter the page is
+        rendered progressively, a recipe heading or a chunk of commands at a
+        time. Otherwise the complete XML document is transformed at once.
+
+        Args:
+            out -- file path or file object
+            xslt_url -- URL of the XSLT document, the xslt_url option of the
+                Controller configuration
+        """
+        if isinstance(out, basestring):
+            with open(out, "w") as f:
+                return self.write_result_html(f, xslt_url)
 
-    def get_result_html(self):
-        xslt_url = lnst_config.get_option("environment", "xslt_url")
         xslt = etree.parse(xslt_url)
-
-        xml = self._generate_xml().toprettyxml()
-        etree_xml = etree.fromstring(xml)
-
         transform = etree.XSLT(xslt)
 
-        transformed_xml = transform(etree_xml)
-        return "<!DOCTYPE html>\n" + str(transformed_xml)
+        out.write("<!DOCTYPE html>\n")
+        if not self._supports_fragments(xslt):
+            xml = StringIO()
+            self.write_result_xml(xml)
+            xml.seek(0)
+            out.write(str(transform(etree.parse(xml))))
+            return
+
+        def render(root, fragment=""):
+            param = etree.XSLT.strparam(fragment)
+            return str(transform(etree.ElementTree(root), fragment=param))
+
+        #the page without any recipe, the recipes go before </body>
+        page = render(etree.Element("results"))
+        end = page.rfind("</body>")
+        out.write(page[:end])
+
+        for recipe, tasks in self._iter_recipes():
+            recipe_el = self._recipe_element(recipe)
+            results_el = etree.Element("results")
+            results_el.append(recipe_el)
+            out.write(render(results_el, "recipe"))
+            out.write("<table class=\"lnst_results\">\n")
+            out.write(render(results_el, "results_header"))
+
+            for task_id, commands in tasks:
+                task_el = etree.SubElement(recipe_el, "task", id=str(task_id))
+                count = 0
+                for cmd, cmd_res in commands:
+                    task_el.append(self._command_element(cmd, cmd_res))
+                    count += 1
+                    if count % HTML_CHUNK_SIZE == 0:
+                        out.write(render(results_el, "tasks"))
+                        recipe_el.remove(task_el)
+                        task_el = etree.SubElement(recipe_el, "task",
+                                                   id=str(task_id),
+                                                   continued="true")
+                if count == 0 or count % HTML_CHUNK_SIZE:
+                    out.write(render(results_el, "tasks"))
+                recipe_el.remove(task_el)
+            out.write("</table>\n")
+
+        out.write(page[end:])
+
+    def _supports_fragments(self, xslt):
+        ns = {"xsl": "http://www.w3.org/1999/XSL/Transform"}
+        params = xslt.xpath("/xsl:stylesheet/xsl:param[@name='fragment']",
+                            namespaces=ns)
+        return len(params) > 0
+
+    def get_result_html(self, xslt_url):
+        out = StringIO()
+        self.write_result_html(out, xslt_url)
+        return out.getvalue()
@@ -0,0 +1,249 @@
+"""
+This module defines the NetnsPool class, a pool generated from Recipe
+requirements whose machines are network namespaces of the local host. Each
+namespace runs its own Slave and the test devices are veth devices wired
+according to the network labels of the requirements.
+
+Example:
+    recipe = MyRecipe()
+    pool = NetnsPool(recipe.req)
+    pool.start()
+    try:
+        ctl = Controller(pools=[pool.get_pool_dir()])
+        ctl.run(recipe)
+    finally:
+        pool.stop()
+
+Copyright 2017 Red Hat, Inc.
+Licensed under the GNU General Public License, version 2 as
+published by the Free Software Foundation; see COPYING for details.
+"""
+
+import os
+import sys
+import socket
+import struct
+import subprocess
+from distutils.spawn import find_executable
+from lnst.Common.Config import DefaultRPCPort
+from lnst.Common.ExecCmd import ExecCmdShell
+from lnst.Controller.LocalPool import LocalPool, LocalPoolError
+from lnst.Controller.LocalPool import get_lnst_path
+
+class NetnsPoolError(LocalPoolError):
+    pass
+
+def _ip_to_int(addr):
+    return struct.unpack("!I", socket.inet_aton(addr))[0]
+
+def _int_to_ip(num):
+    return socket.inet_ntoa(struct.pack("!I", num))
+
+class NetnsPool(LocalPool):
+    """Pool of network namespaces generated from Recipe requirements
+
+    For every HostReq a network namespace with a Slave is created, for every
+    DeviceReq a veth device with the same name is created in the namespace.
+    Network labels with exactly two devices are wired with a single veth
+    pair, labels with more devices get a bridge in the root namespace.
+
+    The Controller reaches each Slave through a control veth pair with a /30
+    subnet allocated from ctl_net. Host parameters of the requirements are
+    copied to the pool description, device parameters too with the exception
+    of hwaddr (used as the veth address) and driver (has to be veth).
+
+    Requires root privileges and the iproute2 tools.
+
+    Args:
+        requirements -- Requirements object of a Recipe (recipe.req) or its
+            dictionary form
+        port -- RPC port of the Slaves
+        ctl_net -- first address of the control network
+        prefix -- prefix of the namespace names, defaults to lnst<pid>
+    """
+    _work_dir_prefix = "lnst_netns_"
+
+    def __init__(self, requirements, port=DefaultRPCPort,
+                 ctl_net="10.253.0.0", prefix=None):
+        super(NetnsPool, self).__init__()
+        if hasattr(requirements, "_to_dict"):
+            requirements = requirements._to_dict()
+        self._reqs = requirements
+        self._port = port
+        self._ctl_net = _ip_to_int(ctl_net)
+
+        if prefix is None:
+            prefix = "lnst%d" % os.getpid()
+        self._prefix = prefix
+        #interface names are limited to 15 characters
+        self._if_prefix = "ln%04x" % (os.getpid() & 0xffff)
+        self._if_seq = 0
+        self._hwaddr_seq = 0
+
+        self._namespaces = {}
+        self._bridges = []
+        self._shell = None
+
+    def get_namespace(self, m_id):
+        return self._namespaces[m_id]
+
+    def _new_if_name(self, kind):
+        self._if_seq += 1
+        return "%s%s%d" % (self._if_prefix, kind, self._if_seq)
+
+    def _new_hwaddr(self):
+        self._hwaddr_seq += 1
+        return "02:4C:4E:%02X:%02X:%02X" % ((self._hwaddr_seq >> 16) & 0xff,
+                                            (self._hwaddr_seq >> 8) & 0xff,
+                                            self._hwaddr_seq & 0xff)
+
+    def _start_slaves(self):
+        #the setup is a long sequence of ip commands, one shell runs them all
+        self._shell = ExecCmdShell()
+        try:
+            self._start_namespaces()
+        finally:
+            self._shell.close()
+
+    def _start_namespaces(self):
+        slave_script = self._find_slave_script()
+        env = dict(os.environ)
+        env["PYTHONPATH"] = os.pathsep.join([get_lnst_path()] +
+                                            [p for p in [env.get("PYTHONPATH")]
+                                             if p])
+
+        ctl_addrs = {}
+        for i, m_id in enumerate(sorted(self._reqs.keys())):
+            netns = "%s_%s" % (self._prefix, m_id)
+            self._shell.run("ip netns add %s" % netns)
+            self._namespaces[m_id] = netns
+            self._shell.run("ip -n %s link set lo up" % netns)
+
+            ctl_addrs[m_id] = self._setup_ctl_link(i, netns)
+
+        interfaces = dict([(m_id, []) for m_id in self._reqs.keys()])
+        self._setup_networks(interfaces)
+
+        for m_id in sorted(self._reqs.keys()):
+            work_dir = os.path.join(self.get_work_dir(), m_id)
+            os.mkdir(work_dir)
+            config = self._write_slave_config(work_dir)
+
+            cmd = ["ip", "netns", "exec", self._namespaces[m_id],
+                   sys.executable, slave_script, "--port", str(self._port),
+                   "--config", config, "--no-colours"]
+            with open(os.path.join(work_dir, "slave.log"), "w") as log:
+                process = subprocess.Popen(cmd, env=env, stdout=log,
+                                           stderr=subprocess.STDOUT)
+            self._add_slave(m_id, process, (ctl_addrs[m_id], self._port))
+
+            params = [("hostname", ctl_addrs[m_id]), ("rpc_port", self._port)]
+            params.extend(sorted(self._reqs[m_id]["params"].items()))
+            self._write_machine_file(m_id, params, sorted(interfaces[m_id]))
+
+    def _find_slave_script(self):
+        path = os.path.join(get_lnst_path(), "lnst-slave")
+        if os.path.isfile(path):
+            return path
+
+        path = find_executable("lnst-slave")
+        if path is None:
+            raise NetnsPoolError("lnst-slave executable not found")
+        return path
+
+    def _write_slave_config(self, work_dir):
+        path = os.path.join(work_dir, "lnst-slave.conf")
+        with open(path, "w") as f:
+            f.write("[environment]\n"
+                    "log_dir = %s\n"
+                    "use_nm = false\n"
+                    "[cache]\n"
+                    "cache_dir = %s\n" % (os.path.join(work_dir, "Logs"),
+                                          os.path.join(work_dir, "cache")))
+        return path
+
+    def _setup_ctl_link(self, index, netns):
+        subnet = self._ctl_net + 4 * index
+        root_addr = _int_to_ip(subnet + 1)
+        ns_addr = _int_to_ip(subnet + 2)
+
+        root_if = self._new_if_name("c")
+        ns_if = self._new_if_name("c")
+        run = self._shell.run
+        run("ip link add %s type veth peer name %s" % (root_if, ns_if))
+        run("ip link set %s netns %s" % (ns_if, netns))
+        run("ip addr add %s/30 dev %s" % (root_addr, root_if))
+        run("ip link set %s up" % root_if)
+        run("ip -n %s link set %s name lnst_ctl" % (netns, ns_if))
+        run("ip -n %s addr add %s/30 dev lnst_ctl" % (netns, ns_addr))
+        run("ip -n %s link set lnst_ctl up" % netns)
+        return ns_addr
+
+    def _setup_networks(self, interfaces):
+        networks = {}
+        for m_id, m in sorted(self._reqs.items()):
+            for if_id, dev in sorted(m["interfaces"].items()):
+                networks.setdefault(dev["network"], []).append((m_id, if_id))
+
+        for label, devs in sorted(networks.items()):
+            if len(devs) == 2:
+                peer_a = self._new_if_name("v")
+                peer_b = self._new_if_name("v")
+                self._shell.run("ip link add %s type veth peer name %s" %
+                                (peer_a, peer_b))
+                for (m_id, if_id), tmp_name in zip(devs, [peer_a, peer_b]):
+                    self._move_dev(m_id, if_id, tmp_name, label, interfaces)
+            else:
+                bridge = self._new_if_name("b")
+                self._shell.run("ip link add %s type bridge" % bridge)
+                self._shell.run("ip link set %s up" % bridge)
+                self._bridges.append(bridge)
+                for m_id, if_id in devs:
+                    peer_a = self._new_if_name("v")
+                    peer_b = self._new_if_name("v")
+                    self._shell.run("ip link add %s type veth peer name %s" %
+                                    (peer_a, peer_b))
+                    self._shell.run("ip link set %s master %s up" %
+                                    (peer_b, bridge))
+                    self._move_dev(m_id, if_id, peer_a, label, interfaces)
+
+    def _move_dev(self, m_id, if_id, tmp_name, label, interfaces):
+        netns = self._namespaces[m_id]
+        req_params = dict(self._reqs[m_id]["interfaces"][if_id]["params"])
+
+        driver = req_params.pop("driver", "veth")
+        if driver != "veth":
+            raise NetnsPoolError("Device %s of host %s requires driver %s, "
+                                 "only veth is available" %
+                                 (if_id, m_id, driver))
+
+        hwaddr = req_params.pop("hwaddr", None)
+        if hwaddr is None:
+            hwaddr = self._new_hwaddr()
+        hwaddr = hwaddr.upper()
+
+        self._shell.run("ip link set %s netns %s" % (tmp_name, netns))
+        self._shell.run("ip -n %s link set %s name %s address %s" %
+                        (netns, tmp_name, if_id, hwaddr))
+
+        params = [("hwaddr", hwaddr), ("driver", "veth")]
+        params.extend(sorted(req_params.items()))
+        interfaces[m_id].append((if_id, label, params))
+
+    def _cleanup(self):
+        self._shell = ExecCmdShell()
+        try:
+            self._remove_namespaces()
+        finally:
+            self._shell.close()
+
+    def _remove_namespaces(self):
+        #devices in the namespaces, including the peers of the control and
+        #bridged veth devices, are removed together with the namespaces
+        for m_id, netns in self._namespaces.items():
+            self._shell.run("ip netns del %s" % netns, die_on_err=False)
+        self._namespaces = {}
+
+        for bridge in self._bridges:
+            self._shell.run("ip link del %s" % bridge, die_on_err=False)
+        self._bridges = []
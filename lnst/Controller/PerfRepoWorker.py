@@ -0,0 +1,306 @@
+"""
+This module defines the PerfRepoWorker class that talks to a PerfRepo
+instance from a background thread so that recipes don't block on REST round
+trips. Uploads are sent in batches with retries, uploads that still fail are
+spooled to disk and replayed the next time a worker is started.
+
+Copyright 2017 Red Hat, Inc.
+Licensed under the GNU General Public License, version 2 as
+published by the Free Software Foundation; see COPYING for details.
+"""
+
+import os
+import time
+import atexit
+import logging
+import tempfile
+import threading
+import cPickle
+import Queue
+from lnst.Common.Utils import mkdir_p
+from lnst.Controller.Common import ControllerError
+from lnst.Controller.ResultsStore import config_hash
+
+#seconds the Controller waits at exit for queued operations, uploads still
+#queued after that are spooled
+STOP_TIMEOUT = 30
+
+class PerfRepoWorkerError(ControllerError):
+    pass
+
+class PerfRepoFuture(object):
+    """Handle to the result of an operation queued in a PerfRepoWorker"""
+    def __init__(self):
+        self._event = threading.Event()
+        self._result = None
+        self._exception = None
+        self._callbacks = []
+        self._lock = threading.Lock()
+
+    def done(self):
+        return self._event.is_set()
+
+    def result(self, timeout=None):
+        """waits for the operation to finish and returns its result
+
+        Raises the exception of the operation if it failed, or
+        PerfRepoWorkerError if the timeout expired.
+        """
+        self._event.wait(timeout)
+        if not self._event.is_set():
+            raise PerfRepoWorkerError("Timeout expired waiting for PerfRepo")
+        if self._exception is not None:
+            raise self._exception
+        return self._result
+
+    def add_done_callback(self, callback):
+        """calls callback(future) once the operation finishes"""
+        with self._lock:
+            if not self._event.is_set():
+                self._callbacks.append(callback)
+                return
+        callback(self)
+
+    def _set(self, result=None, exception=None):
+        with self._lock:
+            self._result = result
+            self._exception = exception
+            self._event.set()
+            callbacks = self._callbacks
+            self._callbacks = []
+        for callback in callbacks:
+            try:
+                callback(self)
+            except:
+                logging.exception("PerfRepo future callback failed")
+
+class _Task(object):
+    UPLOAD = "upload"
+    CALL = "call"
+
+    def __init__(self, kind, func=None, args=(), texec=None, hash_ignore=None,
+                 spool_file=None):
+        self.kind = kind
+        self.func = func
+        self.args = args
+        self.texec = texec
+        self.hash_ignore = hash_ignore
+        self.spool_file = spool_file
+        self.future = PerfRepoFuture()
+
+class PerfRepoWorker(object):
+    """Background PerfRepo client
+
+    Args:
+        rest_api -- PerfRepoRESTAPI object, uploads are spooled while the
+            server is unreachable
+        spool_dir -- directory for uploads that couldn't be delivered, if
+            empty failed uploads are dropped
+        retries -- how many times a failed upload is retried
+        retry_interval -- seconds to wait before the first retry, doubled
+            with every following retry
+        batch_size -- maximum number of queued operations processed in one
+            batch
+    """
+    _sentinel = object()
+
+    def __init__(self, rest_api, spool_dir="", retries=3, retry_interval=1.0,
+                 batch_size=32):
+        self._rest_api = rest_api
+        self._spool_dir = spool_dir
+        self._retries = retries
+        self._retry_interval = retry_interval
+        self._batch_size = batch_size
+
+        self._queue = Queue.Queue()
+        self._thread = None
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run,
+                                        name="PerfRepoWorker")
+        self._thread.daemon = True
+        self._thread.start()
+        atexit.register(self.stop, STOP_TIMEOUT)
+        self.replay_spool()
+
+    def stop(self, timeout=None):
+        """stops the worker after the already queued operations are done
+
+        If the timeout expires, uploads that didn't start yet are spooled.
+        """
+        if self._thread is None:
+            return
+        self._queue.put(self._sentinel)
+        self._thread.join(timeout)
+        if self._thread.is_alive():
+            logging.warning("PerfRepo worker didn't finish in time.")
+            self._spool_queued()
+        self._thread = None
+
+    def _spool_queued(self):
+        while True:
+            try:
+                task = self._queue.get_nowait()
+            except Queue.Empty:
+                return
+            if task is not self._sentinel and task.kind == _Task.UPLOAD:
+                self._fail_upload(task)
+            elif task is not self._sentinel:
+                task.future._set(exception=PerfRepoWorkerError(
+                                        "PerfRepo worker stopped"))
+            self._queue.task_done()
+
+    def flush(self):
+        """blocks until all queued operations are processed"""
+        self._queue.join()
+
+    def pending(self):
+        return self._queue.qsize()
+
+    def submit_upload(self, texec, hash_ignore=None):
+        """queues creation of a TestExecution, returns a PerfRepoFuture
+
+        A TestExecution without the Test uid (created while PerfRepo was
+        unreachable) gets it before the upload, together with the
+        configuration hash tag computed without the hash_ignore parameters.
+        """
+        return self._submit(_Task(_Task.UPLOAD, texec=texec,
+                                  hash_ignore=hash_ignore))
+
+    def submit_call(self, func, *args):
+        """queues a PerfRepoRESTAPI method call, returns a PerfRepoFuture"""
+        return self._submit(_Task(_Task.CALL, func=func, args=args))
+
+    def _submit(self, task):
+        if self._thread is None:
+            raise PerfRepoWorkerError("PerfRepo worker is not running.")
+        self._queue.put(task)
+        return task.future
+
+    def replay_spool(self):
+        """queues uploads of all TestExecutions spooled by earlier runs"""
+        if not self._spool_dir or not os.path.isdir(self._spool_dir):
+            return []
+
+        futures = []
+        for fname in sorted(os.listdir(self._spool_dir)):
+            if not fname.endswith(".texec"):
+                continue
+            path = os.path.join(self._spool_dir, fname)
+            try:
+                with open(path, "rb") as f:
+                    texec, hash_ignore = cPickle.load(f)
+            except Exception as e:
+                logging.error("Unable to load spooled PerfRepo result %s: %s"
+                              % (path, str(e)))
+                continue
+            logging.info("Replaying spooled PerfRepo result %s" % path)
+            futures.append(self._submit(_Task(_Task.UPLOAD, texec=texec,
+                                              hash_ignore=hash_ignore,
+                                              spool_file=path)))
+        return futures
+
+    def _run(self):
+        stop = False
+        while not stop:
+            batch = [self._queue.get()]
+            while len(batch) < self._batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except Queue.Empty:
+                    break
+
+            #lookups block the recipe, process them before uploads
+            calls = [t for t in batch if t is not self._sentinel and
+                                         t.kind == _Task.CALL]
+            uploads = [t for t in batch if t is not self._sentinel and
+                                           t.kind == _Task.UPLOAD]
+            stop = self._sentinel in batch
+
+            for task in calls:
+                self._do_call(task)
+            if len(uploads) > 0:
+                logging.debug("Sending batch of %d results to PerfRepo" %
+                              len(uploads))
+            #once an upload exhausted its retries PerfRepo is considered
+            #down, the rest of the batch is spooled right away
+            down = False
+            for task in uploads:
+                if down:
+                    self._fail_upload(task)
+                else:
+                    down = not self._do_upload(task)
+
+            for i in range(len(batch)):
+                self._queue.task_done()
+
+    def _do_call(self, task):
+        try:
+            res = task.func(*task.args)
+        except Exception as e:
+            task.future._set(exception=e)
+            return
+        task.future._set(result=res)
+
+    def _do_upload(self, task):
+        """sends the TestExecution with retries, returns False on failure"""
+        texec = task.texec
+        delay = self._retry_interval
+        for attempt in range(self._retries + 1):
+            if attempt > 0:
+                logging.debug("Retrying PerfRepo upload in %.1f seconds" %
+                              delay)
+                time.sleep(delay)
+                delay *= 2
+            try:
+                if texec.get_testUid() is None:
+                    self._resolve_test(task)
+                self._rest_api.testExecution_create(texec)
+            except Exception as e:
+                logging.debug("PerfRepo upload failed: %s" % str(e))
+                continue
+            if texec.get_id() is not None:
+                if task.spool_file is not None:
+                    os.unlink(task.spool_file)
+                task.future._set(result=texec)
+                return True
+
+        self._fail_upload(task)
+        return False
+
+    def _resolve_test(self, task):
+        """sets the Test uid of a TestExecution that references its Test by
+        id and adds the configuration hash tag that needs the uid"""
+        texec = task.texec
+        test = self._rest_api.test_get_by_id(texec.get_testId(), log=False)
+        if test is None:
+            raise PerfRepoWorkerError("No Test with id '%s' found" %
+                                      texec.get_testId())
+        texec.set_testUid(test.get_uid())
+        h = config_hash(test.get_uid(), texec.get_tags(),
+                        texec.get_parameters(), task.hash_ignore or [])
+        logging.debug("Adding hash '%s' as tag to result." % h)
+        texec.add_tag(h)
+
+    def _fail_upload(self, task):
+        texec = task.texec
+        err = PerfRepoWorkerError("Failed to send TestExecution '%s' to "
+                                  "PerfRepo" % texec.get_name())
+        logging.error(str(err))
+        if task.spool_file is None:
+            self._spool(texec, task.hash_ignore)
+        task.future._set(exception=err)
+
+    def _spool(self, texec, hash_ignore=None):
+        if not self._spool_dir:
+            return None
+        mkdir_p(self._spool_dir)
+        fd, path = tempfile.mkstemp(suffix=".texec",
+                                    prefix="%d_" % int(time.time()),
+                                    dir=self._spool_dir)
+        with os.fdopen(fd, "wb") as f:
+            cPickle.dump((texec, hash_ignore), f, cPickle.HIGHEST_PROTOCOL)
+        logging.warning("PerfRepo result spooled to %s" % path)
+        return path
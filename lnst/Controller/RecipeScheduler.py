@@ -0,0 +1,302 @@
+"""
+This module defines the RecipeScheduler class that runs a queue of Recipes
+concurrently on disjoint sets of machines from the Controller's pools.
+
+Copyright 2017 Red Hat, Inc.
+Licensed under the GNU General Public License, version 2 as
+published by the Free Software Foundation; see COPYING for details.
+"""
+
+import sys
+import time
+import Queue
+import logging
+import multiprocessing
+from lnst.Common.Logs import log_exc_traceback
+from lnst.Controller.Common import ControllerError
+from lnst.Controller.MachineMapper import MapperError
+from lnst.Controller.MessageDispatcher import MessageDispatcher
+
+#number of MAC addresses given to each running Recipe for virtual devices
+MAC_POOL_BLOCK = 256
+
+class RecipeRun(object):
+    """Describes the execution of one Recipe from the queue
+
+    Attributes:
+        index -- position of the Recipe in the queue
+        name -- class name of the Recipe
+        status -- "PASS", "FAIL" or "UNMATCHED" once finished, None before
+        error -- error message if the Recipe failed
+        pool_name, targets -- the pool and its machines the Recipe ran on
+        log_path -- directory with the logs of the Recipe
+        start_time, end_time -- timestamps of the execution
+    """
+    def __init__(self, index, recipe):
+        self.index = index
+        self.recipe = recipe
+        self.name = recipe.__class__.__name__
+        self.status = None
+        self.error = None
+        self.pool_name = None
+        self.targets = []
+        self.log_path = None
+        self.start_time = None
+        self.end_time = None
+        self._process = None
+
+    @property
+    def passed(self):
+        return self.status == "PASS"
+
+    def __str__(self):
+        return "%02d %s: %s" % (self.index + 1, self.name, self.status)
+
+class RecipeScheduler(object):
+    """Runs Recipes concurrently on disjoint subsets of the pools
+
+    Whenever a Recipe finishes, the queue is searched in order for Recipes
+    that the Mapper can match to the currently free machines. Every started
+    Recipe runs in its own process with its own connections to the matched
+    machines, this is required because a Slave accepts a single controller
+    connection.
+
+    The connections of the Controller to all pool machines are closed for
+    the duration of the queue and reopened at the end. libvirt is opened
+    only by the Recipe processes, the Controller process mustn't use it
+    before the queue.
+    """
+    def __init__(self, controller, max_parallel=0):
+        self._ctl = controller
+        self._max_parallel = max_parallel
+        self._pending = []
+        self._running = {}
+        self._busy = set()
+        self._results = None
+
+    def run(self, recipes, **kwargs):
+        self._check_libvirt()
+        kwargs.pop("multimatch", None)
+        runs = [RecipeRun(i, recipe) for i, recipe in enumerate(recipes)]
+        self._pending = list(runs)
+        self._results = multiprocessing.Queue()
+
+        released = self._release_machines()
+        try:
+            finished = True
+            while len(self._pending) > 0 or len(self._running) > 0:
+                #matching is only retried when some machines were freed
+                if finished:
+                    self._start_pending(kwargs)
+
+                if len(self._running) == 0:
+                    #all machines are free, the rest can never be matched
+                    for run in self._pending:
+                        run.status = "UNMATCHED"
+                        run.error = "This setup cannot be provisioned with "\
+                                    "the current pool."
+                        logging.error("Recipe %s: %s" % (run.name, run.error))
+                    self._pending = []
+                    break
+
+                finished = self._wait_for_results()
+        finally:
+            for run in self._running.values():
+                logging.info("Terminating recipe %s" % run.name)
+                run._process.terminate()
+                run._process.join()
+            self._running = {}
+            self._reconnect_machines(released)
+
+        self._print_summary(runs)
+        return runs
+
+    def _check_libvirt(self):
+        """libvirt may only be opened by the forked Recipe processes
+
+        A forked child would inherit the connection and the state of the
+        event loop thread, including locks held by it at the time of fork.
+        """
+        for mod_name in ["lnst.Controller.VirtDomainCtl",
+                         "lnst.Devices.VirtNetCtl"]:
+            if mod_name in sys.modules and \
+               sys.modules[mod_name].libvirt_initialized():
+                raise ControllerError("libvirt was already used by this "
+                                      "process, recipe queues have to be "
+                                      "run before Controller.run() with "
+                                      "virtual machines.")
+
+    def _release_machines(self):
+        """disconnects the Controller from all pool machines
+
+        Forked processes inherit open sockets, a Slave wouldn't see the
+        connection closed if any process still held it.
+        """
+        msg_dispatcher = self._ctl._msg_dispatcher
+        released = []
+        for pool in self._ctl._pools.get_machine_pools().values():
+            for machine in pool.values():
+                if msg_dispatcher.get_connection(machine) is not None:
+                    msg_dispatcher.disconnect_slave(machine)
+                    released.append(machine)
+        return released
+
+    def _reconnect_machines(self, machines):
+        for machine in machines:
+            try:
+                machine._init_connection()
+            except Exception as exc:
+                logging.error("Reconnecting to machine %s failed: %s" %
+                              (machine.get_id(), str(exc)))
+
+    def _free_pools(self):
+        pools = {}
+        for pool_name, pool in self._ctl._pools.get_pools().items():
+            pools[pool_name] = {}
+            for m_id, m_spec in pool.items():
+                if (pool_name, m_id) not in self._busy:
+                    pools[pool_name][m_id] = m_spec
+        return pools
+
+    def _find_match(self, run, kwargs):
+        #a new mapper each time, the matching state isn't reset completely
+        mapper = self._ctl._mapper.__class__()
+        mapper.set_pools(self._free_pools())
+        mapper.set_requirements(run.recipe.req._to_dict())
+        try:
+            return next(mapper.matches(**kwargs))
+        except (MapperError, StopIteration):
+            return None
+
+    def _start_pending(self, kwargs):
+        for run in list(self._pending):
+            if self._max_parallel and \
+               len(self._running) >= self._max_parallel:
+                return
+
+            match = self._find_match(run, kwargs)
+            if match is None:
+                continue
+
+            self._pending.remove(run)
+            self._start(run, match)
+
+    def _start(self, run, match):
+        run.pool_name = match["pool_name"]
+        run.targets = sorted([m["target"]
+                              for m in match["machines"].values()])
+        run.start_time = time.time()
+
+        for target in run.targets:
+            self._busy.add((run.pool_name, target))
+
+        logging.info("Starting recipe %s on %s: %s" % (run.name,
+                                                       run.pool_name,
+                                                       ", ".join(run.targets)))
+
+        mac_pool = None
+        if match["virtual"]:
+            mac_pool = self._split_mac_pool()
+        run._process = multiprocessing.Process(target=self._worker,
+                                               args=(run, match, mac_pool),
+                                               name="recipe_%s" % run.name)
+        run._process.start()
+        self._running[run.index] = run
+
+    def _split_mac_pool(self):
+        """returns a MacPool with a block of the Controller's addresses
+
+        Recipes running in other processes can't share the MacPool object.
+        """
+        return self._ctl._mac_pool.split(MAC_POOL_BLOCK)
+
+    def _worker(self, run, match, mac_pool):
+        """runs in the forked process of the Recipe"""
+        ctl = self._ctl
+        ctl._log_ctl.set_recipe("%02d_%s" % (run.index + 1, run.name))
+        if mac_pool is not None:
+            ctl._mac_pool = mac_pool
+        ctl._network_bridges = {}
+        ctl._msg_dispatcher = MessageDispatcher(ctl._log_ctl)
+
+        result = {"index": run.index,
+                  "status": "PASS",
+                  "error": None,
+                  "log_path": ctl._log_ctl.get_recipe_log_path()}
+        pool = {}
+        try:
+            for target in run.targets:
+                pool[target] = ctl._pools.create_machine(run.pool_name, target,
+                                                         ctl._msg_dispatcher)
+        except Exception as exc:
+            logging.error("Connecting to the matched machines failed")
+            log_exc_traceback()
+            result["status"] = "FAIL"
+            result["error"] = str(exc)
+
+        if result["status"] == "PASS":
+            try:
+                ctl._run_match(run.recipe, match, pool)
+            except Exception as exc:
+                result["status"] = "FAIL"
+                result["error"] = str(exc)
+
+        for machine in pool.values():
+            if ctl._msg_dispatcher.get_connection(machine) is not None:
+                ctl._msg_dispatcher.disconnect_slave(machine)
+
+        self._results.put(result)
+
+    def _wait_for_results(self):
+        """waits up to a second for finished Recipes
+
+        Returns True if any Recipe finished.
+        """
+        running = len(self._running)
+        try:
+            self._finish(self._results.get(timeout=1))
+        except Queue.Empty:
+            pass
+
+        for run in list(self._running.values()):
+            if run._process.is_alive():
+                continue
+
+            #the result is written before the process exits
+            while True:
+                try:
+                    self._finish(self._results.get_nowait())
+                except Queue.Empty:
+                    break
+
+            if run.index in self._running:
+                self._finish({"index": run.index,
+                              "status": "FAIL",
+                              "error": "Recipe process exited with code %s" %
+                                       run._process.exitcode,
+                              "log_path": None})
+
+        return len(self._running) < running
+
+    def _finish(self, result):
+        run = self._running.pop(result["index"])
+        run._process.join()
+        run._process = None
+        run.end_time = time.time()
+        run.status = result["status"]
+        run.error = result["error"]
+        run.log_path = result["log_path"]
+
+        for target in run.targets:
+            self._busy.discard((run.pool_name, target))
+
+        logging.info("Recipe %s finished: %s (%.1fs)" %
+                     (run.name, run.status, run.end_time - run.start_time))
+
+    def _print_summary(self, runs):
+        logging.info("Recipe queue summary:")
+        for run in runs:
+            if run.error:
+                logging.info("  %s (%s)" % (str(run), run.error))
+            else:
+                logging.info("  %s" % str(run))
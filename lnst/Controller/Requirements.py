@@ -51,8 +51,7 @@ class HostReq(object):
             setattr(self.params, name, p)
 
     def __iter__(self):
-        for x in dir(self):
-            val = getattr(self, x)
+        for x, val in sorted(self.__dict__.items()):
             if isinstance(val, DeviceReq):
                 yield (x, val)
 
@@ -107,7 +106,6 @@ class _Requirements(object):
         return res
 
     def __iter__(self):
-        for x in dir(self):
-            val = getattr(self, x)
+        for x, val in sorted(self.__dict__.items()):
             if isinstance(val, HostReq):
                 yield (x, val)
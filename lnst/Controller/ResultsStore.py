@@ -0,0 +1,560 @@
+"""
+This module defines the ResultsStore class, a local SQLite based storage of
+performance measurements, and the StoreResult and StoreBaseline classes
+that mirror the PerfRepoResult and PerfRepoBaseline interfaces so that
+recipes and the PerfRepoUtils templates work with both.
+
+Regressions are detected against a rolling baseline made of the last N
+results with the same configuration hash, using one of the statistical tests
+defined in REGRESSION_TESTS.
+
+Copyright 2017 Red Hat, Inc.
+Licensed under the GNU General Public License, version 2 as
+published by the Free Software Foundation; see COPYING for details.
+"""
+
+import os
+import re
+import math
+import time
+import json
+import hashlib
+import logging
+import sqlite3
+from lnst.Common.Utils import dict_to_dot, list_to_dot, mkdir_p
+from lnst.Controller.Common import ControllerError
+
+class ResultsStoreError(ControllerError):
+    pass
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS results (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    recipe TEXT,
+    mapping_key TEXT,
+    name TEXT,
+    hash TEXT NOT NULL,
+    timestamp REAL NOT NULL,
+    comment TEXT
+);
+CREATE INDEX IF NOT EXISTS results_hash ON results (hash, timestamp);
+CREATE TABLE IF NOT EXISTS result_values (
+    result_id INTEGER NOT NULL REFERENCES results(id),
+    metric TEXT NOT NULL,
+    value REAL NOT NULL,
+    samples TEXT,
+    comparator TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS result_values_id ON result_values (result_id);
+CREATE TABLE IF NOT EXISTS result_parameters (
+    result_id INTEGER NOT NULL REFERENCES results(id),
+    name TEXT NOT NULL,
+    value TEXT
+);
+CREATE TABLE IF NOT EXISTS result_tags (
+    result_id INTEGER NOT NULL REFERENCES results(id),
+    tag TEXT NOT NULL
+);
+"""
+
+def _mean(values):
+    return sum(values) / float(len(values))
+
+def _variance(values):
+    if len(values) < 2:
+        return 0.0
+    mean = _mean(values)
+    return sum([(x - mean)**2 for x in values]) / (len(values) - 1)
+
+def _betacf(a, b, x):
+    """continued fraction of the incomplete beta function (modified Lentz)"""
+    tiny = 1e-30
+    qab = a + b
+    qap = a + 1.0
+    qam = a - 1.0
+    c = 1.0
+    d = 1.0 - qab * x / qap
+    if abs(d) < tiny:
+        d = tiny
+    d = 1.0 / d
+    h = d
+    for m in range(1, 201):
+        m2 = 2 * m
+        aa = m * (b - m) * x / ((qam + m2) * (a + m2))
+        d = 1.0 + aa * d
+        if abs(d) < tiny:
+            d = tiny
+        c = 1.0 + aa / c
+        if abs(c) < tiny:
+            c = tiny
+        d = 1.0 / d
+        h *= d * c
+        aa = -(a + m) * (qab + m) * x / ((a + m2) * (qap + m2))
+        d = 1.0 + aa * d
+        if abs(d) < tiny:
+            d = tiny
+        c = 1.0 + aa / c
+        if abs(c) < tiny:
+            c = tiny
+        d = 1.0 / d
+        delta = d * c
+        h *= delta
+        if abs(delta - 1.0) < 3e-12:
+            break
+    return h
+
+def _betainc(a, b, x):
+    """regularized incomplete beta function I_x(a, b)"""
+    if x <= 0.0:
+        return 0.0
+    if x >= 1.0:
+        return 1.0
+    lbeta = math.lgamma(a + b) - math.lgamma(a) - math.lgamma(b)
+    front = math.exp(lbeta + a * math.log(x) + b * math.log(1.0 - x))
+    if x < (a + 1.0) / (a + b + 2.0):
+        return front * _betacf(a, b, x) / a
+    return 1.0 - front * _betacf(b, a, 1.0 - x) / b
+
+def _t_sf(t, df):
+    """survival function P(T > t) of the Student's t distribution"""
+    df = float(df)
+    p = 0.5 * _betainc(df / 2.0, 0.5, df / (df + t * t))
+    if t < 0:
+        return 1.0 - p
+    return p
+
+def zscore_test(current, baseline, comparator, config):
+    """compares the mean of the current samples to the distribution of the
+    baseline result means
+
+    The standard deviation is at least the tolerance fraction of the
+    baseline mean, so a stable baseline doesn't turn any tiny worsening into
+    a regression.
+    """
+    if len(baseline) < 2:
+        return None
+
+    base_means = [_mean(samples) for samples in baseline]
+    base_mean = _mean(base_means)
+    base_stdev = math.sqrt(_variance(base_means))
+    base_stdev = max(base_stdev, config["tolerance"] * abs(base_mean))
+    cur_mean = _mean(current)
+
+    diff = cur_mean - base_mean
+    if comparator == "HB":
+        diff = -diff
+
+    if base_stdev == 0.0:
+        score = float("inf") if diff > 0 else 0.0
+    else:
+        score = diff / base_stdev
+
+    return {"regression": score > config["zscore_limit"],
+            "statistic": score,
+            "baseline_mean": base_mean,
+            "current_mean": cur_mean}
+
+def welch_test(current, baseline, comparator, config):
+    """one-sided Welch's t-test of the current samples against all samples of
+    the baseline results"""
+    base_samples = []
+    for samples in baseline:
+        base_samples.extend(samples)
+    if len(base_samples) < 2 or len(current) < 2:
+        return None
+
+    n1, n2 = float(len(current)), float(len(base_samples))
+    v1, v2 = _variance(current) / n1, _variance(base_samples) / n2
+    cur_mean, base_mean = _mean(current), _mean(base_samples)
+
+    diff = cur_mean - base_mean
+    if comparator == "HB":
+        diff = -diff
+
+    if v1 + v2 == 0.0:
+        #constant samples, only a difference above the tolerance counts
+        p_value = 0.0 if diff > config["tolerance"] * abs(base_mean) else 1.0
+        t = 0.0
+    else:
+        t = diff / math.sqrt(v1 + v2)
+        df = (v1 + v2)**2 / (v1**2 / (n1 - 1) + v2**2 / (n2 - 1))
+        p_value = _t_sf(t, df)
+
+    return {"regression": p_value < config["significance"],
+            "statistic": t,
+            "p_value": p_value,
+            "baseline_mean": base_mean,
+            "current_mean": cur_mean}
+
+REGRESSION_TESTS = {"zscore": zscore_test,
+                    "welch": welch_test}
+
+class StoreResult(object):
+    """Result object of the local ResultsStore
+
+    Implements the same interface as PerfRepoResult. Values can be either a
+    single number or a list of samples, in which case their mean is used as
+    the value and the samples are available to the statistical tests.
+    """
+    def __init__(self, mapping_key, name, hash_ignore=[]):
+        self._mapping_key = mapping_key
+        self._name = name
+        self._hash_ignore = list(hash_ignore)
+        self._values = {}
+        self._parameters = []
+        self._tags = []
+        self._comment = None
+        self._id = None
+
+    def add_value(self, val_name, value, comparator="HB"):
+        if comparator not in ["HB", "LB"]:
+            raise ResultsStoreError("Comparator must be either HB or LB")
+        if isinstance(value, (list, tuple)):
+            samples = [float(x) for x in value]
+        else:
+            samples = [float(value)]
+        if len(samples) == 0:
+            raise ResultsStoreError("Value %s has no samples" % val_name)
+        self._values[val_name] = {"samples": samples,
+                                  "comparator": comparator}
+
+    def get_value(self, val_name):
+        try:
+            return _mean(self._values[val_name]["samples"])
+        except KeyError:
+            return None
+
+    def get_values(self):
+        return self._values
+
+    def set_configuration(self, configuration):
+        for pair in dict_to_dot(configuration, "configuration."):
+            self.set_parameter(pair[0], pair[1])
+
+    def set_mapping(self, mapping):
+        for pair in list_to_dot(mapping, "mapping.", "machine"):
+            self.set_parameter(pair[0], pair[1])
+
+    def set_tag(self, tag):
+        self._tags.append(tag)
+
+    def add_tag(self, tag):
+        self.set_tag(tag)
+
+    def set_tags(self, tags):
+        for tag in tags:
+            self.set_tag(tag)
+
+    def add_tags(self, tags):
+        self.set_tags(tags)
+
+    def get_tags(self):
+        return self._tags
+
+    def set_parameter(self, name, value):
+        self._parameters.append((name, value))
+
+    def set_parameters(self, params):
+        for name, value in params:
+            self.set_parameter(name, value)
+
+    def get_parameters(self):
+        return self._parameters
+
+    def set_hash_ignore(self, hash_ignore):
+        self._hash_ignore = hash_ignore
+
+    def get_hash_ignore(self):
+        return self._hash_ignore
+
+    def set_comment(self, comment):
+        if comment:
+            self._comment = comment
+
+    def get_comment(self):
+        return self._comment
+
+    def get_mapping_key(self):
+        return self._mapping_key
+
+    def get_name(self):
+        return self._name
+
+    def get_id(self):
+        """id of the stored record, None if the result wasn't saved yet"""
+        return self._id
+
+    def set_id(self, res_id):
+        self._id = res_id
+
+    def generate_hash(self, ignore=[]):
+        ignore = list(ignore) + self._hash_ignore
+        return config_hash(self._mapping_key, self._tags, self._parameters,
+                           ignore)
+
+def config_hash(key, tags, params, ignore=[]):
+    """hash identifying results of the same test in the same configuration
+
+    Computed the same way as PerfRepoResult.generate_hash with the mapping
+    key taking the place of the PerfRepo test uid. The mapping key is known
+    with and without a PerfRepo connection, so local and mirrored PerfRepo
+    results of the same test share the hash.
+    """
+    sha1 = hashlib.sha1()
+    sha1.update(str(key))
+    for i in sorted(tags):
+        sha1.update(i)
+    for i in sorted(params, key=lambda x: x[0]):
+        skip = False
+        for j in ignore:
+            if re.search(j, i[0]):
+                skip = True
+                break
+        if skip:
+            continue
+        sha1.update(i[0])
+        sha1.update(str(i[1]))
+    return sha1.hexdigest()
+
+class StoreBaseline(object):
+    """Rolling baseline of the local ResultsStore
+
+    Implements the same interface as PerfRepoBaseline, values are the means
+    over the results in the baseline window.
+    """
+    def __init__(self, results):
+        self._results = results
+
+    def get_value(self, name):
+        values = [res["values"][name]["value"] for res in self._results
+                  if name in res["values"]]
+        if len(values) == 0:
+            return None
+        return _mean(values)
+
+    def get_samples(self, name):
+        """returns a list of sample lists, one per baseline result"""
+        return [res["values"][name]["samples"] for res in self._results
+                if name in res["values"]]
+
+    def get_results(self):
+        return self._results
+
+    def get_texec(self):
+        if len(self._results) == 0:
+            return None
+        return self._results
+
+class ResultsStore(object):
+    """Local SQLite storage of measurement results
+
+    Args:
+        path -- path to the database file, created if it doesn't exist
+        window -- number of most recent results with matching hash that
+            form the rolling baseline
+        test -- name of the statistical test from REGRESSION_TESTS
+        zscore_limit -- number of baseline standard deviations the current
+            value has to be worse by to be reported by the zscore test
+        significance -- p-value limit of the welch test
+        tolerance -- relative difference from the baseline mean that is
+            never reported as a regression of a baseline without variance
+    """
+    def __init__(self, path, window=10, test="zscore", zscore_limit=3.0,
+                 significance=0.05, tolerance=0.01):
+        if test not in REGRESSION_TESTS:
+            raise ResultsStoreError("Unknown regression test '%s'" % test)
+        self._path = path
+        self._window = window
+        self._test = test
+        self._test_config = {"zscore_limit": zscore_limit,
+                             "significance": significance,
+                             "tolerance": tolerance}
+        self._recipe = None
+
+        dirname = os.path.dirname(path)
+        if dirname:
+            mkdir_p(dirname)
+        self._db = sqlite3.connect(path)
+        self._db.executescript(SCHEMA)
+        self._db.commit()
+
+    @classmethod
+    def from_config(cls, config, path=None):
+        """creates a store configured by the [results_store] config section"""
+        if path is None:
+            path = config.get_option("results_store", "path")
+        return cls(path,
+                   window=config.get_option("results_store", "baseline_window"),
+                   test=config.get_option("results_store", "regression_test"),
+                   zscore_limit=config.get_option("results_store",
+                                                  "zscore_limit"),
+                   significance=config.get_option("results_store",
+                                                  "significance"),
+                   tolerance=config.get_option("results_store", "tolerance"))
+
+    def get_path(self):
+        return self._path
+
+    def set_recipe(self, recipe):
+        """sets the recipe stored with results saved without one"""
+        self._recipe = recipe
+
+    def close(self):
+        self._db.close()
+
+    def new_result(self, mapping_key, name, hash_ignore=[]):
+        return StoreResult(mapping_key, name, hash_ignore)
+
+    def save_result(self, result, recipe=None):
+        """stores a StoreResult, returns the id of the new record"""
+        if not isinstance(result, StoreResult):
+            raise ResultsStoreError("Parameter result must be an instance "\
+                                    "of StoreResult")
+        if len(result.get_values()) < 1:
+            logging.debug("StoreResult with no result data, skipping.")
+            return None
+
+        values = []
+        for metric, val in result.get_values().items():
+            values.append((metric, val["samples"], val["comparator"]))
+        res_id = self._insert(recipe, result.get_mapping_key(),
+                              result.get_name(), result.generate_hash(),
+                              result.get_comment(), values,
+                              result.get_parameters(), result.get_tags())
+        result.set_id(res_id)
+        return res_id
+
+    def save_perfrepo_result(self, result, recipe=None):
+        """stores a copy of a PerfRepoResult
+
+        The result is keyed by its mapping key like a StoreResult, so the
+        baselines combine runs with and without a PerfRepo connection.
+        """
+        texec = result.get_testExecution()
+        if len(texec.get_values()) < 1:
+            return None
+
+        comparators = {}
+        try:
+            for metric in result.get_test().get_metrics():
+                comparators[metric.get_name()] = metric.get_comparator()
+        except AttributeError:
+            logging.debug("Unable to read metric comparators of the Test.")
+
+        values = []
+        for value in texec.get_values():
+            name = value.get_metricName()
+            values.append((name, [float(value.get_result())],
+                           comparators.get(name, "HB")))
+
+        key = result.get_mapping_key()
+        res_hash = config_hash(key, texec.get_tags(), texec.get_parameters(),
+                               result.get_hash_ignore())
+        return self._insert(recipe, key, texec.get_name(), res_hash,
+                            texec.get_comment(), values,
+                            texec.get_parameters(), texec.get_tags())
+
+    def _insert(self, recipe, key, name, res_hash, comment, values,
+                params, tags):
+        if recipe is None:
+            recipe = self._recipe
+
+        with self._db:
+            cur = self._db.execute(
+                    "INSERT INTO results (recipe, mapping_key, name, hash, "
+                    "timestamp, comment) VALUES (?, ?, ?, ?, ?, ?)",
+                    (recipe, key, name, res_hash, time.time(), comment))
+            res_id = cur.lastrowid
+            self._db.executemany(
+                    "INSERT INTO result_values VALUES (?, ?, ?, ?, ?)",
+                    [(res_id, metric, _mean(samples), json.dumps(samples),
+                      comp) for metric, samples, comp in values])
+            self._db.executemany(
+                    "INSERT INTO result_parameters VALUES (?, ?, ?)",
+                    [(res_id, pname, str(pval)) for pname, pval in params])
+            self._db.executemany(
+                    "INSERT INTO result_tags VALUES (?, ?)",
+                    [(res_id, tag) for tag in tags])
+        logging.debug("Result '%s' stored locally with id %d and hash '%s'" %
+                      (name, res_id, res_hash))
+        return res_id
+
+    def get_baseline(self, res_hash, exclude=None):
+        """returns a StoreBaseline of the last 'window' results with the hash
+
+        Args:
+            exclude -- optional result id to leave out of the baseline (e.g.
+                the result that's being compared)
+        """
+        query = "SELECT id FROM results WHERE hash = ?"
+        args = [res_hash]
+        if exclude is not None:
+            query += " AND id != ?"
+            args.append(exclude)
+        query += " ORDER BY timestamp DESC, id DESC LIMIT ?"
+        args.append(self._window)
+
+        ids = [row[0] for row in self._db.execute(query, args)]
+        results = []
+        for res_id in ids:
+            vals = {}
+            for metric, value, samples, comp in self._db.execute(
+                    "SELECT metric, value, samples, comparator "
+                    "FROM result_values WHERE result_id = ?", (res_id,)):
+                vals[metric] = {"value": value,
+                                "samples": json.loads(samples),
+                                "comparator": comp}
+            results.append({"id": res_id, "values": vals})
+        return StoreBaseline(results)
+
+    def get_baseline_of_result(self, result):
+        """returns the StoreBaseline of a StoreResult
+
+        If the result was already saved it's not part of its own baseline.
+        """
+        res_hash = result.generate_hash()
+        logging.debug("Result hash is: '%s'" % res_hash)
+        baseline = self.get_baseline(res_hash, result.get_id())
+        if baseline.get_texec() is None:
+            logging.debug("No baseline stored for results with hash %s" %
+                          res_hash)
+        return baseline
+
+    def check_regression(self, result, metric_name, baseline=None):
+        """runs the configured statistical test of a result metric
+
+        Returns a dictionary with the test details and the boolean
+        'regression' item, or None if the baseline doesn't contain enough
+        data for the test.
+        """
+        values = result.get_values()
+        if metric_name not in values:
+            raise ResultsStoreError("Result has no value '%s'" % metric_name)
+        if baseline is None:
+            baseline = self.get_baseline_of_result(result)
+
+        current = values[metric_name]["samples"]
+        comparator = values[metric_name]["comparator"]
+        res = REGRESSION_TESTS[self._test](current,
+                                           baseline.get_samples(metric_name),
+                                           comparator, self._test_config)
+        if res is None:
+            logging.debug("Not enough baseline data to test '%s'" %
+                          metric_name)
+            return None
+
+        res["test"] = self._test
+        res["metric"] = metric_name
+        if res["regression"]:
+            logging.warning("Regression of '%s' detected by the %s test: "
+                            "%f (current) vs %f (baseline)" %
+                            (metric_name, self._test, res["current_mean"],
+                             res["baseline_mean"]))
+        return res
+
+    def compare_to_baseline(self, result, metric_name):
+        """returns False if a regression of the metric was detected"""
+        res = self.check_regression(result, metric_name)
+        if res is None:
+            return True
+        return not res["regression"]
@@ -0,0 +1,117 @@
+"""
+This module defines the SimulatedPool class that runs simulated Slaves
+(lnst.Slave.SimulatedSlave) on localhost and describes them in a pool
+directory. Together with the real Controller this allows benchmarking of the
+Controller code paths without any test machines.
+
+Example:
+    pool = SimulatedPool(machine_count=10, device_count=4)
+    pool.start()
+    try:
+        ctl = Controller(pools=[pool.get_pool_dir()])
+        ctl.run(MyRecipe())
+    finally:
+        pool.stop()
+
+Copyright 2017 Red Hat, Inc.
+Licensed under the GNU General Public License, version 2 as
+published by the Free Software Foundation; see COPYING for details.
+"""
+
+import os
+import sys
+import json
+import subprocess
+from lnst.Controller.LocalPool import LocalPool, get_lnst_path
+
+DEFAULT_SIM_PORT = 9100
+
+def sim_address(machine_index):
+    """loopback address of a simulated Slave, all of 127.0.0.0/8 is local"""
+    index = machine_index + 1
+    return "127.%d.%d.%d" % ((index >> 16) & 0xff, (index >> 8) & 0xff,
+                             index & 0xff)
+
+def sim_hwaddr(machine_index, dev_index):
+    """hwaddr of a test device of a simulated Slave
+
+    Has to stay in sync with SimulatedInterfaceManager.get_hwaddr.
+    """
+    return "02:00:%02X:%02X:%02X:%02X" % ((machine_index >> 8) & 0xff,
+                                          machine_index & 0xff,
+                                          (dev_index >> 8) & 0xff,
+                                          dev_index & 0xff)
+
+class SimulatedPool(LocalPool):
+    """Runs simulated Slaves as local processes
+
+    Every Slave listens on its own loopback address (127.0.0.1, 127.0.0.2,
+    ...) since the pool doesn't allow two machines with the same hostname.
+    All test devices are connected to the network label net_label.
+
+    Args:
+        machine_count -- number of simulated Slaves
+        device_count -- number of test devices of each Slave
+        port -- port the Slaves listen on
+        latency -- delay in seconds added to every RPC call
+        method_latency -- dictionary of per method delays
+        net_label -- network label of the test devices
+        debug -- if True the Slaves log to the terminal
+    """
+    _work_dir_prefix = "lnst_sim_"
+
+    def __init__(self, machine_count=2, device_count=2,
+                 port=DEFAULT_SIM_PORT, latency=0.0, method_latency={},
+                 net_label="sim_network", debug=False):
+        super(SimulatedPool, self).__init__()
+        self._machine_count = machine_count
+        self._device_count = device_count
+        self._port = port
+        self._latency = latency
+        self._method_latency = method_latency
+        self._net_label = net_label
+        self._debug = debug
+
+    def _start_slaves(self):
+        #the Slave modules have to be imported in a fresh interpreter
+        env = dict(os.environ)
+        env["PYTHONPATH"] = os.pathsep.join([get_lnst_path()] +
+                                            [p for p in [env.get("PYTHONPATH")]
+                                             if p])
+
+        if self._debug:
+            output = None
+        else:
+            output = open(os.devnull, "w")
+
+        try:
+            for i in range(self._machine_count):
+                m_id = "sim%d" % i
+                work_dir = os.path.join(self.get_work_dir(), m_id)
+                os.mkdir(work_dir)
+
+                cmd = [sys.executable, "-m", "lnst.Slave.SimulatedSlave",
+                       "--address", sim_address(i),
+                       "--port", str(self._port), "--work-dir", work_dir,
+                       "--index", str(i),
+                       "--devices", str(self._device_count),
+                       "--latency", str(self._latency),
+                       "--method-latency", json.dumps(self._method_latency)]
+                if self._debug:
+                    cmd.append("--debug")
+
+                process = subprocess.Popen(cmd, env=env, stdout=output,
+                                           stderr=output)
+                self._add_slave(m_id, process, (sim_address(i), self._port))
+
+                params = [("hostname", sim_address(i)),
+                          ("rpc_port", self._port)]
+                interfaces = []
+                for j in range(self._device_count):
+                    interfaces.append(("eth%d" % j, self._net_label,
+                                       [("hwaddr", sim_hwaddr(i, j)),
+                                        ("driver", "sim")]))
+                self._write_machine_file(m_id, params, interfaces)
+        finally:
+            if output is not None:
+                output.close()
@@ -16,24 +16,33 @@ import sys
 from lxml import etree
 from lnst.Controller.Common import ControllerError
 
+def get_schema_path(ctl_config):
+    # locate the schema file
+    # try git path
+    dirname = os.path.dirname(sys.argv[0])
+    schema_path = os.path.join(dirname, "schema-sm.rng")
+    if not os.path.exists(schema_path):
+        # try configuration
+        res_dir = ctl_config.get_option("environment", "resource_dir")
+        schema_path = os.path.join(res_dir, "schema-sm.rng")
+
+    if not os.path.exists(schema_path):
+        raise Exception("The schema file was not found. " + \
+                        "Your LNST installation is corrupt!")
+    return schema_path
+
 class SlaveMachineParser(object):
+    # compiled schemas shared by all parsers, indexed by path
+    _schemas = {}
+
     def __init__(self, sm_path, ctl_config):
-        # locate the schema file
-        # try git path
-        dirname = os.path.dirname(sys.argv[0])
-        schema_path = os.path.join(dirname, "schema-sm.rng")
-        if not os.path.exists(schema_path):
-            # try configuration
-            res_dir = ctl_config.get_option("environment", "resource_dir")
-            schema_path = os.path.join(res_dir, "schema-sm.rng")
-
-        if not os.path.exists(schema_path):
-            raise Exception("The schema file was not found. " + \
-                            "Your LNST installation is corrupt!")
+        schema_path = get_schema_path(ctl_config)
 
         self._path = sm_path
-        relaxng_doc = etree.parse(schema_path)
-        self._schema = etree.RelaxNG(relaxng_doc)
+        if schema_path not in self._schemas:
+            relaxng_doc = etree.parse(schema_path)
+            self._schemas[schema_path] = etree.RelaxNG(relaxng_doc)
+        self._schema = self._schemas[schema_path]
 
     def parse(self):
         try:
@@ -0,0 +1,111 @@
+"""
+This module defines the SlavePoolCache class that stores the parsed machine
+descriptions of a pool directory so that only the changed XML files have to
+be parsed and validated again.
+
+Copyright 2017 Red Hat, Inc.
+Licensed under the GNU General Public License, version 2 as
+published by the Free Software Foundation; see COPYING for details.
+"""
+
+import os
+import logging
+import hashlib
+import tempfile
+import cPickle
+from lnst.Common.Utils import sha256sum, mkdir_p
+
+#increase when the format of the parsed data changes
+CACHE_VERSION = 1
+
+class SlavePoolCache(object):
+    """Cache of SlaveMachineParser results of one pool directory
+
+    The cache is a pickle file in cache_dir named after the hash of the pool
+    directory path. An entry is valid if the mtime and size of the XML file
+    are unchanged or, when they differ, if the sha256 of the file content is
+    the same as when the entry was stored. The whole cache is invalidated
+    when the schema file changes.
+
+    Entries of files that weren't looked up are dropped on save, so the
+    cache doesn't keep machines removed from the pool.
+    """
+    def __init__(self, cache_dir, pool_dir, schema_path):
+        self._cache_dir = cache_dir
+        pool_dir = os.path.abspath(pool_dir)
+        self._path = os.path.join(cache_dir, "%s.cache" %
+                                  hashlib.sha256(pool_dir).hexdigest())
+        self._schema_hash = sha256sum(schema_path)
+        self._entries = {}
+        self._used = {}
+        self._modified = False
+        self._load()
+
+    def _load(self):
+        try:
+            with open(self._path, "rb") as f:
+                data = cPickle.load(f)
+        except IOError:
+            return
+        except Exception as e:
+            logging.debug("Ignoring corrupted pool cache %s: %s" %
+                          (self._path, str(e)))
+            return
+
+        if not isinstance(data, dict) or \
+           data.get("version") != CACHE_VERSION or \
+           data.get("schema") != self._schema_hash:
+            logging.debug("Pool cache %s is outdated" % self._path)
+            return
+
+        self._entries = data["entries"]
+
+    def get(self, filepath):
+        """returns the cached parser output for the file or None"""
+        name = os.path.basename(filepath)
+        if name not in self._entries:
+            return None
+
+        mtime, size, digest, xml_data = self._entries[name]
+        st = os.stat(filepath)
+        if st.st_mtime != mtime or st.st_size != size:
+            if sha256sum(filepath) != digest:
+                return None
+            #only touched, refresh the stat data
+            self._modified = True
+
+        self._used[name] = (st.st_mtime, st.st_size, digest, xml_data)
+        return xml_data
+
+    def update(self, filepath, xml_data):
+        """stores the parser output for the file"""
+        name = os.path.basename(filepath)
+        st = os.stat(filepath)
+        self._used[name] = (st.st_mtime, st.st_size, sha256sum(filepath),
+                            xml_data)
+        self._modified = True
+
+    def save(self):
+        """writes the cache if it changed, errors are only logged"""
+        if not self._modified and \
+           len(self._used) == len(self._entries):
+            return
+
+        data = {"version": CACHE_VERSION,
+                "schema": self._schema_hash,
+                "entries": self._used}
+        try:
+            mkdir_p(self._cache_dir)
+            fd, tmp_path = tempfile.mkstemp(dir=self._cache_dir,
+                                            suffix=".tmp")
+            with os.fdopen(fd, "wb") as f:
+                cPickle.dump(data, f, cPickle.HIGHEST_PROTOCOL)
+            #atomic, concurrent Controllers never read a partial file
+            os.rename(tmp_path, self._path)
+        except (IOError, OSError) as e:
+            logging.debug("Unable to write pool cache %s: %s" %
+                          (self._path, str(e)))
+            return
+
+        self._entries = dict(self._used)
+        self._modified = False
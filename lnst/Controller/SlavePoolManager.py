@@ -22,6 +22,8 @@ from lnst.Common.NetUtils import normalize_hwaddr
 from lnst.Controller.Common import ControllerError
 from lnst.Controller.Machine import Machine
 from lnst.Controller.SlaveMachineParser import SlaveMachineParser
+from lnst.Controller.SlaveMachineParser import get_schema_path
+from lnst.Controller.SlavePoolCache import SlavePoolCache
 from lnst.Common.Colours import decorate_with_preset
 from lnst.Common.Utils import check_process_running
 
@@ -42,7 +44,8 @@ class SlavePoolManager:
 
         self._allow_virt = ctl_config.get_option("environment",
                                                  "allow_virtual")
-        self._allow_virt &= check_process_running("libvirtd")
+        if self._allow_virt:
+            self._allow_virt = check_process_running("libvirtd")
         self._pool_checks = pool_checks
 
         logging.info("Checking machine pool availability.")
@@ -55,27 +58,41 @@ class SlavePoolManager:
         self._machines = {}
         for pool_name, machines in self._pools.items():
             pool = self._machines[pool_name] = {}
-            for m_id, m_spec in machines.items():
-                params = m_spec["params"]
+            for m_id in machines.keys():
+                pool[m_id] = self.create_machine(pool_name, m_id,
+                                                 self._msg_dispatcher)
+                #TODO check if all described devices are available
 
-                hostname = params["hostname"]
+        logging.info("Finished loading pools.")
 
-                if "libvirt_domain" in params:
-                    libvirt_domain = params["libvirt_domain"]
-                else:
-                    libvirt_domain = None
+    def create_machine(self, pool_name, m_id, msg_dispatcher):
+        """creates a new Machine object for a pool machine
 
-                if "rpc_port" in params:
-                    rpc_port = params["rpc_port"]
-                else:
-                    rpc_port = None
+        The Machine connects to its Slave through the msg_dispatcher, this
+        allows processes running recipes concurrently to create their own
+        connections.
+        """
+        m_spec = self._pools[pool_name][m_id]
+        params = m_spec["params"]
 
-                pool[m_id] = Machine(m_id, hostname, self._msg_dispatcher,
-                                     ctl_config, libvirt_domain, rpc_port,
-                                     m_spec["security"])
-                #TODO check if all described devices are available
+        hostname = params["hostname"]
 
-        logging.info("Finished loading pools.")
+        if "libvirt_domain" in params:
+            libvirt_domain = params["libvirt_domain"]
+        else:
+            libvirt_domain = None
+
+        if "rpc_port" in params:
+            rpc_port = params["rpc_port"]
+        else:
+            rpc_port = None
+
+        #without allow_virtual the snapshot is removed by add_file
+        libvirt_snapshot = params.get("libvirt_snapshot", None)
+
+        return Machine(m_id, hostname, msg_dispatcher, self._ctl_config,
+                       libvirt_domain, rpc_port, m_spec["security"],
+                       libvirt_snapshot)
 
     def get_pools(self):
         return self._pools
@@ -102,10 +119,13 @@ class SlavePoolManager:
                                                                    pool_name))
             return
 
+        cache = self._get_cache(dir_path)
         for dirent in dentries:
-            m_id, m = self.add_file(pool_name, dir_path, dirent)
+            m_id, m = self.add_file(pool_name, dir_path, dirent, cache)
             if m_id != None and m != None:
                 pool[m_id] = m
+        if cache is not None:
+            cache.save()
 
         if len(pool) == 0:
             logging.warn("No machines found in pool '%s', directory '%s'" %
@@ -173,15 +193,35 @@ class SlavePoolManager:
 
             logging.info(msg)
 
-    def add_file(self, pool_name, dir_path, dirent):
+    def _get_cache(self, dir_path):
+        if not self._ctl_config.get_option("environment", "pool_cache"):
+            return None
+
+        cache_dir = self._ctl_config.get_option("environment",
+                                                "pool_cache_dir")
+        schema_path = get_schema_path(self._ctl_config)
+        return SlavePoolCache(cache_dir, dir_path, schema_path)
+
+    def add_file(self, pool_name, dir_path, dirent, cache=None):
         filepath = dir_path + "/" + dirent
         pool = self._pools[pool_name]
         if os.path.isfile(filepath) and re.search("\.xml$", filepath, re.I):
             dirname, basename = os.path.split(filepath)
             m_id = re.sub("\.[xX][mM][lL]$", "", basename)
 
-            parser = SlaveMachineParser(filepath, self._ctl_config)
-            xml_data = parser.parse()
+            xml_data = None
+            if cache is not None:
+                xml_data = cache.get(filepath)
+
+            if xml_data is None:
+                parser = SlaveMachineParser(filepath, self._ctl_config)
+                xml_data = parser.parse()
+                if cache is not None:
+                    cache.update(filepath, xml_data)
+            else:
+                logging.debug("Using cached description of machine '%s'" %
+                              m_id)
+
             machine_spec = self._process_machine_xml_data(m_id, xml_data)
 
             if 'libvirt_domain' in machine_spec['params'] and \
@@ -190,6 +230,7 @@ class SlavePoolManager:
                                  "Removing libvirt_domain from "\
                                  "machine '%s'" % m_id)
                    del machine_spec['params']['libvirt_domain']
+                   machine_spec['params'].pop('libvirt_snapshot', None)
 
             # Check if there isn't any machine with the same
             # hostname or libvirt_domain already in the pool
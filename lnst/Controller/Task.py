@@ -10,14 +10,14 @@ __author__ = """
 rpazdera@redhat.com (Radek Pazdera)
 """
 
-import hashlib
-import re
 import logging
 from lnst.Common.Utils import dict_to_dot, list_to_dot, deprecated
 from lnst.Common.Config import lnst_config
 from lnst.Controller.XmlTemplates import XmlTemplateError
 from lnst.Common.Path import Path
 from lnst.Controller.PerfRepoMapping import PerfRepoMapping
+from lnst.Controller.ResultsStore import ResultsStore, StoreResult, config_hash
+from lnst.Controller.PerfRepoWorker import PerfRepoWorker, STOP_TIMEOUT
 from lnst.Controller.Common import ControllerError
 from lnst.Common.Utils import Noop
 
@@ -101,6 +101,7 @@ class ControllerAPI(object):
         self.mreq = {}
 
         self._perf_repo_api = PerfRepoAPI()
+        self._results_store = None
 
         self._hosts = {}
 
@@ -213,8 +214,18 @@ class ControllerAPI(object):
             if not password:
                 logging.warn("No PerfRepo password specified in config file")
             if url and username and password:
-                self._perf_repo_api.connect(url, username, password)
-
+                spool_dir = lnst_config.get_option("perfrepo", "spool_dir")
+                retries = lnst_config.get_option("perfrepo", "retries")
+                retry_interval = lnst_config.get_option("perfrepo",
+                                                        "retry_interval")
+                self._perf_repo_api.connect(url, username, password,
+                                            spool_dir, retries,
+                                            retry_interval)
+
+            if lnst_config.get_option("results_store", "enabled"):
+                self._perf_repo_api.set_local_store(self.connect_ResultsStore())
+
+            self._perf_repo_api.set_recipe(self._ctl._recipe_path)
             root = Path(None, self._ctl._recipe_path).get_root()
             path = Path(root, mapping_file)
             self._perf_repo_api.load_mapping(path)
@@ -222,10 +233,33 @@ class ControllerAPI(object):
             if not self._perf_repo_api.connected():
                 if PerfRepoRESTAPI is None:
                     logging.warn("Python PerfRepo library not found.")
-                logging.warn("Connection to PerfRepo incomplete, further "\
-                             "PerfRepo commands will be ignored.")
+                if self._perf_repo_api.get_local_store() is not None:
+                    logging.warn("Connection to PerfRepo incomplete, results "\
+                                 "will only be stored locally.")
+                else:
+                    logging.warn("Connection to PerfRepo incomplete, further "\
+                                 "PerfRepo commands will be ignored.")
         return self._perf_repo_api
 
+    def connect_ResultsStore(self, path=None):
+        """
+            Open the local results store.
+
+            :param path: path to the SQLite database, the results_store
+                configuration is used by default
+            :type path: string
+
+            :return: The local results store handle.
+            :rtype: ResultsStore
+        """
+        if self._results_store is None or \
+           (path is not None and path != self._results_store.get_path()):
+            self._results_store = ResultsStore.from_config(lnst_config, path)
+            self._results_store.set_recipe(self._ctl._recipe_path)
+            logging.info("Using local results store '%s'" %
+                         self._results_store.get_path())
+        return self._results_store
+
     def get_configuration(self):
         machines = self._ctl._machines
         configuration = {}
@@ -654,6 +688,20 @@ class InterfaceAPI(object):
                                "untagged": untagged,
                                "self": self, "master": master})
 
+    def add_br_vlans(_self, vlan_tcis, pvid=False, untagged=False,
+                     self=False, master=False):
+        _self._if.add_br_vlans([{"vlan_id": vlan_tci, "pvid": pvid,
+                                 "untagged": untagged,
+                                 "self": self, "master": master}
+                                for vlan_tci in vlan_tcis])
+
+    def del_br_vlans(_self, vlan_tcis, pvid=False, untagged=False,
+                     self=False, master=False):
+        _self._if.del_br_vlans([{"vlan_id": vlan_tci, "pvid": pvid,
+                                 "untagged": untagged,
+                                 "self": self, "master": master}
+                                for vlan_tci in vlan_tcis])
+
     def get_br_vlans(self):
         return self._if.get_br_vlans()
 
@@ -665,9 +713,24 @@ class InterfaceAPI(object):
         _self._if.del_br_fdb({"hwaddr": hwaddr, "self": self, "master": master,
                               "vlan_id": vlan_tci})
 
+    def add_br_fdbs(_self, entries, self=False, master=False):
+        """entries is a list of (hwaddr, vlan_tci) tuples"""
+        _self._if.add_br_fdbs([{"hwaddr": str(hwaddr), "self": self,
+                                "master": master, "vlan_id": vlan_tci}
+                               for hwaddr, vlan_tci in entries])
+
+    def del_br_fdbs(_self, entries, self=False, master=False):
+        """entries is a list of (hwaddr, vlan_tci) tuples"""
+        _self._if.del_br_fdbs([{"hwaddr": str(hwaddr), "self": self,
+                                "master": master, "vlan_id": vlan_tci}
+                               for hwaddr, vlan_tci in entries])
+
     def get_br_fdbs(self):
         return self._if.get_br_fdbs()
 
+    def get_br_fdb(self, hwaddr, vlan_tci=0):
+        return self._if.get_br_fdb(str(hwaddr), vlan_tci)
+
     def set_br_learning(_self, on=True, self=False, master=False):
         _self._if.set_br_learning({"on": on, "self": self, "master": master})
 
@@ -825,7 +888,20 @@ class VolatileValue(object):
 class PerfRepoAPI(object):
     def __init__(self):
         self._rest_api = None
+        self._worker = None
         self._mapping = None
+        self._local_store = None
+        self._recipe = None
+
+    def set_recipe(self, recipe):
+        """sets the recipe the saved results are stored with"""
+        self._recipe = recipe
+
+    def set_local_store(self, store):
+        self._local_store = store
+
+    def get_local_store(self):
+        return self._local_store
 
     def load_mapping(self, file_path):
         try:
@@ -845,16 +921,61 @@ class PerfRepoAPI(object):
         else:
             return False
 
-    def connect(self, url, username, password):
-        if PerfRepoRESTAPI is not None:
-            self._rest_api = PerfRepoRESTAPI(url, username, password)
-            if not self._rest_api.connected():
-                self._rest_api = None
+    def spooling(self):
+        """True if results are queued for PerfRepo while it's unreachable"""
+        return self._worker is not None and self._mapping is not None and\
+                not self.connected()
+
+    def connect(self, url, username, password, spool_dir="", retries=3,
+                retry_interval=1.0):
+        if PerfRepoRESTAPI is None:
+            self._rest_api = None
+            return
+
+        rest_api = PerfRepoRESTAPI(url, username, password)
+        if rest_api.connected():
+            self._rest_api = rest_api
+        elif spool_dir:
+            #results are spooled and sent by a later run
+            logging.warn("PerfRepo unreachable, results will be spooled to "\
+                         "%s" % spool_dir)
         else:
             self._rest_api = None
+            return
+
+        if self._worker is not None:
+            #the spool is replayed by the new worker, the old one has to
+            #finish its uploads first so that nothing is sent twice
+            self._worker.stop(STOP_TIMEOUT)
+        self._worker = PerfRepoWorker(rest_api, spool_dir, retries,
+                                      retry_interval)
+        self._worker.start()
+
+    def flush(self):
+        """waits until all queued PerfRepo uploads and lookups are done"""
+        if self._worker is not None:
+            self._worker.flush()
 
     def new_result(self, mapping_key, name, hash_ignore=[]):
+        if self.spooling():
+            mapping_id = self._mapping.get_id(mapping_key)
+            if mapping_id is None:
+                logging.debug("Test key '%s' has no mapping defined!" %
+                              mapping_key)
+                return Noop()
+            logging.info("Creating a new result object to be spooled for "\
+                         "PerfRepo")
+            return PerfRepoResult(None, name, hash_ignore, test_ref=mapping_id,
+                                  mapping_key=mapping_key)
+
         if not self.connected():
+            if self._local_store is not None:
+                logging.info("Creating a new result object for the local "\
+                             "results store")
+                result = self._local_store.new_result(mapping_key, name,
+                                                      hash_ignore)
+                result.set_configuration(ctl.get_configuration())
+                return result
             return Noop()
 
         mapping_id = self._mapping.get_id(mapping_key)
@@ -878,58 +999,78 @@ class PerfRepoAPI(object):
             return Noop()
 
         logging.info("Creating a new result object for PerfRepo")
-        result = PerfRepoResult(test, name, hash_ignore)
+        result = PerfRepoResult(test, name, hash_ignore,
+                                mapping_key=mapping_key)
         return result
 
     def save_result(self, result):
         if isinstance(result, Noop):
             return
-        elif not self.connected():
+        elif isinstance(result, StoreResult):
+            self._local_store.save_result(result, self._recipe)
+        elif not self.connected() and not self.spooling():
             raise TaskError("Not connected to PerfRepo.")
         elif isinstance(result, PerfRepoResult):
             if len(result.get_testExecution().get_values()) < 1:
                 logging.debug("PerfRepoResult with no result data, skipping "\
                               "send to PerfRepo.")
                 return
+            if self._local_store is not None:
+                self._local_store.save_perfrepo_result(result, self._recipe)
             h = result.generate_hash()
-            logging.debug("Adding hash '%s' as tag to result." % h)
-            result.add_tag(h)
-            logging.info("Sending TestExecution to PerfRepo.")
-            self._rest_api.testExecution_create(result.get_testExecution())
-
-            report_id = self._mapping.get_id(h)
-            if not report_id and result.get_testExecution().get_id() != None:
-                logging.debug("No mapping defined for hash '%s'" % h)
-                logging.debug("If you want to create a new report and set "\
-                              "this result as the baseline run this command:")
-                cmd = "perfrepo report create"
-                cmd += " name REPORTNAME"
-
-                test = result.get_test()
-                cmd += " chart CHARTNAME"
-                cmd += " testid %s" % test.get_id()
-                series_num = 0
-                for m in test.get_metrics():
-                    cmd += " series NAME%d" % series_num
-                    cmd += " metric %s" % m.get_id()
-                    cmd += " tags %s" % h
-                    series_num += 1
-                cmd += " baseline BASELINENAME"
-                cmd += " execid %s" % result.get_testExecution().get_id()
-                cmd += " metric %s" % test.get_metrics()[0].get_id()
-                logging.debug(cmd)
+            if h is not None:
+                logging.debug("Adding hash '%s' as tag to result." % h)
+                result.add_tag(h)
+                hash_ignore = None
+            else:
+                logging.debug("Hash tag will be added once the Test uid is "\
+                              "known.")
+                hash_ignore = result.get_hash_ignore()
+            logging.info("Queueing TestExecution for PerfRepo.")
+            future = self._worker.submit_upload(result.get_testExecution(),
+                                                hash_ignore)
+            future.add_done_callback(lambda f: self._report_hint(result, h))
         else:
             raise TaskError("Parameter result must be an instance "\
                             "of PerfRepoResult")
 
+    def _report_hint(self, result, h):
+        if result.get_test() is None:
+            return
+        report_id = self._mapping.get_id(h)
+        if not report_id and result.get_testExecution().get_id() != None:
+            logging.debug("No mapping defined for hash '%s'" % h)
+            logging.debug("If you want to create a new report and set "\
+                          "this result as the baseline run this command:")
+            cmd = "perfrepo report create"
+            cmd += " name REPORTNAME"
+
+            test = result.get_test()
+            cmd += " chart CHARTNAME"
+            cmd += " testid %s" % test.get_id()
+            series_num = 0
+            for m in test.get_metrics():
+                cmd += " series NAME%d" % series_num
+                cmd += " metric %s" % m.get_id()
+                cmd += " tags %s" % h
+                series_num += 1
+            cmd += " baseline BASELINENAME"
+            cmd += " execid %s" % result.get_testExecution().get_id()
+            cmd += " metric %s" % test.get_metrics()[0].get_id()
+            logging.debug(cmd)
+
     def get_baseline(self, report_id):
         if report_id is None or not self.connected():
             return Noop()
 
+        future = self._worker.submit_call(self._fetch_baseline, report_id)
+        return PerfRepoBaseline(future=future)
+
+    def _fetch_baseline(self, report_id):
         report = self._rest_api.report_get_by_id(report_id, log=False)
         if report is None:
             logging.debug("No report with id %s found!" % report_id)
-            return Noop()
+            return None
         logging.debug("Report found: %s" %\
                         self._rest_api.get_obj_url(report))
 
@@ -938,7 +1079,7 @@ class PerfRepoAPI(object):
         if baseline is None:
             logging.debug("No baseline set for report %s" %\
                             self._rest_api.get_obj_url(report))
-            return Noop()
+            return None
 
         baseline_exec_id = baseline["execId"]
         baseline_testExec = self._rest_api.testExecution_get(baseline_exec_id,
@@ -946,9 +1087,11 @@ class PerfRepoAPI(object):
 
         logging.debug("TestExecution of baseline: %s" %\
                         self._rest_api.get_obj_url(baseline_testExec))
-        return PerfRepoBaseline(baseline_testExec)
+        return baseline_testExec
 
     def get_baseline_of_result(self, result):
+        if isinstance(result, StoreResult):
+            return self._local_store.get_baseline_of_result(result)
         if not isinstance(result, PerfRepoResult) or not self.connected():
             return Noop()
 
@@ -963,13 +1106,11 @@ class PerfRepoAPI(object):
             logging.debug("Hash '%s' has no mapping defined!" % res_hash)
             return Noop()
 
-        baseline = self.get_baseline(report_id)
-
-        if baseline.get_texec() is None:
-            logging.debug("No baseline set for results with hash %s" % res_hash)
-        return baseline
+        return self.get_baseline(report_id)
 
     def compare_to_baseline(self, result, report_id, metric_name):
+        if isinstance(result, StoreResult):
+            return self._local_store.compare_to_baseline(result, metric_name)
         if not self.connected():
             return False
         baseline_testExec = self.get_baseline(report_id)
@@ -1002,11 +1143,20 @@ class PerfRepoAPI(object):
         return False
 
 class PerfRepoResult(object):
-    def __init__(self, test, name, hash_ignore=[]):
+    def __init__(self, test, name, hash_ignore=[], test_ref=None,
+                 mapping_key=None):
+        """test can be None when PerfRepo is unreachable, the TestExecution
+        then references the Test by test_ref (the mapped id or uid)"""
         self._test = test
+        self._mapping_key = mapping_key
         self._testExecution = PerfRepoTestExecution()
-        self._testExecution.set_testId(test.get_id())
-        self._testExecution.set_testUid(test.get_uid())
+        if test is not None:
+            self._testExecution.set_testId(test.get_id())
+            self._testExecution.set_testUid(test.get_uid())
+        elif str(test_ref).isdigit():
+            self._testExecution.set_testId(test_ref)
+        else:
+            self._testExecution.set_testUid(test_ref)
         self._testExecution.set_name(name)
         self.set_configuration(ctl.get_configuration())
         self._hash_ignore = hash_ignore
@@ -1066,36 +1216,46 @@ class PerfRepoResult(object):
     def get_test(self):
         return self._test
 
+    def get_mapping_key(self):
+        return self._mapping_key
+
     def generate_hash(self, ignore=[]):
+        """returns None for a spooled result of a Test mapped by its id, the
+        uid is unknown until PerfRepo is reachable"""
+        uid = self._testExecution.get_testUid()
+        if uid is None:
+            return None
         ignore.extend(self._hash_ignore)
         tags = self._testExecution.get_tags()
         params = self._testExecution.get_parameters()
-
-        sha1 = hashlib.sha1()
-        sha1.update(self._testExecution.get_testUid())
-        for i in sorted(tags):
-            sha1.update(i)
-        for i in sorted(params, key=lambda x: x[0]):
-            skip = False
-            for j in ignore:
-                if re.search(j, i[0]):
-                    skip = True
-                    break
-            if skip:
-                continue
-            sha1.update(i[0])
-            sha1.update(str(i[1]))
-        return sha1.hexdigest()
+        return config_hash(uid, tags, params, ignore)
 
 class PerfRepoBaseline(object):
-    def __init__(self, texec):
+    """Baseline TestExecution
+
+    The TestExecution can be provided directly or as a PerfRepoFuture of a
+    lookup running in the background, in which case the first access waits
+    for the lookup to finish.
+    """
+    def __init__(self, texec=None, future=None):
         self._texec = texec
+        self._future = future
+
+    def _resolve(self):
+        if self._future is not None:
+            try:
+                self._texec = self._future.result()
+            except Exception as e:
+                logging.error("PerfRepo baseline lookup failed: %s" % str(e))
+                self._texec = None
+            self._future = None
+        return self._texec
 
     def get_value(self, name):
-        if self._texec is None:
+        if self._resolve() is None:
             return None
         perfrepovalue = self._texec.get_value(name)
         return perfrepovalue.get_result()
 
     def get_texec(self):
-        return self._texec
+        return self._resolve()
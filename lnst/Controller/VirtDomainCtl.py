@@ -11,8 +11,11 @@ __author__ = """
 rpazdera@redhat.com (Radek Pazdera)
 """
 
+import time
 import logging
+import threading
 import libvirt
+from xml.etree import ElementTree
 from libvirt import libvirtError
 from lnst.Controller.Common import ControllerError
 
@@ -21,11 +24,37 @@ from lnst.Controller.Common import ControllerError
 #can't handle that many connections at a time
 _libvirt_conn = None
 
+#device removal events are supported since libvirt 1.1.1
+_device_events = hasattr(libvirt, "VIR_DOMAIN_EVENT_ID_DEVICE_REMOVED")
+
+_event_thread = None
+
+def _run_event_loop():
+    while True:
+        libvirt.virEventRunDefaultImpl()
+
 def init_libvirt_con():
     global _libvirt_conn
+    global _event_thread
     if _libvirt_conn is None:
+        if _device_events:
+            #the event implementation has to be registered before the
+            #connection is opened
+            if _event_thread is None:
+                libvirt.virEventRegisterDefaultImpl()
+                _event_thread = threading.Thread(target=_run_event_loop,
+                                                 name="libvirtEventLoop")
+                _event_thread.daemon = True
+                _event_thread.start()
         _libvirt_conn = libvirt.open(None)
 
+def libvirt_initialized():
+    """True once this process opened libvirt
+
+    The connection and the event loop can't be used across fork.
+    """
+    return _libvirt_conn is not None or _event_thread is not None
+
 class VirtDomainCtlError(ControllerError):
     pass
 
@@ -46,49 +75,187 @@ class VirtDomainCtl(object):
     def __init__(self, domain_name):
         self._name = domain_name
         self._created_interfaces = {}
+        self._removal_waits = {}
+        self._event_cb_id = None
+        self._domain = None
+
+    def _get_domain(self):
+        """looks the domain up, libvirt is opened on the first use"""
+        if self._domain is None:
+            init_libvirt_con()
+            try:
+                self._domain = _libvirt_conn.lookupByName(self._name)
+            except:
+                raise VirtDomainCtlError("Domain '%s' doesn't exist!" %
+                                         self._name)
+        return self._domain
 
-        init_libvirt_con()
+    def close(self):
+        """deregisters the device removal callback of the domain
 
+        The callback is registered again by the next detach.
+        """
+        if self._event_cb_id is None:
+            return
         try:
-            self._domain = _libvirt_conn.lookupByName(domain_name)
-        except:
-            raise VirtDomainCtlError("Domain '%s' doesn't exist!" % domain_name)
+            _libvirt_conn.domainEventDeregisterAny(self._event_cb_id)
+        except libvirtError as e:
+            logging.warning("Deregistering the events of domain '%s' failed: "
+                            "%s" % (self._name, str(e)))
+        self._event_cb_id = None
+
+    def _register_events(self):
+        if not _device_events or self._event_cb_id is not None:
+            return
+        try:
+            self._event_cb_id = _libvirt_conn.domainEventRegisterAny(
+                    self._get_domain(),
+                    libvirt.VIR_DOMAIN_EVENT_ID_DEVICE_REMOVED,
+                    self._device_removed_cb, None)
+        except libvirtError as e:
+            raise VirtDomainCtlError(str(e))
 
     def start(self):
-        self._domain.create()
+        self._get_domain().create()
 
     def stop(self):
-        self._domain.destroy()
+        self._get_domain().destroy()
 
     def restart(self):
-        self._domain.reboot()
+        self._get_domain().reboot()
 
-    def attach_interface(self, hw_addr, net_name, driver="virtio"):
+    def is_running(self):
+        return self._get_domain().isActive() == 1
+
+    def create_snapshot(self, snapshot_name):
+        """creates a snapshot of the current domain state
+
+        Taken from a running domain with the Slave started it can be used
+        as a warm starting point of the machine.
+        """
+        snapshot_xml = "<domainsnapshot><name>%s</name></domainsnapshot>" %\
+                            snapshot_name
         try:
-            device_xml = self._net_device_template.format(hw_addr,
-                                                          net_name,
-                                                          driver)
-            self._domain.attachDevice(device_xml)
-            logging.debug("libvirt device with hwaddr '%s' "
-                          "driver '%s' attached" % (hw_addr, driver))
-            self._created_interfaces[hw_addr] = device_xml
-            return True
+            self._get_domain().snapshotCreateXML(snapshot_xml, 0)
         except libvirtError as e:
             raise VirtDomainCtlError(str(e))
 
-    def detach_interface(self, hw_addr):
-        if hw_addr in self._created_interfaces:
-            device_xml = self._created_interfaces[hw_addr]
-        else:
-            device_xml = self._net_device_bare_template.format(hw_addr)
+    def snapshot_exists(self, snapshot_name):
+        return snapshot_name in self._get_domain().snapshotListNames(0)
 
+    def revert_to_snapshot(self, snapshot_name):
+        """reverts the domain to the snapshot and leaves it running
+
+        All devices attached since the snapshot was taken disappear, so
+        they're forgotten here too.
+        """
+        domain = self._get_domain()
         try:
-            self._domain.detachDevice(device_xml)
-            logging.debug("libvirt device with hwaddr '%s' detached" % hw_addr)
-            return True
+            snapshot = domain.snapshotLookupByName(snapshot_name, 0)
+            domain.revertToSnapshot(snapshot,
+                                libvirt.VIR_DOMAIN_SNAPSHOT_REVERT_RUNNING)
+        except libvirtError as e:
+            raise VirtDomainCtlError("Reverting domain '%s' to snapshot "
+                                     "'%s' failed: %s" % (self._name,
+                                                          snapshot_name,
+                                                          str(e)))
+        logging.debug("Domain '%s' reverted to snapshot '%s'" %
+                      (self._name, snapshot_name))
+        self._created_interfaces = {}
+
+    def _device_removed_cb(self, conn, domain, dev_alias, opaque):
+        event = self._removal_waits.get(dev_alias, None)
+        if event is not None:
+            event.set()
+
+    def _get_interface_alias(self, hw_addr):
+        domain = self._get_domain()
+        try:
+            domain_xml = ElementTree.fromstring(domain.XMLDesc(0))
         except libvirtError as e:
             raise VirtDomainCtlError(str(e))
 
+        for iface in domain_xml.findall("devices/interface"):
+            mac = iface.find("mac")
+            alias = iface.find("alias")
+            if mac is None or alias is None:
+                continue
+            if mac.get("address", "").lower() == hw_addr.lower():
+                return alias.get("name")
+        return None
+
+    def attach_interface(self, hw_addr, net_name, driver="virtio"):
+        return self.attach_interfaces([(hw_addr, net_name, driver)])
+
+    def attach_interfaces(self, interfaces):
+        """attaches a list of (hw_addr, net_name, driver) interfaces
+
+        The call returns once libvirt has attached all of them, the guest
+        side devices are announced by the Slave.
+        """
+        for hw_addr, net_name, driver in interfaces:
+            try:
+                device_xml = self._net_device_template.format(hw_addr,
+                                                              net_name,
+                                                              driver)
+                self._get_domain().attachDevice(device_xml)
+                logging.debug("libvirt device with hwaddr '%s' "
+                              "driver '%s' attached" % (hw_addr, driver))
+                self._created_interfaces[hw_addr] = device_xml
+            except libvirtError as e:
+                raise VirtDomainCtlError(str(e))
+        return True
+
+    def detach_interface(self, hw_addr, timeout=60):
+        return self.detach_interfaces([hw_addr], timeout)
+
+    def detach_interfaces(self, hw_addrs, timeout=60, strict=True):
+        """detaches the interfaces and waits for the guest to release them
+
+        Detaching needs cooperation of the guest, so the call waits for the
+        libvirt device-removed events of all the interfaces, at most timeout
+        seconds. An expired timeout raises VirtDomainCtlError if strict is
+        True, otherwise only a warning is logged.
+        """
+        self._register_events()
+
+        waits = {}
+        try:
+            for hw_addr in hw_addrs:
+                if hw_addr in self._created_interfaces:
+                    device_xml = self._created_interfaces.pop(hw_addr)
+                else:
+                    device_xml = self._net_device_bare_template.format(hw_addr)
+
+                alias = None
+                if _device_events:
+                    alias = self._get_interface_alias(hw_addr)
+                if alias is not None:
+                    waits[alias] = hw_addr
+                    self._removal_waits[alias] = threading.Event()
+
+                try:
+                    self._get_domain().detachDevice(device_xml)
+                    logging.debug("libvirt device with hwaddr '%s' detached" %
+                                  hw_addr)
+                except libvirtError as e:
+                    raise VirtDomainCtlError(str(e))
+
+            deadline = time.time() + timeout
+            for alias, hw_addr in waits.items():
+                remaining = max(deadline - time.time(), 0)
+                if not self._removal_waits[alias].wait(remaining):
+                    msg = "Device with hwaddr '%s' wasn't removed from "\
+                          "domain %s in %d seconds" % (hw_addr, self._name,
+                                                       timeout)
+                    if strict:
+                        raise VirtDomainCtlError(msg)
+                    logging.warning(msg)
+        finally:
+            for alias in waits:
+                del self._removal_waits[alias]
+        return True
+
     @classmethod
     def domain_exist(cls, domain_name):
         try:
@@ -21,6 +21,7 @@ import os
 from lnst.Common.Utils import mkdir_p, check_process_running
 from lnst.Common.Config import DefaultRPCPort
 from lnst.Common.ConnectionHandler import send_data, recv_data
+from lnst.Common.DeviceRef import encode_payload, decode_payload
 from lnst.Controller.CtlSecSocket import CtlSecSocket
 from lnst.Common.SecureSocket import SecSocketException
 from xml.dom.minidom import getDOMImplementation
@@ -390,9 +391,10 @@ class Wizard:
         @param sock Socket used for connecting to machine
         @return Dictionary with machine interfaces or None if RPC call fails
         """
+        args = [{"ifi_type": 1, "state": "DOWN"}]
         msg = {"type": "command",
                "method_name": "get_devices_by_params",
-               "args": [{"ifi_type": 1, "state": "DOWN"}]}
+               "payload": encode_payload((args, {}))}
         if not send_data(sock, msg):
             sys.stderr.write("Could not send request to slave machine\n")
             return None
@@ -400,7 +402,7 @@ class Wizard:
         while True:
             data = recv_data(sock)
             if data["type"] == "result":
-                return data["result"]
+                return decode_payload(data["payload"])
 
     def _parse_host(self, host):
         """ Parses hostname:port string
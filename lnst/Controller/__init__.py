@@ -1,3 +1,4 @@
 from lnst.Controller.Controller import Controller
 from lnst.Controller.Recipe import BaseRecipe
 from lnst.Controller.Requirements import HostReq, DeviceReq
+from lnst.Controller.Job import wait_for_jobs
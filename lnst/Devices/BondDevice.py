@@ -12,27 +12,77 @@ olichtne@redhat.com (Ondrej Lichtner)
 
 from lnst.Common.ExecCmd import exec_cmd
 from lnst.Devices.MasterDevice import MasterDevice
+from lnst.Devices.MasterDevice import int_option, enum_option, device_option
 
 class BondDevice(MasterDevice):
     _name_template = "t_bond"
 
+    _linkinfo_kind = "bond"
+    _linkinfo_options = {
+        "mode": ("IFLA_BOND_MODE",
+                 enum_option({"balance-rr": 0, "active-backup": 1,
+                              "balance-xor": 2, "broadcast": 3,
+                              "802.3ad": 4, "balance-tlb": 5,
+                              "balance-alb": 6})),
+        "active_slave": ("IFLA_BOND_ACTIVE_SLAVE", device_option),
+        "miimon": ("IFLA_BOND_MIIMON", int_option),
+        "updelay": ("IFLA_BOND_UPDELAY", int_option),
+        "downdelay": ("IFLA_BOND_DOWNDELAY", int_option),
+        "use_carrier": ("IFLA_BOND_USE_CARRIER", int_option),
+        "arp_interval": ("IFLA_BOND_ARP_INTERVAL", int_option),
+        "arp_validate": ("IFLA_BOND_ARP_VALIDATE",
+                         enum_option({"none": 0, "active": 1, "backup": 2,
+                                      "all": 3, "filter": 4,
+                                      "filter_active": 5,
+                                      "filter_backup": 6})),
+        "arp_all_targets": ("IFLA_BOND_ARP_ALL_TARGETS",
+                            enum_option({"any": 0, "all": 1})),
+        "primary": ("IFLA_BOND_PRIMARY", device_option),
+        "primary_reselect": ("IFLA_BOND_PRIMARY_RESELECT",
+                             enum_option({"always": 0, "better": 1,
+                                          "failure": 2})),
+        "fail_over_mac": ("IFLA_BOND_FAIL_OVER_MAC",
+                          enum_option({"none": 0, "active": 1,
+                                       "follow": 2})),
+        "xmit_hash_policy": ("IFLA_BOND_XMIT_HASH_POLICY",
+                             enum_option({"layer2": 0, "layer3+4": 1,
+                                          "layer2+3": 2, "encap2+3": 3,
+                                          "encap3+4": 4})),
+        "resend_igmp": ("IFLA_BOND_RESEND_IGMP", int_option),
+        "num_grat_arp": ("IFLA_BOND_NUM_PEER_NOTIF", int_option),
+        "num_unsol_na": ("IFLA_BOND_NUM_PEER_NOTIF", int_option),
+        "all_slaves_active": ("IFLA_BOND_ALL_SLAVES_ACTIVE", int_option),
+        "min_links": ("IFLA_BOND_MIN_LINKS", int_option),
+        "lp_interval": ("IFLA_BOND_LP_INTERVAL", int_option),
+        "packets_per_slave": ("IFLA_BOND_PACKETS_PER_SLAVE", int_option),
+        "lacp_rate": ("IFLA_BOND_AD_LACP_RATE",
+                      enum_option({"slow": 0, "fast": 1})),
+        "ad_select": ("IFLA_BOND_AD_SELECT",
+                      enum_option({"stable": 0, "bandwidth": 1,
+                                   "count": 2})),
+        "ad_actor_sys_prio": ("IFLA_BOND_AD_ACTOR_SYS_PRIO", int_option),
+        "ad_user_port_key": ("IFLA_BOND_AD_USER_PORT_KEY", int_option),
+        "tlb_dynamic_lb": ("IFLA_BOND_TLB_DYNAMIC_LB", int_option)}
+
     def _create(self):
         exec_cmd("ip link add %s type bond" % self.name)
 
     def _get_bond_dir(self):
         return "/sys/class/net/%s/bonding" % self.name
 
-    def set_option(self, option, value):
-        if option == "primary":
-            '''
-            "primary" option is not direct value but it's
-            a Device reference
-            '''
-            value = value.name
+    def _set_sysfs_option(self, option, value):
         exec_cmd('echo "%s" > %s/%s' % (value,
                                         self._get_bond_dir(),
                                         option))
 
+    def set_option(self, option, value):
+        self.set_options([(option, value)])
+
     def set_options(self, options):
-        for option, value in options:
-            self.set_option(option, value)
+        """applies all options with a single netlink message
+
+        Options without a netlink attribute (e.g. arp_ip_target) are
+        written to sysfs afterwards.
+        """
+        for option, value in self._linkinfo_set(options):
+            self._set_sysfs_option(option, value)
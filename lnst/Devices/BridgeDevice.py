@@ -11,23 +11,74 @@ olichtne@redhat.com (Ondrej Lichtner)
 """
 
 from lnst.Common.ExecCmd import exec_cmd
-from lnst.Devices.MasterDevice import MasterDevice
+from lnst.Devices.MasterDevice import MasterDevice, int_option, clock_option
 
 class BridgeDevice(MasterDevice):
     _name_template = "t_br"
 
+    #time values are in 1/100 s, the same as in sysfs
+    _linkinfo_kind = "bridge"
+    _linkinfo_options = {
+        "forward_delay": ("IFLA_BR_FORWARD_DELAY", clock_option),
+        "hello_time": ("IFLA_BR_HELLO_TIME", clock_option),
+        "max_age": ("IFLA_BR_MAX_AGE", clock_option),
+        "ageing_time": ("IFLA_BR_AGEING_TIME", clock_option),
+        "stp_state": ("IFLA_BR_STP_STATE", int_option),
+        "priority": ("IFLA_BR_PRIORITY", int_option),
+        "vlan_filtering": ("IFLA_BR_VLAN_FILTERING", int_option),
+        "vlan_protocol": ("IFLA_BR_VLAN_PROTOCOL", int_option),
+        "group_fwd_mask": ("IFLA_BR_GROUP_FWD_MASK", int_option),
+        "multicast_router": ("IFLA_BR_MCAST_ROUTER", int_option),
+        "multicast_snooping": ("IFLA_BR_MCAST_SNOOPING", int_option),
+        "multicast_query_use_ifaddr": ("IFLA_BR_MCAST_QUERY_USE_IFADDR",
+                                       int_option),
+        "multicast_querier": ("IFLA_BR_MCAST_QUERIER", int_option),
+        "hash_elasticity": ("IFLA_BR_MCAST_HASH_ELASTICITY", int_option),
+        "hash_max": ("IFLA_BR_MCAST_HASH_MAX", int_option),
+        "multicast_last_member_count": ("IFLA_BR_MCAST_LAST_MEMBER_CNT",
+                                        int_option),
+        "multicast_startup_query_count": ("IFLA_BR_MCAST_STARTUP_QUERY_CNT",
+                                          int_option),
+        "multicast_last_member_interval": ("IFLA_BR_MCAST_LAST_MEMBER_INTVL",
+                                           clock_option),
+        "multicast_membership_interval": ("IFLA_BR_MCAST_MEMBERSHIP_INTVL",
+                                          clock_option),
+        "multicast_querier_interval": ("IFLA_BR_MCAST_QUERIER_INTVL",
+                                       clock_option),
+        "multicast_query_interval": ("IFLA_BR_MCAST_QUERY_INTVL",
+                                     clock_option),
+        "multicast_query_response_interval":
+            ("IFLA_BR_MCAST_QUERY_RESPONSE_INTVL", clock_option),
+        "multicast_startup_query_interval":
+            ("IFLA_BR_MCAST_STARTUP_QUERY_INTVL", clock_option),
+        "nf_call_iptables": ("IFLA_BR_NF_CALL_IPTABLES", int_option),
+        "nf_call_ip6tables": ("IFLA_BR_NF_CALL_IP6TABLES", int_option),
+        "nf_call_arptables": ("IFLA_BR_NF_CALL_ARPTABLES", int_option),
+        "default_pvid": ("IFLA_BR_VLAN_DEFAULT_PVID", int_option),
+        "vlan_stats_enabled": ("IFLA_BR_VLAN_STATS_ENABLED", int_option),
+        "multicast_stats_enabled": ("IFLA_BR_MCAST_STATS_ENABLED",
+                                    int_option),
+        "multicast_igmp_version": ("IFLA_BR_MCAST_IGMP_VERSION", int_option),
+        "multicast_mld_version": ("IFLA_BR_MCAST_MLD_VERSION", int_option)}
+
     def _create(self):
         exec_cmd("ip link add dev {} type bridge".format(self._name))
 
     def _get_bridge_dir(self):
         return "/sys/class/net/%s/bridge" % self.name
 
-    def set_option(self, option, value):
-        #TODO redo to work with iproute
+    def _set_sysfs_option(self, option, value):
         exec_cmd('echo "%s" > %s/%s' % (value,
                                         self._get_bridge_dir(),
                                         option))
 
+    def set_option(self, option, value):
+        self.set_options([(option, value)])
+
     def set_options(self, options):
-        for option, value in options:
-            self.set_option(option, value)
+        """applies all options with a single netlink message
+
+        Options without a netlink attribute are written to sysfs afterwards.
+        """
+        for option, value in self._linkinfo_set(options):
+            self._set_sysfs_option(option, value)
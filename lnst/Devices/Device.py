@@ -45,6 +45,9 @@ class Device(object):
     """
     __metaclass__ = ABCMeta
 
+    #the original class of Devices with a swapped class
+    _device_class = None
+
     def __init__(self, if_manager):
         self.if_index = None #TODO ifindex
         self._nl_msg = None
@@ -73,35 +76,42 @@ class Device(object):
 
     def _enable(self):
         """Enables the Device object"""
+        if self._deleted or self._enabled:
+            return
         self._enabled = True
+        self.__class__ = self.__class__._device_class
 
     def _disable(self):
         """Disables the Device object
 
-        When a Device object is disabled, any calls to it's methods will result
-        in a "no operation", however attribute access will still work.
+        When a Device object is disabled, any calls to it's public methods
+        will result in a "no operation", however attribute access will still
+        work.
 
         The justification for this is to disable the Device used by the
         Controller-Slave connection to avoid accidental disconnects.
+
+        The class of the object is replaced by a derived class with no-op
+        public methods so that enabled Devices don't pay for any checks.
         """
+        if self._deleted or not self._enabled:
+            return
         self._enabled = False
+        self.__class__ = _derived_class(self.__class__, _disabled_classes,
+                                        _make_disabled_class)
 
-    def __getattribute__(self, name):
-        what = object.__getattribute__(self, name)
-
-        if object.__getattribute__(self, "_deleted"):
-            raise DeviceDeleted()
+    def _mark_deleted(self):
+        """Marks the Device object as deleted
 
-        if not callable(what):
-            return what
-        else:
-            if (object.__getattribute__(self, "_enabled") or
-                    name in ["enable", "disable"]):
-                return what
-            else:
-                def noop(*args, **kwargs):
-                    pass
-                return noop
+        Called when the netdevice disappears, any further attribute access
+        raises the DeviceDeleted exception.
+        """
+        if self._deleted:
+            return
+        self._deleted = True
+        device_class = self.__class__._device_class or self.__class__
+        self.__class__ = _derived_class(device_class, _deleted_classes,
+                                        _make_deleted_class)
 
     def _set_devlink(self, devlink_port_data):
         self._devlink = devlink_port_data
@@ -129,8 +139,8 @@ class Device(object):
                 raise DeviceError("RTM_NEWADDR message passed to incorrect "\
                                   "Device object.")
 
-            addr = IpAddress(nl_msg.get_attr('IFA_ADDRESS'))
-            addr.prefixlen = nl_msg["prefixlen"]
+            addr = IpAddress(nl_msg.get_attr('IFA_ADDRESS'),
+                             nl_msg["prefixlen"])
 
             if addr not in self._ip_addrs:
                 self._ip_addrs.append(addr)
@@ -139,8 +149,8 @@ class Device(object):
                 raise DeviceError("RTM_DELADDR message passed to incorrect "\
                                   "Device object.")
 
-            addr = IpAddress(nl_msg.get_attr('IFA_ADDRESS'))
-            addr.prefixlen = nl_msg["prefixlen"]
+            addr = IpAddress(nl_msg.get_attr('IFA_ADDRESS'),
+                             nl_msg["prefixlen"])
 
             if addr in self._ip_addrs:
                 self._ip_addrs.remove(addr)
@@ -408,3 +418,36 @@ class Device(object):
     def autoneg_off(self):
         """disable automatic negotiation of speed for this device"""
         exec_cmd("ethtool -s %s autoneg off" % self.name)
+
+_disabled_classes = {}
+_deleted_classes = {}
+
+def _derived_class(device_class, cache, factory):
+    if device_class not in cache:
+        cache[device_class] = factory(device_class)
+    return cache[device_class]
+
+def _noop(*args, **kwargs):
+    pass
+
+def _make_disabled_class(device_class):
+    attrs = {"_device_class": device_class,
+             "__module__": device_class.__module__}
+    for name in dir(device_class):
+        if name.startswith("_"):
+            continue
+        #properties aren't callable, their values stay accessible
+        if callable(getattr(device_class, name)):
+            attrs[name] = _noop
+    return type(device_class)(device_class.__name__, (device_class,), attrs)
+
+def _deleted_getattribute(self, name):
+    if name.startswith("__"):
+        return object.__getattribute__(self, name)
+    raise DeviceDeleted()
+
+def _make_deleted_class(device_class):
+    attrs = {"_device_class": device_class,
+             "__module__": device_class.__module__,
+             "__getattribute__": _deleted_getattribute}
+    return type(device_class)(device_class.__name__, (device_class,), attrs)
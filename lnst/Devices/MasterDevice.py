@@ -10,13 +10,58 @@ __author__ = """
 olichtne@redhat.com (Ondrej Lichtner)
 """
 
+import pyroute2
+from pyroute2.netlink import NLM_F_REQUEST, NLM_F_ACK
+from pyroute2.netlink.rtnl.ifinfmsg import ifinfmsg
+from lnst.Common.DeviceError import DeviceConfigValueError
 from lnst.Devices.SoftDevice import SoftDevice
 
+try:
+    from pyroute2.netlink.iproute import RTM_NEWLINK
+except ImportError:
+    from pyroute2.iproute import RTM_NEWLINK
+
+def int_option(dev, value):
+    """integer option, accepts the same strings as sysfs ("0x8100", "100")"""
+    if isinstance(value, (bool, int, long)):
+        return int(value)
+    return int(str(value), 0)
+
+def clock_option(dev, value):
+    """time option in 1/100 s (clock_t)
+
+    The kernel keeps these in jiffies, the value read back can differ by one
+    from the value set because of the rounding in the conversions.
+    """
+    return int_option(dev, value)
+
+def enum_option(values):
+    """option that accepts either a name from values or its number"""
+    def convert(dev, value):
+        if str(value) in values:
+            return values[str(value)]
+        return int_option(dev, value)
+    return convert
+
+def device_option(dev, value):
+    """option referring to a Device, accepts a Device object or a name"""
+    if isinstance(value, basestring):
+        value = dev._if_manager.get_device_by_name(value)
+    return value.if_index
+
 class MasterDevice(SoftDevice):
     """Common class for all master device types
 
     Implements the slaves attribute getter and the slave_{add, del} methods.
+
+    Derived classes can define the _linkinfo_options dictionary that maps
+    option names (the sysfs file names) to a tuple of the IFLA_INFO_DATA
+    attribute and a value converter. Such options are applied with a single
+    netlink message and verified by reading them back.
     """
+    _linkinfo_kind = None
+    _linkinfo_options = {}
+
     @property
     def slaves(self):
         ret = []
@@ -31,3 +76,80 @@ class MasterDevice(SoftDevice):
 
     def slave_del(self, dev):
         dev.master_set(None)
+
+    def _linkinfo_set(self, options):
+        """applies netlink capable options in one message
+
+        Args:
+            options -- list of (option, value) tuples
+        Returns:
+            list of the (option, value) tuples that have no netlink
+            attribute and need to be set another way
+        """
+        attrs = []
+        tolerance = {}
+        rest = []
+        for option, value in options:
+            if option in self._linkinfo_options:
+                attr, convert = self._linkinfo_options[option]
+                if convert is clock_option:
+                    tolerance[attr] = 1
+                try:
+                    attrs.append([attr, convert(self, value)])
+                except (ValueError, TypeError, AttributeError):
+                    raise DeviceConfigValueError("Invalid value '%s' of "
+                                                 "option %s" % (value, option))
+            else:
+                rest.append((option, value))
+
+        if not attrs:
+            return rest
+
+        msg = ifinfmsg()
+        msg["index"] = self.if_index
+        msg["attrs"] = [["IFLA_LINKINFO",
+                         {"attrs": [["IFLA_INFO_KIND", self._linkinfo_kind],
+                                    ["IFLA_INFO_DATA", {"attrs": attrs}]]}]]
+        with pyroute2.IPRoute() as ipr:
+            try:
+                ipr.nlm_request(msg, msg_type=RTM_NEWLINK,
+                                msg_flags=NLM_F_REQUEST | NLM_F_ACK)
+            except pyroute2.netlink.NetlinkError as e:
+                raise DeviceConfigValueError("Setting options of %s failed: "
+                                             "%s" % (self.name, str(e)))
+
+        current = self._linkinfo_get()
+        for attr, value in attrs:
+            #attributes the kernel doesn't report can't be verified
+            if attr in current and \
+               abs(current[attr] - value) > tolerance.get(attr, 0):
+                raise DeviceConfigValueError("Option %s of %s is %s instead "
+                                             "of %s" % (attr, self.name,
+                                                        current[attr], value))
+        return rest
+
+    def _linkinfo_get(self):
+        """returns dictionary of the IFLA_INFO_DATA attributes"""
+        with pyroute2.IPRoute() as ipr:
+            link = ipr.get_links(self.if_index)[0]
+
+        linkinfo = link.get_attr("IFLA_LINKINFO")
+        if linkinfo is None:
+            return {}
+        data = linkinfo.get_attr("IFLA_INFO_DATA")
+        if data is None or not hasattr(data, "get"):
+            return {}
+        return dict((attr[0], attr[1]) for attr in data.get("attrs", []))
+
+    def get_options(self):
+        """returns dictionary of the current option values
+
+        Only the options applied over netlink are included, enumerated
+        options are reported as numbers.
+        """
+        current = self._linkinfo_get()
+        ret = {}
+        for option, (attr, convert) in self._linkinfo_options.items():
+            if attr in current:
+                ret[option] = current[attr]
+        return ret
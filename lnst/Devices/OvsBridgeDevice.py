@@ -10,6 +10,8 @@ __author__ = """
 olichtne@redhat.com (Ondrej Lichtner)
 """
 
+import os
+from tempfile import NamedTemporaryFile
 from lnst.Common.ExecCmd import exec_cmd
 from lnst.Devices.Device import Device, DeviceError
 from lnst.Devices.SoftDevice import SoftDevice
@@ -89,17 +91,17 @@ class OvsBridgeDevice(SoftDevice):
     def tunnel_add(self, tunnel_type, options):
         name = self._if_manager.assign_name(tunnel_type)
 
-        options = ""
+        opts = ""
         for opt_name, opt_value in options.items():
             if opt_name == "name":
                 name = opt_value
                 continue
 
-            options += " %s=%s" % (opt_name, opt_value)
+            opts += " %s=%s" % (opt_name, opt_value)
 
         exec_cmd("ovs-vsctl add-port %s %s -- set Interface %s "\
                  "type=%s %s" % (self.name, name, name,
-                                 tunnel_type, options))
+                                 tunnel_type, opts))
 
     def tunnel_del(self, name):
         self.port_del(name)
@@ -107,9 +109,36 @@ class OvsBridgeDevice(SoftDevice):
     def flow_add(self, entry):
         exec_cmd("ovs-ofctl add-flow %s '%s'" % (self.name, entry))
 
-    def flows_add(self, entries):
-        for entry in entries:
-            self.flow_add(entry)
-
-    def flows_del(self, entry):
-        exec_cmd("ovs-ofctl del-flows %s" % (self.name))
+    def flows_add(self, entries, atomic=True):
+        """adds a list of flow entries with a single ovs-ofctl call
+
+        With atomic=True the entries are installed in one OpenFlow bundle,
+        so either all of them are installed or, if any of them fails, none
+        is. Bundles need OpenFlow 1.4 enabled on the bridge, use
+        atomic=False for switches that don't support it.
+        """
+        self._flows_cmd("add-flows", entries, atomic)
+
+    def flows_del(self, entries=None, atomic=True):
+        """deletes the listed flow entries, all flows if entries is None"""
+        if entries is None:
+            exec_cmd("ovs-ofctl del-flows %s" % (self.name))
+            return
+        self._flows_cmd("del-flows", entries, atomic)
+
+    def _flows_cmd(self, cmd, entries, atomic):
+        if isinstance(entries, str):
+            entries = [entries]
+
+        flows_file = NamedTemporaryFile(prefix="lnst_flows_", delete=False)
+        try:
+            for entry in entries:
+                flows_file.write("%s\n" % entry)
+            flows_file.close()
+
+            bundle = "--bundle " if atomic else ""
+            exec_cmd("ovs-ofctl %s%s %s %s" % (bundle, cmd, self.name,
+                                               flows_file.name))
+        finally:
+            flows_file.close()
+            os.unlink(flows_file.name)
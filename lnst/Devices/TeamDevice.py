@@ -13,6 +13,7 @@ olichtne@redhat.com (Ondrej Lichtner)
 import re
 from lnst.Common.ExecCmd import exec_cmd
 from lnst.Common.Utils import bool_it
+from lnst.Common.TeamdCtl import TeamdCtl
 from lnst.Devices.MasterDevice import MasterDevice
 
 def prepare_json_str(json_str):
@@ -30,6 +31,7 @@ class TeamDevice(MasterDevice):
 
         self._config = kwargs.get("config", None)
         self._dbus = not bool_it(kwargs.get("disable_dbus", False))
+        self._teamd_ctl = TeamdCtl(self._name)
 
     @property
     def config(self):
@@ -48,13 +50,35 @@ class TeamDevice(MasterDevice):
                      " -D" if self.dbus else ""))
 
     def _destroy(self):
+        self._teamd_ctl.close()
         exec_cmd("teamd -k -t %s" % self.name)
 
     def slave_add(self, dev, port_config=None):
-        exec_cmd("teamdctl %s %s port config update %s \"%s\"" %\
-                    (" -D" if self.dbus else "",
-                     self.name,
-                     dev.name,
-                     prepare_json_str(port_config)))
+        if port_config:
+            self._teamd_ctl.port_config_update(dev.name, port_config)
+        self._teamd_ctl.port_add(dev.name)
+
+    def slave_del(self, dev):
+        self._teamd_ctl.port_remove(dev.name)
+
+    def config_dump(self, actual=False):
+        """returns the teamd configuration as a dictionary
+
+        With actual=True the configuration including the defaults filled
+        in by teamd is returned.
+        """
+        return self._teamd_ctl.config_dump(actual)
+
+    def port_config_dump(self, dev):
+        return self._teamd_ctl.port_config_dump(dev.name)
+
+    def state_dump(self):
+        """returns the teamd state (runner, ports, ...) as a dictionary"""
+        return self._teamd_ctl.state_dump()
+
+    def state_item_get(self, item):
+        """returns a single state item, e.g. "runner.active_port" """
+        return self._teamd_ctl.state_item_get(item)
 
-        dev.master_set(self)
+    def state_item_set(self, item, value):
+        self._teamd_ctl.state_item_set(item, value)
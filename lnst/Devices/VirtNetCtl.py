@@ -26,6 +26,10 @@ def init_libvirt_con():
     if _libvirt_conn is None:
         _libvirt_conn = libvirt.open(None)
 
+def libvirt_initialized():
+    """True once this process opened libvirt"""
+    return _libvirt_conn is not None
+
 class VirtNetCtlError(LnstError):
     pass
 
@@ -41,6 +45,7 @@ class VirtNetCtl(object):
     def __init__(self, name=None):
         init_libvirt_con()
 
+        self._generated_name = not name
         if not name:
             name = self._generate_name()
         self._name = name
@@ -59,13 +64,20 @@ class VirtNetCtl(object):
         return self._name
 
     def init(self):
-        try:
-            network_xml = self._network_template.format(self._name)
-            _libvirt_conn.networkCreateXML(network_xml)
-            logging.debug("libvirt network '%s' created" % self._name)
-            return True
-        except libvirtError as e:
-            raise VirtNetCtlError(str(e))
+        while True:
+            try:
+                network_xml = self._network_template.format(self._name)
+                _libvirt_conn.networkCreateXML(network_xml)
+                logging.debug("libvirt network '%s' created" % self._name)
+                return True
+            except libvirtError as e:
+                #a concurrently running recipe can take the generated name
+                #between the check and the creation
+                if self._generated_name and \
+                   self._name in _libvirt_conn.listNetworks():
+                    self._name = self._generate_name()
+                    continue
+                raise VirtNetCtlError(str(e))
 
     def cleanup(self):
         try:
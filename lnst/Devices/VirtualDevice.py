@@ -11,16 +11,10 @@ olichtne@redhat.com (Ondrej Lichtner)
 """
 
 import logging
-from time import sleep
-from lnst.Common.Utils import check_process_running
 from lnst.Common.NetUtils import normalize_hwaddr
 from lnst.Devices.Device import Device, DeviceError
 from lnst.Devices.RemoteDevice import RemoteDevice
 
-# conditional support for libvirt
-if check_process_running("libvirtd"):
-    from lnst.Devices.VirtNetCtl import VirtNetCtl
-
 class VirtualDevice(RemoteDevice):
     """Remote eth device created on the controller through libvirt
 
@@ -56,9 +50,11 @@ class VirtualDevice(RemoteDevice):
 
         return super(VirtualDevice, self)._match_update_data(data)
 
-    def create(self):
-        domain_ctl = self.host.get_domain_ctl()
+    def _prepare(self):
+        """picks the hwaddr and network of the device
 
+        Returns the (hwaddr, net_name, driver) tuple used to attach it.
+        """
         if self.orig_hwaddr:
             if self.host.get_dev_by_hwaddr(self.orig_hwaddr):
                 msg = "Device with hwaddr %s already exists" % self.orig_hwaddr
@@ -75,6 +71,8 @@ class VirtualDevice(RemoteDevice):
         if self.network in bridges:
             net_ctl = bridges[self.network]
         else:
+            # libvirt is imported only when needed
+            from lnst.Devices.VirtNetCtl import VirtNetCtl
             bridges[self.network] = net_ctl = VirtNetCtl()
             net_ctl.init()
 
@@ -82,17 +80,47 @@ class VirtualDevice(RemoteDevice):
 
         logging.info("Creating virtual device with hwaddr='%s' on machine %s",
                      self.orig_hwaddr, self.host.get_id())
+        return (self.orig_hwaddr, net_name, self.virt_driver)
 
-        domain_ctl.attach_interface(self.orig_hwaddr,
-                                    net_name,
-                                    self.virt_driver)
-        # The sleep here is necessary, because udev sometimes renames the
-        # newly created device
-        sleep(1)
+    def create(self):
+        VirtualDevice.create_devices([self])
 
     def destroy(self):
-        logging.info("Destroying virtual device with hwaddr='%s' on machine %s",
-                     self.orig_hwaddr, self.host.get_id())
-
-        domain_ctl = self.host.get_domain_ctl()
-        domain_ctl.detach_interface(self.orig_hwaddr)
+        VirtualDevice.destroy_devices([self])
+
+    @staticmethod
+    def create_devices(devices):
+        """attaches several VirtualDevices with one call per domain
+
+        There's no waiting here, the Slave announces the new devices with
+        netlink events which are processed by Machine.wait_for_tmp_devices.
+        """
+        for host, host_devs in VirtualDevice._by_host(devices):
+            domain_ctl = host.get_domain_ctl()
+            domain_ctl.attach_interfaces([dev._prepare()
+                                          for dev in host_devs])
+
+    @staticmethod
+    def destroy_devices(devices, strict=True):
+        """detaches several VirtualDevices, waiting until the guests
+        release all of them, see VirtDomainCtl.detach_interfaces"""
+        for host, host_devs in VirtualDevice._by_host(devices):
+            for dev in host_devs:
+                logging.info("Destroying virtual device with hwaddr='%s' on "
+                             "machine %s", dev.orig_hwaddr, host.get_id())
+            domain_ctl = host.get_domain_ctl()
+            domain_ctl.detach_interfaces([dev.orig_hwaddr
+                                          for dev in host_devs],
+                                         strict=strict)
+
+    @staticmethod
+    def _by_host(devices):
+        hosts = []
+        for dev in devices:
+            for host, host_devs in hosts:
+                if host is dev.host:
+                    host_devs.append(dev)
+                    break
+            else:
+                hosts.append((dev.host, [dev]))
+        return hosts
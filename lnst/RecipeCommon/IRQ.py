@@ -11,6 +11,8 @@ __author__ = """
 jtluka@redhat.com (Jan Tluka)
 """
 
+import logging
+
 
 '''
 Pins all device IRQs to specified cpu on machine.
@@ -30,3 +32,33 @@ def pin_dev_irqs(machine, device, cpu):
         except:
             continue
         machine.config("/proc/irq/%s/smp_affinity_list" % intr.strip(), cpu)
+
+    mismatched = check_dev_irqs(machine, device, cpu)
+    if len(mismatched) > 0:
+        logging.warning("IRQs %s of device %s are not pinned to cpu %s" %
+                        (", ".join(mismatched), device.get_devname(), cpu))
+    return len(mismatched) == 0
+
+'''
+Verifies that all device IRQs are pinned to specified cpu on machine.
+
+machine: HostAPI object
+device: InterfaceAPI object
+cpu: integer
+
+Returns the list of IRQ numbers whose affinity differs from cpu.
+'''
+def check_dev_irqs(machine, device, cpu):
+    pi = machine.run("for i in $(grep %s /proc/interrupts | cut -f1 -d:); do "
+                     "echo $i $(cat /proc/irq/$i/smp_affinity_list); done"
+                     % device.get_devname())
+    res = pi.get_result()
+    mismatched = []
+    for line in res["res_data"]["stdout"].split('\n'):
+        fields = line.split()
+        if len(fields) != 2:
+            continue
+        intr, affinity = fields
+        if affinity != str(cpu):
+            mismatched.append(intr)
+    return mismatched
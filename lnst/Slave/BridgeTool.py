@@ -1,5 +1,8 @@
 """
-This module defines a class useful to work with "bridge" tool.
+This module defines a class useful to work with bridge VLANs, FDB entries
+and port flags. It talks rtnetlink directly (the same messages the "bridge"
+tool sends), which allows programming thousands of entries over a single
+socket.
 
 Copyright 2015 Mellanox Technologies. All rights reserved.
 Licensed under the GNU General Public License, version 2 as
@@ -10,110 +13,395 @@ __author__ = """
 jiri@mellanox.com (Jiri Pirko)
 """
 
+import errno
+from socket import AF_BRIDGE
+from pyroute2 import IPRoute
+from pyroute2.netlink import NLM_F_REQUEST, NLM_F_ACK, NLM_F_CREATE
+from pyroute2.netlink import NLM_F_EXCL, NLM_F_DUMP, NLA_F_NESTED
+from pyroute2.netlink.exceptions import NetlinkError
+from pyroute2.netlink.rtnl import RTM_NEWNEIGH, RTM_DELNEIGH, RTM_GETNEIGH
+from pyroute2.netlink.rtnl import RTM_SETLINK, RTM_DELLINK, RTM_GETLINK
+from pyroute2.netlink.rtnl.ifinfmsg import ifinfmsg
+from pyroute2.netlink.rtnl.ndmsg import ndmsg
 from lnst.Common.NetUtils import normalize_hwaddr
-from lnst.Common.ExecCmd import exec_cmd
-import re
+from lnst.Common.LnstError import LnstError
+
+#include/uapi/linux/if_bridge.h
+BRIDGE_FLAGS_MASTER = 1
+BRIDGE_FLAGS_SELF = 2
+
+BRIDGE_VLAN_INFO_MASTER = 0x1
+BRIDGE_VLAN_INFO_PVID = 0x2
+BRIDGE_VLAN_INFO_UNTAGGED = 0x4
+BRIDGE_VLAN_INFO_RANGE_BEGIN = 0x8
+BRIDGE_VLAN_INFO_RANGE_END = 0x10
+
+BR_STATES = {"disabled": 0, "listening": 1, "learning": 2,
+             "forwarding": 3, "blocking": 4}
+
+#include/uapi/linux/rtnetlink.h
+RTEXT_FILTER_BRVLAN = 1 << 1
+
+#include/uapi/linux/neighbour.h
+NTF_SELF = 0x02
+NTF_MASTER = 0x04
+NTF_EXT_LEARNED = 0x10
+NTF_OFFLOADED = 0x20
+NUD_PERMANENT = 0x80
+NUD_NOARP = 0x40
+
+#maximum number of VLAN entries sent in one netlink message
+VLANS_PER_MSG = 256
+#maximum number of requests sent before their acks are collected
+REQUEST_WINDOW = 64
+
+class BridgeToolError(LnstError):
+    pass
+
+def _br_flags(info):
+    flags = 0
+    if info.get("self", False):
+        flags |= BRIDGE_FLAGS_SELF
+    if info.get("master", False):
+        flags |= BRIDGE_FLAGS_MASTER
+    return flags
+
+def _vlan_flags(br_vlan_info):
+    flags = 0
+    if br_vlan_info.get("pvid", False):
+        flags |= BRIDGE_VLAN_INFO_PVID
+    if br_vlan_info.get("untagged", False):
+        flags |= BRIDGE_VLAN_INFO_UNTAGGED
+    return flags
+
+def _compress_vlans(vlans):
+    """turns a list of (vid, flags) into VLAN_INFO entries
+
+    Consecutive VLANs with the same flags are sent as a single range, PVID
+    can't be part of a range.
+    """
+    entries = []
+    vlans = sorted(vlans)
+    i = 0
+    while i < len(vlans):
+        vid, flags = vlans[i]
+        j = i
+        if not flags & BRIDGE_VLAN_INFO_PVID:
+            while j + 1 < len(vlans) and vlans[j + 1][1] == flags and \
+                  vlans[j + 1][0] == vlans[j][0] + 1:
+                j += 1
+        if j == i:
+            entries.append({"flags": flags, "vid": vid})
+        else:
+            entries.append({"flags": flags | BRIDGE_VLAN_INFO_RANGE_BEGIN,
+                            "vid": vid})
+            entries.append({"flags": flags | BRIDGE_VLAN_INFO_RANGE_END,
+                            "vid": vlans[j][0]})
+        i = j + 1
+    return entries
 
 class BridgeTool:
     def __init__(self, dev_name):
         self._dev_name = dev_name
+        self._if_index = None
+
+    def _get_if_index(self, ipr):
+        if self._if_index is None:
+            indices = ipr.link_lookup(ifname=self._dev_name)
+            if not indices:
+                raise BridgeToolError("Device %s not found" % self._dev_name)
+            self._if_index = indices[0]
+        return self._if_index
+
+    def _requests(self, ipr, msgs):
+        """sends (msg, msg_type, msg_flags) requests and checks their acks
+
+        Up to REQUEST_WINDOW requests are in flight at a time so bulk
+        operations don't wait for a round trip per entry.
+        """
+        pending = []
+        for msg, msg_type, msg_flags in msgs:
+            seq = ipr.addr_pool.alloc()
+            ipr.put(msg, msg_type, msg_flags | NLM_F_REQUEST | NLM_F_ACK,
+                    msg_seq=seq)
+            pending.append(seq)
+            if len(pending) >= REQUEST_WINDOW:
+                self._collect(ipr, pending)
+                pending = []
+        self._collect(ipr, pending)
+
+    def _collect(self, ipr, pending):
+        error = None
+        for seq in pending:
+            try:
+                ipr.get(msg_seq=seq)
+            except NetlinkError as e:
+                if error is None:
+                    error = e
+            finally:
+                ipr.addr_pool.free(seq, ban=0xff)
+        if error is not None:
+            raise BridgeToolError("Bridge operation on %s failed: %s" %
+                                  (self._dev_name, str(error)))
+
+    def _vlan_msgs(self, op, br_vlan_infos, ipr):
+        if_index = self._get_if_index(ipr)
+        msg_type = RTM_SETLINK if op == "add" else RTM_DELLINK
+
+        groups = {}
+        for info in br_vlan_infos:
+            vlans = groups.setdefault(_br_flags(info), [])
+            vlans.append((int(info["vlan_id"]), _vlan_flags(info)))
+
+        for br_flags, vlans in groups.iteritems():
+            entries = _compress_vlans(vlans)
+            i = 0
+            while i < len(entries):
+                chunk = entries[i:i + VLANS_PER_MSG]
+                #don't split a range between two messages
+                if chunk[-1]["flags"] & BRIDGE_VLAN_INFO_RANGE_BEGIN:
+                    chunk = entries[i:i + VLANS_PER_MSG + 1]
+                i += len(chunk)
+
+                attrs = []
+                if br_flags:
+                    attrs.append(["IFLA_BRIDGE_FLAGS", br_flags])
+                for entry in chunk:
+                    attrs.append(["IFLA_BRIDGE_VLAN_INFO", entry])
 
-    def _add_del_vlan(self, op, br_vlan_info):
-        cmd = "bridge vlan %s dev %s vid %d" % (op, self._dev_name,
-                                                br_vlan_info["vlan_id"])
-        if br_vlan_info["pvid"]:
-            cmd += " pvid"
-        if br_vlan_info["untagged"]:
-            cmd += " untagged"
-        if br_vlan_info["self"]:
-            cmd += " self"
-        if br_vlan_info["master"]:
-            cmd += " master"
-        exec_cmd(cmd)
+                msg = ifinfmsg()
+                msg["family"] = AF_BRIDGE
+                msg["index"] = if_index
+                msg["attrs"] = [("IFLA_AF_SPEC", {"attrs": attrs},
+                                 NLA_F_NESTED)]
+                yield msg, msg_type, 0
+
+    def add_vlans(self, br_vlan_infos):
+        ipr = IPRoute()
+        try:
+            self._requests(ipr, self._vlan_msgs("add", br_vlan_infos, ipr))
+        finally:
+            ipr.close()
+
+    def del_vlans(self, br_vlan_infos):
+        ipr = IPRoute()
+        try:
+            self._requests(ipr, self._vlan_msgs("del", br_vlan_infos, ipr))
+        finally:
+            ipr.close()
 
     def add_vlan(self, br_vlan_info):
-        return self._add_del_vlan("add", br_vlan_info)
+        return self.add_vlans([br_vlan_info])
 
     def del_vlan(self, br_vlan_info):
-        return self._add_del_vlan("del", br_vlan_info)
+        return self.del_vlans([br_vlan_info])
 
     def get_vlans(self):
-        output = exec_cmd("bridge vlan show dev %s" % self._dev_name,
-                          die_on_err=False)[0]
+        ipr = IPRoute()
+        try:
+            if_index = self._get_if_index(ipr)
+            msg = ifinfmsg()
+            msg["family"] = AF_BRIDGE
+            msg["attrs"] = [["IFLA_EXT_MASK", RTEXT_FILTER_BRVLAN]]
+            links = ipr.nlm_request(msg, msg_type=RTM_GETLINK,
+                                    msg_flags=NLM_F_REQUEST | NLM_F_DUMP)
+        finally:
+            ipr.close()
+
         br_vlan_info_list = []
-        for line in output.split("\n"):
-            match = re.match(r'.*\s+(\d+)', line)
-            if match:
-                vlan_id = int(match.groups()[0])
-                pvid = True if re.match(r'.*\s+PVID', line) else False
-                untagged = True if re.match(r'.*\s+Egress Untagged', line) \
-                                else False
-                br_vlan_info = {"vlan_id": vlan_id, "pvid": pvid,
-                                "untagged": untagged}
-                br_vlan_info_list.append(br_vlan_info)
+        for link in links:
+            if link["index"] != if_index:
+                continue
+            af_spec = link.get_attr("IFLA_AF_SPEC")
+            if af_spec is None:
+                continue
+            range_begin = None
+            for entry in af_spec.get_attrs("IFLA_BRIDGE_VLAN_INFO"):
+                flags = entry["flags"]
+                if flags & BRIDGE_VLAN_INFO_RANGE_BEGIN:
+                    range_begin = entry["vid"]
+                    continue
+                if flags & BRIDGE_VLAN_INFO_RANGE_END:
+                    vids = range(range_begin, entry["vid"] + 1)
+                else:
+                    vids = [entry["vid"]]
+
+                for vlan_id in vids:
+                    br_vlan_info_list.append(
+                        {"vlan_id": vlan_id,
+                         "pvid": bool(flags & BRIDGE_VLAN_INFO_PVID),
+                         "untagged": bool(flags & BRIDGE_VLAN_INFO_UNTAGGED)})
         return br_vlan_info_list
 
-    def _add_del_fdb(self, op, br_fdb_info):
-        cmd = "bridge fdb %s %s dev %s" % (op, br_fdb_info["hwaddr"],
-                                           self._dev_name)
-        if br_fdb_info["self"]:
-            cmd += " self"
-        if br_fdb_info["master"]:
-            cmd += " master"
-        if br_fdb_info["vlan_id"]:
-            cmd += " vlan %s" % br_fdb_info["vlan_id"]
-        exec_cmd(cmd)
+    def _fdb_msg(self, if_index, br_fdb_info):
+        flags = 0
+        if br_fdb_info.get("self", False):
+            flags |= NTF_SELF
+        if br_fdb_info.get("master", False):
+            flags |= NTF_MASTER
+        if not flags:
+            #the bridge tool default
+            flags = NTF_SELF
+
+        msg = ndmsg()
+        msg["family"] = AF_BRIDGE
+        msg["ifindex"] = if_index
+        #"bridge fdb add" without permanent or temp adds NUD_PERMANENT, the
+        #entries are local (permanent) as when they were added by the tool
+        msg["state"] = NUD_NOARP | NUD_PERMANENT
+        msg["flags"] = flags
+        msg["attrs"] = [["NDA_LLADDR", str(br_fdb_info["hwaddr"])]]
+        if br_fdb_info.get("vlan_id", None):
+            msg["attrs"].append(["NDA_VLAN", int(br_fdb_info["vlan_id"])])
+        return msg
+
+    def _fdb_msgs(self, op, br_fdb_infos, ipr):
+        if_index = self._get_if_index(ipr)
+        if op == "add":
+            msg_type = RTM_NEWNEIGH
+            msg_flags = NLM_F_CREATE | NLM_F_EXCL
+        else:
+            msg_type = RTM_DELNEIGH
+            msg_flags = 0
+
+        for info in br_fdb_infos:
+            yield self._fdb_msg(if_index, info), msg_type, msg_flags
+
+    def add_fdbs(self, br_fdb_infos):
+        ipr = IPRoute()
+        try:
+            self._requests(ipr, self._fdb_msgs("add", br_fdb_infos, ipr))
+        finally:
+            ipr.close()
+
+    def del_fdbs(self, br_fdb_infos):
+        ipr = IPRoute()
+        try:
+            self._requests(ipr, self._fdb_msgs("del", br_fdb_infos, ipr))
+        finally:
+            ipr.close()
 
     def add_fdb(self, br_fdb_info):
-        return self._add_del_fdb("add", br_fdb_info)
+        return self.add_fdbs([br_fdb_info])
 
     def del_fdb(self, br_fdb_info):
-        return self._add_del_fdb("del", br_fdb_info)
+        return self.del_fdbs([br_fdb_info])
+
+    def _fdb_info(self, neigh):
+        flags = neigh["flags"]
+        hwaddr = neigh.get_attr("NDA_LLADDR")
+        if hwaddr is None:
+            return None
+        return {"hwaddr": normalize_hwaddr(hwaddr),
+                "vlan_id": neigh.get_attr("NDA_VLAN") or 0,
+                "self": bool(flags & NTF_SELF),
+                #the bridge reports its records with the NDA_MASTER
+                #attribute, that's what "bridge fdb" shows as master
+                "master": bool(flags & NTF_MASTER or
+                               neigh.get_attr("NDA_MASTER") is not None),
+                "offload": bool(flags & (NTF_EXT_LEARNED | NTF_OFFLOADED))}
+
+    def get_fdbs(self):
+        ipr = IPRoute()
+        try:
+            if_index = self._get_if_index(ipr)
+            msg = ndmsg()
+            msg["family"] = AF_BRIDGE
+            neighs = ipr.nlm_request(msg, msg_type=RTM_GETNEIGH,
+                                     msg_flags=NLM_F_REQUEST | NLM_F_DUMP)
+        finally:
+            ipr.close()
 
-    def get_fdbs(_self):
-        output = exec_cmd("bridge fdb show dev %s" % _self._dev_name,
-                          die_on_err=False)[0]
         br_fdb_info_list = []
-        for line in output.split("\n"):
-            match = re.match(r'([0-9a-f]{2}:[0-9a-f]{2}:[0-9a-f]{2}:[0-9a-f]{2}:[0-9a-f]{2}:[0-9a-f]{2})', line)
-            if match:
-                hwaddr = normalize_hwaddr(match.groups()[0])
-                match = re.match(r'.*\s+vlan (\d+)', line)
-                vlan_id = int(match.groups()[0]) if match else 0
-                self = True if re.match(r'.*\s+self', line) else False
-                master = True if re.match(r'.*\s+master', line) else False
-                offload = True if re.match(r'.*\s+offload', line) else False
-                br_fdb_info = {"hwaddr": hwaddr, "vlan_id": vlan_id,
-                               "self": self, "master": master, "offload": offload}
+        for neigh in neighs:
+            if neigh["ifindex"] != if_index:
+                continue
+            br_fdb_info = self._fdb_info(neigh)
+            if br_fdb_info is not None:
                 br_fdb_info_list.append(br_fdb_info)
         return br_fdb_info_list
 
+    def get_fdb(self, hwaddr, vlan_id=0):
+        """returns the FDB records of hwaddr and vlan_id on the device
+
+        Both the bridge (master) and the device (self) records are looked
+        up with a single request each. The whole FDB is dumped only for the
+        records whose lookup isn't supported, by the kernel or, for the self
+        records, by the device driver.
+        """
+        hwaddr = normalize_hwaddr(str(hwaddr))
+        vlan_id = int(vlan_id or 0)
+
+        ipr = IPRoute()
+        try:
+            if_index = self._get_if_index(ipr)
+            br_fdb_info_list = []
+            unsupported = []
+            for flag in ["master", "self"]:
+                msg = self._fdb_msg(if_index, {"hwaddr": hwaddr,
+                                               "vlan_id": vlan_id,
+                                               flag: True})
+                msg["state"] = 0
+                try:
+                    neighs = ipr.nlm_request(msg, msg_type=RTM_GETNEIGH,
+                                             msg_flags=NLM_F_REQUEST)
+                except NetlinkError as e:
+                    if e.code == errno.ENOENT:
+                        continue
+                    if e.code in [errno.EOPNOTSUPP, errno.EINVAL]:
+                        unsupported.append(flag)
+                        continue
+                    raise BridgeToolError("FDB lookup on %s failed: %s" %
+                                          (self._dev_name, str(e)))
+                for neigh in neighs:
+                    br_fdb_info = self._fdb_info(neigh)
+                    if br_fdb_info is not None:
+                        br_fdb_info_list.append(br_fdb_info)
+        finally:
+            ipr.close()
+
+        if unsupported:
+            br_fdb_info_list.extend(
+                    [fdb for fdb in self.get_fdbs()
+                     if fdb["hwaddr"] == hwaddr and fdb["vlan_id"] == vlan_id
+                     and any([fdb[flag] for flag in unsupported])])
+        return br_fdb_info_list
+
+    def _set_protinfo(self, attrs, br_link_info):
+        ipr = IPRoute()
+        try:
+            msg = ifinfmsg()
+            msg["family"] = AF_BRIDGE
+            msg["index"] = self._get_if_index(ipr)
+            msg["attrs"] = [("IFLA_PROTINFO", {"attrs": attrs},
+                             NLA_F_NESTED)]
+            br_flags = _br_flags(br_link_info)
+            if br_flags:
+                msg["attrs"].append(("IFLA_AF_SPEC",
+                                     {"attrs": [["IFLA_BRIDGE_FLAGS",
+                                                 br_flags]]},
+                                     NLA_F_NESTED))
+            self._requests(ipr, [(msg, RTM_SETLINK, 0)])
+        finally:
+            ipr.close()
+
     def _set_link(self, attr, br_link_info):
-        cmd = "bridge link set dev %s %s" % (self._dev_name, attr)
-        if br_link_info["on"]:
-            cmd += " on"
-        else:
-            cmd += " off"
-        if br_link_info["self"]:
-            cmd += " self"
-        if br_link_info["master"]:
-            cmd += " master"
-        exec_cmd(cmd)
+        value = 1 if br_link_info["on"] else 0
+        self._set_protinfo([[attr, value]], br_link_info)
 
     def set_learning(self, br_learning_info):
-        return self._set_link("learning", br_learning_info)
+        return self._set_link("IFLA_BRPORT_LEARNING", br_learning_info)
 
     def set_learning_sync(self, br_learning_sync_info):
-        return self._set_link("learning_sync", br_learning_sync_info)
+        return self._set_link("IFLA_BRPORT_LEARNING_SYNC",
+                              br_learning_sync_info)
 
     def set_flooding(self, br_flooding_info):
-        return self._set_link("flood", br_flooding_info)
+        return self._set_link("IFLA_BRPORT_UNICAST_FLOOD", br_flooding_info)
 
     def set_state(self, br_state_info):
-        cmd = "bridge link set dev %s state %s" % (self._dev_name,
-                                                   br_state_info["state"])
-        if br_state_info["self"]:
-            cmd += " self"
-        if br_state_info["master"]:
-            cmd += " master"
-        exec_cmd(cmd)
+        state = br_state_info["state"]
+        if state in BR_STATES:
+            state = BR_STATES[state]
+        self._set_protinfo([["IFLA_BRPORT_STATE", int(state)]],
+                           br_state_info)
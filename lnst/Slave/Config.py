@@ -34,6 +34,12 @@ class SlaveConfig(Config):
                 "action" : self.optionPort,
                 "name" : "rpcport"}
 
+        self._options['environment']['exec_cmd_timeout'] = {\
+                "value" : 0,
+                "additive" : False,
+                "action" : self.optionTimeval,
+                "name" : "exec_cmd_timeout"}
+
         self._options['cache'] = dict()
         self._options['cache']['dir'] = {\
                 "value" : os.path.abspath(os.path.join(
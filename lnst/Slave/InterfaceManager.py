@@ -104,7 +104,7 @@ class InterfaceManager(object):
             logging.debug("Deleting Device with if_index %d, name %s because "\
                           "it doesn't exist anymore." % (i, dev_name))
 
-            self._devices[i]._deleted = True
+            self._devices[i]._mark_deleted()
             del self._devices[i]
 
             del_msg = {"type": "dev_deleted",
@@ -140,7 +140,7 @@ class InterfaceManager(object):
         elif msg['header']['type'] == RTM_DELLINK:
             if msg['index'] in self._devices:
                 dev = self._devices[msg['index']]
-                dev._deleted = True
+                dev._mark_deleted()
 
                 del self._devices[msg['index']]
 
@@ -17,10 +17,13 @@ import signal
 import logging
 import multiprocessing
 from lnst.Common.JobError import JobError
-from lnst.Common.ExecCmd import exec_cmd, ExecCmdFail
+from lnst.Common.ExecCmd import exec_cmd, ExecCmdFail, set_default_timeout
 from lnst.Common.ConnectionHandler import send_data
 from lnst.Common.Logs import log_exc_traceback
 
+#maximal size of the data of one job_output message
+OUTPUT_CHUNK_SIZE = 65536
+
 def get_job_class(what):
     if what["type"] == "shell":
         return ShellExecJob(what)
@@ -30,6 +33,29 @@ def get_job_class(what):
         logging.error("Unknown job type \"%s\"" % what["type"])
         raise JobError("Unknown command type \"%s\"" % what["type"])
 
+class JobOutputSender(object):
+    """Sends the output of a running job to the Controller
+
+    Used as the output_cb of exec_cmd, every call sends the data in
+    job_output messages of at most OUTPUT_CHUNK_SIZE bytes. Each stream has
+    its own sequence numbers starting at 0.
+    """
+    def __init__(self, job_id, target):
+        self._job_id = job_id
+        self._target = target
+        self._seq = {"stdout": 0, "stderr": 0}
+
+    def __call__(self, out_type, data):
+        stream = out_type.lower()
+        for i in range(0, len(data), OUTPUT_CHUNK_SIZE):
+            msg = {"type": "job_output",
+                   "job_id": self._job_id,
+                   "stream": stream,
+                   "seq": self._seq[stream],
+                   "data": data[i:i + OUTPUT_CHUNK_SIZE]}
+            send_data(self._target, msg)
+            self._seq[stream] += 1
+
 class JobContext(object):
     def __init__(self):
         self._dict = {}
@@ -101,6 +127,12 @@ class Job(object):
 
         self._log_ctl.disable_logging()
         self._log_ctl.set_connection(self._child_pipe)
+        self._log_ctl.set_job_id(self._id)
+        self._job_cls.set_output_cb(JobOutputSender(self._id,
+                                                    self._child_pipe))
+        # the slave's exec_cmd timeout is meant for its own commands, jobs
+        # run until they finish or are killed by the controller
+        set_default_timeout(0)
 
         result = {}
         try:
@@ -146,6 +178,10 @@ class GenericJob(object):
         self._result = {"passed": False,
                         "res_data": None,
                         "msg": None}
+        self._output_cb = None
+
+    def set_output_cb(self, output_cb):
+        self._output_cb = output_cb
 
     def run(self):
         raise JobError("Method run must be defined.")
@@ -218,14 +254,16 @@ class GenericJob(object):
 
 class ShellExecJob(GenericJob):
     def run(self):
+        #the output is streamed by the output_cb, the Controller assembles
+        #stdout and stderr (and parses json) so the result stays small
         try:
-            stdout, stderr = exec_cmd(self._what["command"], self._what["json"])
+            #jobs can run for any time, the default timeout doesn't apply
+            exec_cmd(self._what["command"], log_outputs=False, timeout=0,
+                     output_cb=self._output_cb, max_output=OUTPUT_CHUNK_SIZE)
             self._result["passed"] = True
-            self._result["res_data"] = {"stdout": stdout, "stderr": stderr}
-        except ExecCmdFail as e:
+        except ExecCmdFail:
             self._result["passed"] = False
-            self._result["res_data"] = res_data = {"stdout": e.get_stdout(),
-                                                   "stderr": e.get_stderr()}
+        self._result["res_data"] = {}
 
     # def _format_cmd_res_header(self):
         # cmd_type = self._what["type"]
@@ -17,6 +17,7 @@ from lnst.Common.ExecCmd import exec_cmd
 from lnst.Slave.NetConfigCommon import get_slaves, get_option, get_slave_option
 from lnst.Slave.NetConfigCommon import parse_netem, get_slave_options
 from lnst.Common.Utils import bool_it
+from lnst.Common.TeamdCtl import TeamdCtl
 from lnst.Slave.NmConfigDevice import type_class_mapping as nm_type_class_mapping
 from lnst.Slave.NmConfigDevice import is_nm_managed
 
@@ -379,8 +380,14 @@ class NetConfigDeviceTeam(NetConfigDeviceGeneric):
 
     def destroy(self):
         dev_name = self._dev_config["name"]
+        self._teamd_ctl().close()
         exec_cmd("teamd -k -t %s" % dev_name)
 
+    def _teamd_ctl(self):
+        if not hasattr(self, "_teamd_ctl_conn"):
+            self._teamd_ctl_conn = TeamdCtl(self._dev_config["name"])
+        return self._teamd_ctl_conn
+
     def configure(self):
         self._ports_down()
 
@@ -393,29 +400,24 @@ class NetConfigDeviceTeam(NetConfigDeviceGeneric):
             self._slave_del(slave_id)
 
     def _slave_add(self, slave_id):
-        dev_name = self._dev_config["name"]
         port_dev = self._if_manager.get_mapped_device(slave_id)
         port_name = port_dev.get_name()
         teamd_port_config = get_slave_option(self._dev_config,
                                              slave_id,
                                              "teamd_port_config")
-        dbus_option = "-D" if self._should_enable_dbus() else ""
         if teamd_port_config:
-            teamd_port_config = prepare_json_str(teamd_port_config)
-            exec_cmd("teamdctl %s %s port config update %s \"%s\"" % (dbus_option, dev_name, port_name, teamd_port_config))
+            self._teamd_ctl().port_config_update(port_name, teamd_port_config)
         port_dev.down()
-        exec_cmd("teamdctl %s %s port add %s" % (dbus_option, dev_name, port_name))
+        self._teamd_ctl().port_add(port_name)
 
     def slave_add(self, slave_id):
         self._slave_add(slave_id)
         self._dev_config["slaves"].append(slave_id)
 
     def _slave_del(self, slave_id):
-        dev_name = self._dev_config["name"]
         port_dev = self._if_manager.get_mapped_device(slave_id)
         port_name = port_dev.get_name()
-        dbus_option = "-D" if self._should_enable_dbus() else ""
-        exec_cmd("teamdctl %s %s port remove %s" % (dbus_option, dev_name, port_name))
+        self._teamd_ctl().port_remove(port_name)
 
     def slave_del(self, slave_id):
         self._dev_config["slaves"].remove(slave_id)
@@ -21,6 +21,8 @@ import ctypes
 import multiprocessing
 import imp
 import types
+import shutil
+import tempfile
 from time import sleep, time
 from inspect import isclass
 from tempfile import NamedTemporaryFile
@@ -28,6 +30,7 @@ from lnst.Common.Logs import log_exc_traceback
 from lnst.Common.PacketCapture import PacketCapture
 from lnst.Common.Utils import die_when_parent_die
 from lnst.Common.ExecCmd import exec_cmd, ExecCmdFail
+from lnst.Common.ExecCmd import set_default_timeout
 from lnst.Common.ResourceCache import ResourceCache
 from lnst.Common.NetTestCommand import NetTestCommandContext
 from lnst.Common.NetTestCommand import NetTestCommand
@@ -38,11 +41,10 @@ from lnst.Common.ConnectionHandler import send_data
 from lnst.Common.ConnectionHandler import ConnectionHandler
 from lnst.Common.Config import DefaultRPCPort
 from lnst.Common.DeviceRef import DeviceRef
+from lnst.Common.DeviceRef import encode_payload, decode_payload
 from lnst.Common.LnstError import LnstError
 from lnst.Common.DeviceError import DeviceDeleted
 from lnst.Common.IpAddress import IpAddress
-from lnst.Common.TestModule import BaseTestModule
-from lnst.Common.Parameters import Parameters, DeviceParam
 from lnst.Slave.Job import Job, JobContext
 from lnst.Slave.InterfaceManager import InterfaceManager
 from lnst.Slave.BridgeTool import BridgeTool
@@ -65,6 +67,7 @@ class SlaveMethods:
     def __init__(self, job_context, log_ctl, net_namespaces,
                  server_handler, slave_config, slave_server):
         self._packet_captures = {}
+        self._stopped_captures = {}
         self._if_manager = None
         self._job_context = job_context
         self._log_ctl = log_ctl
@@ -74,6 +77,7 @@ class SlaveMethods:
         self._slave_config = slave_config
 
         self._capture_files = {}
+        self._capture_extracts = {}
         self._copy_targets = {}
         self._copy_sources = {}
         self._system_config = {}
@@ -95,9 +99,12 @@ class SlaveMethods:
         else:
             slave_desc["nm_running"] = False
 
-        k_release, _ = exec_cmd("uname -r", False, False, False)
-        r_release, _ = exec_cmd("cat /etc/redhat-release", False, False, False)
-        slave_desc["kernel_release"] = k_release.strip()
+        try:
+            with open("/etc/redhat-release") as f:
+                r_release = f.read()
+        except IOError:
+            r_release = ""
+        slave_desc["kernel_release"] = os.uname()[2]
         slave_desc["redhat_release"] = r_release.strip()
         slave_desc["lnst_version"] = self._slave_config.version
 
@@ -343,33 +350,89 @@ class SlaveMethods:
             # logging.error("No device with id '%s' to deconfigure." % if_id)
         # return True
 
-    def start_packet_capture(self, filt):
+    def start_packet_capture(self, filt, ring_file_size=None,
+                             ring_file_count=None):
+        """starts tcpdump on all devices except the loopback and the device
+        of the Controller connection
+
+        When ring_file_size (MB) and ring_file_count are set, each capture
+        writes into a bounded ring of compressed files in its own temporary
+        directory and packets can be retrieved with get_packet_capture.
+        Returns a dictionary mapping if_index to the capture file (or ring
+        directory). A previous capture of a device is stopped and its files
+        are removed.
+        """
         if not is_installed("tcpdump"):
             raise Exception("Can't start packet capture, tcpdump not available")
 
+        ring = ring_file_size is not None and ring_file_count is not None
+
         files = {}
-        for if_id, dev in self._if_manager.get_mapped_devices().iteritems():
-            if dev.get_netns() != None:
+        for dev in self._if_manager.get_devices():
+            if not dev._enabled or "loopback" in dev.state:
                 continue
-            dev_name = dev.get_name()
+            if_index = dev.if_index
+            self._remove_capture(if_index)
 
-            df_handle = NamedTemporaryFile(delete=False)
-            dump_file = df_handle.name
-            df_handle.close()
-
-            files[if_id] = dump_file
+            if ring:
+                dump_dir = tempfile.mkdtemp(prefix="lnst_pcap_")
+                dump_file = os.path.join(dump_dir, dev.name + ".pcap")
+                files[if_index] = dump_dir
+            else:
+                df_handle = NamedTemporaryFile(delete=False)
+                dump_file = df_handle.name
+                df_handle.close()
+                files[if_index] = dump_file
 
             pcap = PacketCapture()
-            pcap.set_interface(dev_name)
+            pcap.set_interface(dev.name)
             pcap.set_output_file(dump_file)
             pcap.set_filter(filt)
+            if ring:
+                pcap.set_ring(ring_file_size, ring_file_count)
             pcap.start()
 
-            self._packet_captures[if_id] = pcap
+            self._packet_captures[if_index] = pcap
 
-        self._capture_files = files
+        self._capture_files.update(files)
         return files
 
+    def get_packet_capture(self, if_index, start=None, end=None, filt=None):
+        """extracts packets of a capture into a gzipped pcap file
+
+        Args:
+            if_index -- device whose capture is used
+            start, end -- unix timestamps of the Slave bounding the time
+                window, None means unbounded
+            filt -- optional BPF filter applied to the extracted packets
+        Returns:
+            path of the file to be copied to the Controller, it's removed
+            with the other capture files or by remove_capture_extract
+        """
+        pcap = self._packet_captures.get(if_index, None)
+        if pcap is None:
+            pcap = self._stopped_captures.get(if_index, None)
+        if pcap is None:
+            raise LnstError("No packet capture of device %s" % if_index)
+
+        df_handle = NamedTemporaryFile(suffix=".pcap.gz", delete=False)
+        extract_file = df_handle.name
+        df_handle.close()
+        self._capture_extracts[extract_file] = if_index
+
+        count = pcap.extract(extract_file, start, end, filt)
+        logging.debug("Extracted %d packets of device %s into %s" %
+                      (count, if_index, extract_file))
+        return extract_file
+
+    def remove_capture_extract(self, path):
+        if path not in self._capture_extracts:
+            return False
+        if os.path.exists(path):
+            os.unlink(path)
+        del self._capture_extracts[path]
+        return True
+
     def stop_packet_capture(self):
         if self._packet_captures == None:
             return True
@@ -377,16 +440,40 @@ class SlaveMethods:
         for if_index, pcap in self._packet_captures.iteritems():
             pcap.stop()
 
+        #keep the stopped captures available for retrieval
+        self._stopped_captures.update(self._packet_captures)
         self._packet_captures.clear()
 
         return True
 
-    def _remove_capture_files(self):
-        for key, name in self._capture_files.iteritems():
-            logging.debug("Removing temporary packet capture file %s", name)
+    def _remove_capture(self, if_index):
+        """stops the capture of the device and removes its files"""
+        pcap = self._packet_captures.pop(if_index, None)
+        if pcap is not None:
+            pcap.stop()
+        else:
+            pcap = self._stopped_captures.pop(if_index, None)
+        if pcap is not None:
+            pcap.cleanup()
+
+        name = self._capture_files.pop(if_index, None)
+        if name is None:
+            return
+        logging.debug("Removing temporary packet capture file %s", name)
+        if os.path.isdir(name):
+            shutil.rmtree(name, ignore_errors=True)
+        elif os.path.exists(name):
             os.unlink(name)
 
-        self._capture_files.clear()
+    def _remove_capture_files(self):
+        if_indexes = set(self._capture_files.keys())
+        if_indexes.update(self._packet_captures.keys())
+        if_indexes.update(self._stopped_captures.keys())
+        for if_index in if_indexes:
+            self._remove_capture(if_index)
+
+        for path in self._capture_extracts.keys():
+            self.remove_capture_extract(path)
 
     def _update_system_config(self, options, persistent):
         system_config = self._system_config
@@ -708,91 +795,79 @@ class SlaveMethods:
             # device.set_netns(None)
             # return True
 
-    def add_br_vlan(self, if_id, br_vlan_info):
-        dev = self._if_manager.get_mapped_device(if_id)
-        if not dev:
-            logging.error("Device with id '%s' not found." % if_id)
-            return False
-        brt = BridgeTool(dev.get_name())
+    def _get_bridge_tool(self, if_index):
+        dev = self._if_manager.get_device(if_index)
+        return BridgeTool(dev.name)
+
+    def add_br_vlan(self, if_index, br_vlan_info):
+        brt = self._get_bridge_tool(if_index)
         brt.add_vlan(br_vlan_info)
         return True
 
-    def del_br_vlan(self, if_id, br_vlan_info):
-        dev = self._if_manager.get_mapped_device(if_id)
-        if not dev:
-            logging.error("Device with id '%s' not found." % if_id)
-            return False
-        brt = BridgeTool(dev.get_name())
+    def del_br_vlan(self, if_index, br_vlan_info):
+        brt = self._get_bridge_tool(if_index)
         brt.del_vlan(br_vlan_info)
         return True
 
-    def get_br_vlans(self, if_id):
-        dev = self._if_manager.get_mapped_device(if_id)
-        if not dev:
-            logging.error("Device with id '%s' not found." % if_id)
-            return False
-        brt = BridgeTool(dev.get_name())
+    def add_br_vlans(self, if_index, br_vlan_infos):
+        brt = self._get_bridge_tool(if_index)
+        brt.add_vlans(br_vlan_infos)
+        return True
+
+    def del_br_vlans(self, if_index, br_vlan_infos):
+        brt = self._get_bridge_tool(if_index)
+        brt.del_vlans(br_vlan_infos)
+        return True
+
+    def get_br_vlans(self, if_index):
+        brt = self._get_bridge_tool(if_index)
         return brt.get_vlans()
 
-    def add_br_fdb(self, if_id, br_fdb_info):
-        dev = self._if_manager.get_mapped_device(if_id)
-        if not dev:
-            logging.error("Device with id '%s' not found." % if_id)
-            return False
-        brt = BridgeTool(dev.get_name())
+    def add_br_fdb(self, if_index, br_fdb_info):
+        brt = self._get_bridge_tool(if_index)
         brt.add_fdb(br_fdb_info)
         return True
 
-    def del_br_fdb(self, if_id, br_fdb_info):
-        dev = self._if_manager.get_mapped_device(if_id)
-        if not dev:
-            logging.error("Device with id '%s' not found." % if_id)
-            return False
-        brt = BridgeTool(dev.get_name())
+    def del_br_fdb(self, if_index, br_fdb_info):
+        brt = self._get_bridge_tool(if_index)
         brt.del_fdb(br_fdb_info)
         return True
 
-    def get_br_fdbs(self, if_id):
-        dev = self._if_manager.get_mapped_device(if_id)
-        if not dev:
-            logging.error("Device with id '%s' not found." % if_id)
-            return False
-        brt = BridgeTool(dev.get_name())
+    def add_br_fdbs(self, if_index, br_fdb_infos):
+        brt = self._get_bridge_tool(if_index)
+        brt.add_fdbs(br_fdb_infos)
+        return True
+
+    def del_br_fdbs(self, if_index, br_fdb_infos):
+        brt = self._get_bridge_tool(if_index)
+        brt.del_fdbs(br_fdb_infos)
+        return True
+
+    def get_br_fdbs(self, if_index):
+        brt = self._get_bridge_tool(if_index)
         return brt.get_fdbs()
 
-    def set_br_learning(self, if_id, br_learning_info):
-        dev = self._if_manager.get_mapped_device(if_id)
-        if not dev:
-            logging.error("Device with id '%s' not found." % if_id)
-            return False
-        brt = BridgeTool(dev.get_name())
+    def get_br_fdb(self, if_index, hwaddr, vlan_id=0):
+        brt = self._get_bridge_tool(if_index)
+        return brt.get_fdb(hwaddr, vlan_id)
+
+    def set_br_learning(self, if_index, br_learning_info):
+        brt = self._get_bridge_tool(if_index)
         brt.set_learning(br_learning_info)
         return True
 
-    def set_br_learning_sync(self, if_id, br_learning_sync_info):
-        dev = self._if_manager.get_mapped_device(if_id)
-        if not dev:
-            logging.error("Device with id '%s' not found." % if_id)
-            return False
-        brt = BridgeTool(dev.get_name())
+    def set_br_learning_sync(self, if_index, br_learning_sync_info):
+        brt = self._get_bridge_tool(if_index)
         brt.set_learning_sync(br_learning_sync_info)
         return True
 
-    def set_br_flooding(self, if_id, br_flooding_info):
-        dev = self._if_manager.get_mapped_device(if_id)
-        if not dev:
-            logging.error("Device with id '%s' not found." % if_id)
-            return False
-        brt = BridgeTool(dev.get_name())
+    def set_br_flooding(self, if_index, br_flooding_info):
+        brt = self._get_bridge_tool(if_index)
         brt.set_flooding(br_flooding_info)
         return True
 
-    def set_br_state(self, if_id, br_state_info):
-        dev = self._if_manager.get_mapped_device(if_id)
-        if not dev:
-            logging.error("Device with id '%s' not found." % if_id)
-            return False
-        brt = BridgeTool(dev.get_name())
+    def set_br_state(self, if_index, br_state_info):
+        brt = self._get_bridge_tool(if_index)
         brt.set_state(br_state_info)
         return True
 
@@ -853,6 +928,7 @@ class ServerHandler(ConnectionHandler):
             self.close_c_sock()
             raise
 
+        self._c_socket[0].set_device_encoding(device_persistent_id)
         self.add_connection(self._c_socket[1], self._c_socket[0])
         return self._c_socket
 
@@ -925,7 +1001,8 @@ class ServerHandler(ConnectionHandler):
                 data = {"type": "from_netns",
                         "netns": self._netns,
                         "data": data}
-            data = device_to_deviceref(data)
+                #the pipe to the parent Slave doesn't encode devices
+                data = device_to_deviceref(data)
             return send_data(self._c_socket[0], data)
         else:
             return False
@@ -992,43 +1069,24 @@ def device_to_deviceref(obj):
     else:
         return obj
 
-def deviceref_to_device(if_manager, obj):
-    if isinstance(obj, DeviceRef):
-        dev = if_manager.get_device(obj.if_index)
-        return dev
-    elif isinstance(obj, dict):
-        new_dict = {}
-        for key, value in obj.items():
-            new_dict[key] = deviceref_to_device(if_manager, value)
-        return new_dict
-    elif isinstance(obj, list):
-        new_list = []
-        for value in obj:
-            new_list.append(deviceref_to_device(if_manager, value))
-        return new_list
-    elif isinstance(obj, tuple):
-        new_list = []
-        for value in obj:
-            new_list.append(deviceref_to_device(if_manager, value))
-        return tuple(new_list)
-    elif isinstance(obj, DeviceParam):
-        obj.val = deviceref_to_device(if_manager, obj.val)
-        return obj
-    elif isinstance(obj, Parameters):
-        for param_name, param in obj:
-            deviceref_to_device(if_manager, param)
-        return obj
-    elif isinstance(obj, BaseTestModule):
-        deviceref_to_device(if_manager, obj.params)
-        return obj
-    else:
-        return obj
+def device_persistent_id(obj):
+    """pickle persistent id function of the Controller connection"""
+    Device = getattr(Devices, "Device", None)
+    if isinstance(obj, DeviceRef) or \
+       (Device is not None and isinstance(obj, Device)):
+        return obj.if_index
+    return None
 
 class NetTestSlave:
     def __init__(self, log_ctl, slave_config):
         self._slave_config = slave_config
         die_when_parent_die()
 
+        exec_timeout = slave_config.get_option("environment",
+                                               "exec_cmd_timeout")
+        if exec_timeout:
+            set_default_timeout(exec_timeout)
+
         self._job_context = JobContext()
         port = slave_config.get_option("environment", "rpcport")
         logging.info("Using RPC port %d." % port)
@@ -1088,11 +1146,10 @@ class NetTestSlave:
             if method != None:
                 if_manager = self._methods._if_manager
                 if if_manager is not None:
-                    args = deviceref_to_device(if_manager, msg["args"])
-                    kwargs = deviceref_to_device(if_manager, msg["kwargs"])
+                    resolve = if_manager.get_device
                 else:
-                    args = msg["args"]
-                    kwargs = msg["kwargs"]
+                    resolve = DeviceRef
+                args, kwargs = decode_payload(msg["payload"], resolve)
 
                 try:
                     result = method(*args, **kwargs)
@@ -1103,8 +1160,10 @@ class NetTestSlave:
                     self._server_handler.send_data_to_ctl(response)
                     return
 
-                response = {"type": "result", "result": result}
-                response = device_to_deviceref(response)
+                #encoded here so that the result passes through the parent
+                #Slave of a network namespace unchanged
+                payload = encode_payload(result, device_persistent_id)
+                response = {"type": "result", "payload": payload}
                 self._server_handler.send_data_to_ctl(response)
             else:
                 err = LnstError("Method '%s' not supported." % msg["method_name"])
@@ -1131,6 +1190,8 @@ class NetTestSlave:
 
             job.set_finished(msg["result"])
             self._server_handler.send_data_to_ctl(msg)
+        elif msg["type"] == "job_output":
+            self._server_handler.send_data_to_ctl(msg)
         elif msg["type"] == "netlink":
             if_manager = self._methods._if_manager
             if if_manager is not None:
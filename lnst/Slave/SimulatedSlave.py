@@ -0,0 +1,387 @@
+"""
+This module defines the SimulatedSlave class, a Slave that implements the
+SlaveMethods RPC interface against a synthetic device table instead of the
+system it runs on. It listens on localhost and is meant for benchmarking the
+Controller (RPC overhead, mapping, serialization) without test machines.
+
+The module is executable, see lnst.Controller.SimulatedPool for a pool of
+simulated Slaves usable by the Controller.
+
+Copyright 2017 Red Hat, Inc.
+Licensed under the GNU General Public License, version 2 as
+published by the Free Software Foundation; see COPYING for details.
+"""
+
+import os
+import sys
+import json
+import getopt
+import signal
+import logging
+import datetime
+import multiprocessing
+from time import sleep
+from lnst.Common.Logs import LoggingCtl
+from lnst.Common.DeviceError import DeviceNotFound
+from lnst.Common.IpAddress import IpAddress
+from lnst.Slave.Config import SlaveConfig
+from lnst.Slave.Job import JobContext
+from lnst.Slave.NetTestSlave import NetTestSlave, SlaveMethods, ServerHandler
+
+class SimulatedDevice(object):
+    """Entry of the synthetic device table
+
+    Provides the attributes the Controller reads from Devices, methods that
+    have no simulated implementation do nothing and return None.
+    """
+    def __init__(self, if_manager, if_index, name, hwaddr, driver="sim",
+                 ips=[]):
+        self._if_manager = if_manager
+        self.if_index = if_index
+        self.name = name
+        self.hwaddr = hwaddr
+        self.driver = driver
+        self.ips = list(ips)
+        self.mtu = 1500
+        self.state = "DOWN"
+        self.master = None
+        self.link_header_type = 1
+        self.speed = 10000
+        self._devlink = None
+        self._enabled = True
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+
+        def noop(*args, **kwargs):
+            return None
+        return noop
+
+    def _get_if_data(self):
+        return {"if_index": self.if_index,
+                "hwaddr": self.hwaddr,
+                "name": self.name,
+                "ip_addrs": self.ips,
+                "link_header_type": self.link_header_type,
+                "state": self.state,
+                "master": self.master,
+                "mtu": self.mtu,
+                "driver": self.driver,
+                "devlink": self._devlink}
+
+    def _enable(self):
+        self._enabled = True
+
+    def _disable(self):
+        self._enabled = False
+
+    def _destroy(self):
+        self._if_manager.remove_device(self)
+
+    def get_name(self):
+        return self.name
+
+    def get_hwaddr(self):
+        return self.hwaddr
+
+    def up(self):
+        self.state = "UP"
+
+    def down(self):
+        self.state = "DOWN"
+
+    def ip_add(self, addr):
+        addr = IpAddress(addr)
+        if addr not in self.ips:
+            self.ips.append(addr)
+        return addr
+
+    def ip_del(self, addr):
+        addr = IpAddress(addr)
+        if addr in self.ips:
+            self.ips.remove(addr)
+
+    def ip_flush(self):
+        self.ips = []
+
+    def master_set(self, dev):
+        self.master = dev.if_index if dev is not None else None
+
+class SimulatedInterfaceManager(object):
+    """InterfaceManager replacement keeping a synthetic device table
+
+    The table contains the control device with the loopback address (the
+    Slave disables the device its controller connection uses) and
+    device_count test devices.
+    """
+    def __init__(self, machine_index=0, device_count=2,
+                 ctl_address="127.0.0.1"):
+        self._machine_index = machine_index
+        self._device_count = device_count
+        self._next_if_index = 1
+        self._devices = {}
+
+        #never written to, keeps the ServerHandler netlink slot occupied
+        self._nl_socket, self._nl_peer = multiprocessing.Pipe(False)
+
+        self._add_device("lo", "00:00:00:00:00:00", driver="loopback",
+                         ips=[IpAddress("%s/8" % ctl_address)])
+        for i in range(device_count):
+            self._add_device("eth%d" % i, self.get_hwaddr(machine_index, i))
+        self._persistent = set(self._devices.keys())
+
+    @staticmethod
+    def get_hwaddr(machine_index, dev_index):
+        #the same as lnst.Controller.SimulatedPool.sim_hwaddr, the Controller
+        #modules can't be imported on the Slave
+        return "02:00:%02X:%02X:%02X:%02X" % ((machine_index >> 8) & 0xff,
+                                              machine_index & 0xff,
+                                              (dev_index >> 8) & 0xff,
+                                              dev_index & 0xff)
+
+    def _add_device(self, name, hwaddr, **kwargs):
+        dev = SimulatedDevice(self, self._next_if_index, name, hwaddr,
+                              **kwargs)
+        self._devices[dev.if_index] = dev
+        self._next_if_index += 1
+        return dev
+
+    def add_device_class(self, name, cls):
+        pass
+
+    def reconnect_netlink(self):
+        pass
+
+    def get_nl_socket(self):
+        return self._nl_socket
+
+    def handle_netlink_msgs(self, msgs):
+        pass
+
+    def rescan_devices(self):
+        pass
+
+    def get_device(self, if_index):
+        if if_index in self._devices:
+            return self._devices[if_index]
+        else:
+            raise DeviceNotFound()
+
+    def get_devices(self):
+        return self._devices.values()
+
+    def get_device_by_hwaddr(self, hwaddr):
+        for dev in self._devices.values():
+            if dev.hwaddr == hwaddr:
+                return dev
+        raise DeviceNotFound()
+
+    def get_device_by_name(self, name):
+        for dev in self._devices.values():
+            if dev.name == name:
+                return dev
+        raise DeviceNotFound()
+
+    def deconfigure_all(self):
+        for dev in self._devices.values():
+            if dev.if_index not in self._persistent:
+                self.remove_device(dev)
+            else:
+                dev.ip_flush()
+                dev.down()
+                dev.master = None
+
+    def create_device(self, clsname, args=[], kwargs={}):
+        if "name" in kwargs and kwargs["name"]:
+            name = kwargs["name"]
+        else:
+            name = "t_%s%d" % (clsname.lower()[:4], self._next_if_index)
+        hwaddr = self.get_hwaddr(self._machine_index,
+                                 0x8000 + self._next_if_index)
+        return self._add_device(name, hwaddr, driver=clsname.lower())
+
+    def remove_device(self, dev):
+        if dev.if_index in self._devices:
+            del self._devices[dev.if_index]
+
+class SimulatedSlaveMethods(SlaveMethods):
+    """SlaveMethods working on the SimulatedInterfaceManager
+
+    Jobs aren't executed, they finish successfully right after they're
+    started.
+    """
+    def __init__(self, *args, **kwargs):
+        self._machine_index = kwargs.pop("machine_index", 0)
+        self._device_count = kwargs.pop("device_count", 2)
+        self._address = kwargs.pop("address", "127.0.0.1")
+        SlaveMethods.__init__(self, *args, **kwargs)
+        self._finished_jobs = []
+
+    def hello(self):
+        logging.info("Recieved a controller connection.")
+
+        slave_desc = {"nm_running": False,
+                      "kernel_release": "simulated",
+                      "redhat_release": "simulated",
+                      "lnst_version": self._slave_config.version}
+        return ("hello", slave_desc)
+
+    def set_recipe(self, recipe_name):
+        self.machine_cleanup()
+        self._cache.del_old_entries()
+        self.reset_file_transfers()
+
+        date = datetime.datetime.now().strftime("%Y-%m-%d_%H:%M:%S")
+        self._log_ctl.set_recipe(recipe_name, expand=date)
+        return True
+
+    def init_if_manager(self):
+        self._if_manager = SimulatedInterfaceManager(self._machine_index,
+                                                     self._device_count,
+                                                     self._address)
+        self._server_handler.set_if_manager(self._if_manager)
+        self._server_handler.add_connection('netlink',
+                                            self._if_manager.get_nl_socket())
+        return True
+
+    def destroy_devices(self):
+        self._if_manager.deconfigure_all()
+
+    def run_job(self, job):
+        logging.info("Simulating job %d" % job["job_id"])
+        self._finished_jobs.append({"type": "job_finished",
+                                    "job_id": job["job_id"],
+                                    "result": {"passed": True,
+                                               "res_data": None}})
+        return True
+
+    def kill_job(self, job_id, signal):
+        return True
+
+    def pop_finished_jobs(self):
+        jobs = self._finished_jobs
+        self._finished_jobs = []
+        return jobs
+
+class SimulatedSlave(NetTestSlave):
+    """Slave answering RPC calls from a synthetic device table
+
+    Args:
+        log_ctl -- LoggingCtl object
+        slave_config -- SlaveConfig object, rpcport sets the listening port
+        address -- loopback address to listen on, every simulated Slave of
+            a pool needs its own as the pool hostnames have to be unique
+        machine_index -- number used to generate unique hwaddrs
+        device_count -- number of test devices in the device table
+        latency -- delay in seconds added to every RPC call
+        method_latency -- dictionary of per method delays overriding latency
+    """
+    def __init__(self, log_ctl, slave_config, address="127.0.0.1",
+                 machine_index=0, device_count=2, latency=0.0,
+                 method_latency={}):
+        self._slave_config = slave_config
+
+        self._job_context = JobContext()
+        port = slave_config.get_option("environment", "rpcport")
+        logging.info("Simulated slave using RPC address %s:%d." % (address,
+                                                                 port))
+        self._server_handler = ServerHandler((address, port), slave_config)
+
+        self._net_namespaces = {}
+
+        self._methods = SimulatedSlaveMethods(self._job_context, log_ctl,
+                                              self._net_namespaces,
+                                              self._server_handler,
+                                              slave_config, self,
+                                              machine_index=machine_index,
+                                              device_count=device_count,
+                                              address=address)
+
+        self._latency = latency
+        self._method_latency = dict(method_latency)
+
+        self.register_die_signal(signal.SIGHUP)
+        self.register_die_signal(signal.SIGINT)
+        self.register_die_signal(signal.SIGTERM)
+
+        self._finished = False
+
+        self._log_ctl = log_ctl
+
+    def _process_msg(self, msg):
+        if msg["type"] == "command":
+            latency = self._method_latency.get(msg["method_name"],
+                                               self._latency)
+            if latency:
+                sleep(latency)
+
+        NetTestSlave._process_msg(self, msg)
+
+        for job_msg in self._methods.pop_finished_jobs():
+            self._server_handler.send_data_to_ctl(job_msg)
+
+def usage():
+    print "Usage: python -m lnst.Slave.SimulatedSlave [OPTION...]"
+    print ""
+    print "  -a, --address          loopback address to listen on"
+    print "  -p, --port             port to listen on"
+    print "  -w, --work-dir         directory for logs and the resource cache"
+    print "  -i, --index            machine index used to generate hwaddrs"
+    print "  -n, --devices          number of test devices"
+    print "  -l, --latency          delay in seconds added to every RPC call"
+    print "  -m, --method-latency   JSON object of per method delays"
+    print "  -d, --debug            emit debugging messages"
+    sys.exit()
+
+def main():
+    try:
+        opts = getopt.getopt(sys.argv[1:], "a:p:w:i:n:l:m:dh",
+                             ["address=", "port=", "work-dir=", "index=", "devices=",
+                              "latency=", "method-latency=", "debug",
+                              "help"])[0]
+    except getopt.GetoptError as err:
+        print str(err)
+        usage()
+
+    slave_config = SlaveConfig()
+    address = "127.0.0.1"
+    work_dir = os.getcwd()
+    machine_index = 0
+    device_count = 2
+    latency = 0.0
+    method_latency = {}
+    debug = False
+    for opt, arg in opts:
+        if opt in ("-a", "--address"):
+            address = arg
+        elif opt in ("-p", "--port"):
+            slave_config.set_option("environment", "rpcport", int(arg))
+        elif opt in ("-w", "--work-dir"):
+            work_dir = os.path.abspath(arg)
+        elif opt in ("-i", "--index"):
+            machine_index = int(arg)
+        elif opt in ("-n", "--devices"):
+            device_count = int(arg)
+        elif opt in ("-l", "--latency"):
+            latency = float(arg)
+        elif opt in ("-m", "--method-latency"):
+            method_latency = json.loads(arg)
+        elif opt in ("-d", "--debug"):
+            debug = True
+        elif opt in ("-h", "--help"):
+            usage()
+
+    slave_config.set_option("environment", "use_nm", False)
+    slave_config.set_option("cache", "dir", os.path.join(work_dir, "cache"))
+
+    log_ctl = LoggingCtl(debug, log_dir=os.path.join(work_dir, "Logs"),
+                         colours=False)
+
+    slave = SimulatedSlave(log_ctl, slave_config, address, machine_index,
+                           device_count, latency, method_latency)
+    logging.info("Started")
+    slave.run()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,250 @@
+"""
+Defines the CPUProfiler test module that samples per-CPU utilisation,
+networking softirq counts and per-IRQ interrupt rates while other Jobs
+generate traffic.
+
+Copyright 2017 Red Hat, Inc.
+Licensed under the GNU General Public License, version 2 as
+published by the Free Software Foundation; see COPYING for details.
+"""
+
+import os
+import time
+import signal
+import logging
+from lnst.Common.Parameters import FloatParam, DeviceParam
+from lnst.Common.TestModule import BaseTestModule, TestModuleError
+
+NET_SOFTIRQS = ["NET_RX", "NET_TX"]
+
+def read_proc_stat():
+    """returns {cpu_name: (busy_jiffies, total_jiffies)} from /proc/stat"""
+    res = {}
+    with open("/proc/stat", "r") as f:
+        for line in f:
+            if not line.startswith("cpu") or line.startswith("cpu "):
+                continue
+            fields = line.split()
+            values = [int(x) for x in fields[1:]]
+            total = sum(values[:8])
+            # idle + iowait
+            idle = values[3] + values[4]
+            res[fields[0]] = (total - idle, total)
+    return res
+
+def read_proc_softirqs(names=NET_SOFTIRQS):
+    """returns {softirq_name: {cpu_name: count}} from /proc/softirqs"""
+    res = {}
+    with open("/proc/softirqs", "r") as f:
+        cpus = [cpu.lower() for cpu in f.readline().split()]
+        for line in f:
+            fields = line.split()
+            if not fields:
+                continue
+            name = fields[0].rstrip(":")
+            if name not in names:
+                continue
+            res[name] = dict(zip(cpus, [int(x) for x in fields[1:]]))
+    return res
+
+def read_proc_interrupts(pattern=None):
+    """returns {irq: {"desc": str, "counts": {cpu_name: count}}}
+
+    Only numbered IRQs are reported, if pattern is set only IRQs whose
+    description contains the pattern are returned.
+    """
+    res = {}
+    with open("/proc/interrupts", "r") as f:
+        cpus = [cpu.lower() for cpu in f.readline().split()]
+        for line in f:
+            fields = line.split()
+            if not fields:
+                continue
+            irq = fields[0].rstrip(":")
+            if not irq.isdigit():
+                continue
+            counts = {}
+            for cpu, val in zip(cpus, fields[1:]):
+                try:
+                    counts[cpu] = int(val)
+                except ValueError:
+                    break
+            desc = " ".join(fields[len(counts)+1:])
+            if pattern is not None and pattern not in desc:
+                continue
+            res[irq] = {"desc": desc, "counts": counts}
+    return res
+
+def read_irq_affinity(irq):
+    """returns the effective affinity list of an IRQ as a string
+
+    Falls back to smp_affinity_list on kernels that don't expose the
+    effective affinity. Returns None if neither is readable.
+    """
+    for fname in ["effective_affinity_list", "smp_affinity_list"]:
+        try:
+            with open("/proc/irq/%s/%s" % (irq, fname), "r") as f:
+                return f.read().strip()
+        except IOError:
+            continue
+    return None
+
+def read_dev_packets(dev_name):
+    """returns rx_packets + tx_packets of a network device"""
+    total = 0
+    for stat in ["rx_packets", "tx_packets"]:
+        path = "/sys/class/net/%s/statistics/%s" % (dev_name, stat)
+        with open(path, "r") as f:
+            total += int(f.read())
+    return total
+
+def summarize(values):
+    if len(values) == 0:
+        return {"min": None, "avg": None, "max": None}
+    return {"min": min(values),
+            "avg": sum(values) / float(len(values)),
+            "max": max(values)}
+
+class CPUProfiler(BaseTestModule):
+    """Background CPU, softirq and IRQ profiler
+
+    Samples /proc/stat, /proc/softirqs and /proc/interrupts every 'interval'
+    seconds. The module runs for 'duration' seconds, or, when 'duration' is
+    not set, until the Job receives SIGINT or SIGTERM, so it's intended to be
+    run in background next to the traffic generating Job:
+        prof = m1.run(CPUProfiler(iface=m1.eth0), bg=True)
+        m1.run(Netperf(...))
+        prof.kill(signal.SIGINT)
+        prof.wait()
+
+    When 'iface' is set, only the IRQs of that device are reported, their
+    effective CPU affinity is recorded so that IRQ pinning can be verified,
+    and the CPU cost per packet is computed from the device's packet counters.
+
+    The result contains per-sample time series ('samples') and a 'summary'.
+    """
+    interval = FloatParam(default=1.0)
+    duration = FloatParam()
+    iface = DeviceParam()
+
+    def run(self):
+        self._stop = False
+        signal.signal(signal.SIGINT, self._stop_handler)
+        signal.signal(signal.SIGTERM, self._stop_handler)
+
+        interval = self.params.interval.val
+        if interval <= 0:
+            raise TestModuleError("Parameter interval must be positive")
+
+        dev_name = None
+        if self.params.iface.set:
+            dev_name = self.params.iface.val.name
+
+        samples = []
+        prev = self._sample(dev_name)
+        start = prev["time"]
+        while not self._stop:
+            time.sleep(interval)
+            cur = self._sample(dev_name)
+            samples.append(self._diff(prev, cur, start))
+            prev = cur
+
+            if self.params.duration.set and \
+               cur["time"] - start >= self.params.duration.val:
+                break
+
+        logging.debug("Collected %d CPU profile samples" % len(samples))
+
+        self._res_data = {"interval": interval,
+                          "samples": samples,
+                          "summary": self._summarize(samples, dev_name)}
+        return True
+
+    def _stop_handler(self, signum, frame):
+        logging.debug("CPUProfiler caught signal %d, stopping" % signum)
+        self._stop = True
+
+    def _sample(self, dev_name):
+        sample = {"time": time.time(),
+                  "cpu": read_proc_stat(),
+                  "softirq": read_proc_softirqs(),
+                  "irq": read_proc_interrupts(dev_name),
+                  "packets": None}
+        if dev_name is not None:
+            sample["packets"] = read_dev_packets(dev_name)
+        return sample
+
+    def _diff(self, prev, cur, start):
+        elapsed = cur["time"] - prev["time"]
+        res = {"time": cur["time"] - start,
+               "cpu_util": {},
+               "cpu_busy_jiffies": 0,
+               "softirq_rate": {},
+               "irq_rate": {},
+               "packets": None}
+
+        for cpu, (busy, total) in cur["cpu"].items():
+            if cpu not in prev["cpu"]:
+                continue
+            prev_busy, prev_total = prev["cpu"][cpu]
+            d_total = total - prev_total
+            d_busy = busy - prev_busy
+            res["cpu_busy_jiffies"] += d_busy
+            if d_total > 0:
+                res["cpu_util"][cpu] = 100.0 * d_busy / d_total
+            else:
+                res["cpu_util"][cpu] = 0.0
+
+        for name, counts in cur["softirq"].items():
+            prev_counts = prev["softirq"].get(name, {})
+            res["softirq_rate"][name] = \
+                dict([(cpu, (val - prev_counts.get(cpu, val)) / elapsed)
+                      for cpu, val in counts.items()])
+
+        for irq, data in cur["irq"].items():
+            if irq not in prev["irq"]:
+                continue
+            prev_counts = prev["irq"][irq]["counts"]
+            res["irq_rate"][irq] = \
+                dict([(cpu, (val - prev_counts.get(cpu, val)) / elapsed)
+                      for cpu, val in data["counts"].items()])
+
+        if cur["packets"] is not None:
+            res["packets"] = cur["packets"] - prev["packets"]
+        return res
+
+    def _summarize(self, samples, dev_name):
+        summary = {"cpu_util": {}, "softirq_rate": {}, "irq": {}}
+
+        cpus = set()
+        for sample in samples:
+            cpus.update(sample["cpu_util"].keys())
+        for cpu in cpus:
+            summary["cpu_util"][cpu] = summarize(
+                    [s["cpu_util"][cpu] for s in samples if cpu in s["cpu_util"]])
+
+        for name in NET_SOFTIRQS:
+            totals = [sum(s["softirq_rate"].get(name, {}).values())
+                      for s in samples]
+            summary["softirq_rate"][name] = summarize(totals)
+
+        irqs = set()
+        for sample in samples:
+            irqs.update(sample["irq_rate"].keys())
+        for irq in irqs:
+            rates = [sum(s["irq_rate"][irq].values())
+                     for s in samples if irq in s["irq_rate"]]
+            summary["irq"][irq] = {"rate": summarize(rates),
+                                   "affinity": read_irq_affinity(irq)}
+
+        if dev_name is not None:
+            packets = sum([s["packets"] for s in samples])
+            busy = sum([s["cpu_busy_jiffies"] for s in samples])
+            busy_usec = busy * 1000000.0 / os.sysconf("SC_CLK_TCK")
+            summary["packets"] = packets
+            summary["cpu_busy_usec"] = busy_usec
+            if packets > 0:
+                summary["cpu_usec_per_packet"] = busy_usec / packets
+            else:
+                summary["cpu_usec_per_packet"] = None
+        return summary
@@ -0,0 +1,271 @@
+"""
+Defines the LatencyServer and LatencyClient test modules that measure
+request/response latency over UDP or TCP and report it as a log-bucketed
+histogram.
+
+Copyright 2017 Red Hat, Inc.
+Licensed under the GNU General Public License, version 2 as
+published by the Free Software Foundation; see COPYING for details.
+"""
+
+import time
+import errno
+import fcntl
+import select
+import signal
+import socket
+import struct
+import logging
+from lnst.Common.Parameters import IntParam, FloatParam, StrParam, IpParam
+from lnst.Common.TestModule import BaseTestModule, TestModuleError
+from lnst.Common.Histogram import LogHistogram
+
+#from asm-generic/sockios.h
+SIOCGSTAMPNS = 0x8907
+
+#sequence number and the size of the whole probe, the TCP server reads the
+#rest of the probe according to it
+PROBE_HDR = struct.Struct("!QI")
+
+def _get_kernel_rx_stamp(sock):
+    """returns the kernel receive timestamp of the last datagram in seconds
+
+    Returns None if the socket doesn't support it (e.g. stream sockets).
+    """
+    try:
+        res = fcntl.ioctl(sock.fileno(), SIOCGSTAMPNS, struct.pack("qq", 0, 0))
+    except IOError:
+        return None
+    sec, nsec = struct.unpack("qq", res)
+    return sec + nsec / 1e9
+
+def _recv_exact(sock, size):
+    data = ""
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            raise socket.error(errno.ECONNRESET, "Connection closed by peer")
+        data += chunk
+    return data
+
+class LatencyServer(BaseTestModule):
+    """Echo server for LatencyClient probes
+
+    Runs for 'duration' seconds or, if it isn't set, until the Job receives
+    SIGINT or SIGTERM, so it's meant to be run in background. The size of
+    the probes is taken from their header.
+    """
+    bind = IpParam()
+    port = IntParam(default=9010)
+    proto = StrParam(default="udp")
+    duration = FloatParam()
+
+    def run(self):
+        self._stop = False
+        signal.signal(signal.SIGINT, self._stop_handler)
+        signal.signal(signal.SIGTERM, self._stop_handler)
+
+        proto = self.params.proto.val
+        if proto not in ["udp", "tcp"]:
+            raise TestModuleError("Unsupported protocol %s" % proto)
+
+        family = socket.AF_INET
+        addr = ""
+        if self.params.bind.set:
+            family = self.params.bind.val.family
+            addr = str(self.params.bind.val)
+
+        if proto == "udp":
+            sock = socket.socket(family, socket.SOCK_DGRAM)
+        else:
+            sock = socket.socket(family, socket.SOCK_STREAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind((addr, self.params.port.val))
+        if proto == "tcp":
+            sock.listen(1)
+
+        self._start = time.time()
+        self._echoed = 0
+        try:
+            if proto == "udp":
+                self._serve_udp(sock)
+            else:
+                self._serve_tcp(sock)
+        finally:
+            sock.close()
+
+        self._res_data = {"echoed": self._echoed}
+        return True
+
+    def _stop_handler(self, signum, frame):
+        logging.debug("LatencyServer caught signal %d, stopping" % signum)
+        self._stop = True
+
+    def _should_run(self):
+        if self._stop:
+            return False
+        if self.params.duration.set:
+            return time.time() - self._start < self.params.duration.val
+        return True
+
+    def _wait_readable(self, sock):
+        try:
+            rl, _, _ = select.select([sock], [], [], 0.5)
+        except select.error as e:
+            if e[0] == errno.EINTR:
+                return False
+            raise
+        return len(rl) > 0
+
+    def _serve_udp(self, sock):
+        while self._should_run():
+            if not self._wait_readable(sock):
+                continue
+            data, addr = sock.recvfrom(65535)
+            sock.sendto(data, addr)
+            self._echoed += 1
+
+    def _serve_tcp(self, sock):
+        while self._should_run():
+            if not self._wait_readable(sock):
+                continue
+            conn, addr = sock.accept()
+            conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            try:
+                while self._should_run():
+                    if not self._wait_readable(conn):
+                        continue
+                    data = _recv_exact(conn, PROBE_HDR.size)
+                    seq, size = PROBE_HDR.unpack(data)
+                    if size < PROBE_HDR.size:
+                        raise socket.error(errno.EPROTO,
+                                           "Invalid probe size %d" % size)
+                    data += _recv_exact(conn, size - PROBE_HDR.size)
+                    conn.sendall(data)
+                    self._echoed += 1
+            except socket.error as e:
+                logging.debug("Connection from %s closed: %s" %
+                              (addr[0], str(e)))
+            finally:
+                conn.close()
+
+class LatencyClient(BaseTestModule):
+    """Request/response latency measurement
+
+    Sends 'count' probes of 'size' bytes to a LatencyServer, one every
+    'interval' seconds, and measures the round trip time of each. For UDP the
+    receive side uses the kernel socket timestamp when the kernel provides
+    it, otherwise (and for TCP) a userspace clock is used. The result
+    contains the p50, p99, p99.9 and max latency in microseconds and the raw
+    histogram (in nanoseconds) that can be merged across runs with
+    LogHistogram.from_dict and LogHistogram.merge.
+
+    Probes that don't come back within 'timeout' seconds are counted as
+    lost. A TCP connection is reopened after a lost probe, because the rest
+    of the late response would be read as the next one.
+    """
+    server = IpParam(mandatory=True)
+    port = IntParam(default=9010)
+    proto = StrParam(default="udp")
+    count = IntParam(default=1000)
+    interval = FloatParam(default=0.01)
+    size = IntParam(default=64)
+    timeout = FloatParam(default=1.0)
+
+    def run(self):
+        proto = self.params.proto.val
+        if proto not in ["udp", "tcp"]:
+            raise TestModuleError("Unsupported protocol %s" % proto)
+        if self.params.size.val < PROBE_HDR.size:
+            raise TestModuleError("Parameter size must be at least %d" %
+                                  PROBE_HDR.size)
+
+        sock = self._connect()
+        hist = LogHistogram()
+        self._kernel_stamps = proto == "udp"
+        if self._kernel_stamps:
+            #the first SIOCGSTAMPNS enables the timestamping, a datagram
+            #received before that has no kernel timestamp
+            _get_kernel_rx_stamp(sock)
+        lost = 0
+        try:
+            for seq in xrange(self.params.count.val):
+                rtt = self._probe(sock, seq)
+                if rtt is None:
+                    lost += 1
+                    if proto == "tcp":
+                        sock.close()
+                        sock = self._connect()
+                else:
+                    hist.record(rtt * 1e9)
+                time.sleep(self.params.interval.val)
+        finally:
+            sock.close()
+
+        def usec(val):
+            if val is None:
+                return None
+            return val / 1000.0
+
+        self._res_data = {"proto": proto,
+                          "timestamping": "kernel" if self._kernel_stamps
+                                          else "software",
+                          "sent": self.params.count.val,
+                          "received": hist.total,
+                          "lost": lost,
+                          "min": usec(hist.min),
+                          "avg": usec(hist.mean),
+                          "p50": usec(hist.percentile(50)),
+                          "p99": usec(hist.percentile(99)),
+                          "p99.9": usec(hist.percentile(99.9)),
+                          "max": usec(hist.max),
+                          "histogram": hist.to_dict()}
+
+        if hist.total == 0:
+            self._res_data["msg"] = "no probe responses received"
+            return False
+        return True
+
+    def _connect(self):
+        server = self.params.server.val
+        addr = (str(server), self.params.port.val)
+        if self.params.proto.val == "udp":
+            sock = socket.socket(server.family, socket.SOCK_DGRAM)
+            sock.connect(addr)
+        else:
+            sock = socket.create_connection(addr, self.params.timeout.val)
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        sock.settimeout(self.params.timeout.val)
+        return sock
+
+    def _probe(self, sock, seq):
+        size = self.params.size.val
+        payload = PROBE_HDR.pack(seq, size)
+        payload += "\0" * (size - len(payload))
+
+        sent = time.time()
+        sock.sendall(payload)
+        while True:
+            try:
+                if self.params.proto.val == "udp":
+                    data = sock.recv(65535)
+                else:
+                    data = _recv_exact(sock, len(payload))
+            except socket.timeout:
+                return None
+            received = time.time()
+
+            if PROBE_HDR.unpack(data[:PROBE_HDR.size])[0] != seq:
+                #late response to an already lost probe
+                continue
+            break
+
+        if self._kernel_stamps:
+            stamp = _get_kernel_rx_stamp(sock)
+            if stamp is None:
+                self._kernel_stamps = False
+            elif sent <= stamp <= received:
+                received = stamp
+            #otherwise the datagram wasn't stamped on receive and the kernel
+            #returned the time of the ioctl, the userspace time is used
+        return received - sent
@@ -13,5 +13,7 @@ olichtne@redhat.com (Ondrej Lichtner)
 """
 
 from lnst.Tests.IcmpPing import IcmpPing
+from lnst.Tests.CPUProfiler import CPUProfiler
+from lnst.Tests.Latency import LatencyServer, LatencyClient
 
 #TODO add support for test classes from lnst-ctl.conf
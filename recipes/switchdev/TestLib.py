@@ -288,13 +288,12 @@ class TestLib:
         m1.run(custom_mod, desc=desc)
 
     def check_fdb(self, iface, hwaddr, vlan_id, rec_type, find=True):
-        fdb_table = iface.get_br_fdbs()
+        fdb_table = iface.get_br_fdb(hwaddr, vlan_id)
 
         rec = "offload" if rec_type == "software" else "self"
         found = False
         for fdb in fdb_table:
-            if (fdb["hwaddr"] == str(hwaddr) and fdb["vlan_id"] == vlan_id and
-                fdb[rec]):
+            if fdb[rec]:
                 found = True
 
         if found and not find:
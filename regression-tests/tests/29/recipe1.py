@@ -0,0 +1,16 @@
+from lnst.Controller.Task import ctl
+
+m1 = ctl.get_host("testmachine1")
+
+# nothing listens on port 1, PerfRepo is unreachable
+url = "http://127.0.0.1:1/perfrepo"
+
+perf_api = ctl.connect_PerfRepo("perfrepo.mapping", url, "user", "password")
+perf_api = ctl.connect_PerfRepo("perfrepo.mapping", url, "user", "password")
+
+result = perf_api.new_result("spool_test_id", "spool_test")
+result.add_value("throughput", 1000.0)
+perf_api.save_result(result)
+perf_api.flush()
+
+m1.run("echo spooled")
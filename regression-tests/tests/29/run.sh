@@ -0,0 +1,43 @@
+#!/bin/bash
+
+. ../lib.sh
+
+function assert_spooled
+{
+    local expect="$1"
+    local count="$2"
+
+    if [ "$count" -ne "$expect" ]; then
+        test_status=1
+        echo "assert_spooled FAILED (expected: $expect, real: $count)"
+    else
+        echo "assert_spooled PASSED (expected: $expect, real: $count)"
+    fi
+}
+
+init_test
+
+rm -rf spool
+
+lnst-ctl -d -c spool.conf run recipe1.xml | tee test.log
+rv1=${PIPESTATUS[0]}
+log1=`cat test.log`
+spooled1=`ls -1 spool/*.texec 2>/dev/null | wc -l`
+
+lnst-ctl -d -c spool.conf run recipe1.xml | tee test.log
+rv2=${PIPESTATUS[0]}
+log2=`cat test.log`
+spooled2=`ls -1 spool/*.texec 2>/dev/null | wc -l`
+
+print_separator
+assert_status "pass" "$rv1"
+assert_log "WARNING" "PerfRepo unreachable, results will be spooled" "$log1"
+assert_log "WARNING" "PerfRepo result spooled to" "$log1"
+assert_spooled 1 "$spooled1"
+assert_status "pass" "$rv2"
+assert_log "INFO" "Replaying spooled PerfRepo result" "$log2"
+assert_spooled 2 "$spooled2"
+
+rm -rf spool test.log
+
+end_test
@@ -1,31 +1,59 @@
 <?xml version="1.0" encoding="ISO-8859-1"?>
 <xsl:stylesheet version="1.0" xmlns:xsl="http://www.w3.org/1999/XSL/Transform">
     <xsl:output method="html" indent="yes"/>
+
+    <!-- set by the result serializer to render parts of the page separately:
+         'recipe' - recipe heading and match description
+         'results_header' - header rows of the results table
+         'tasks' - rows of the tasks -->
+    <xsl:param name="fragment" select="''"/>
+
     <xsl:template match="/">
-        <html>
-            <head>
-                <title>LNST results</title>
-                <meta charset="utf-8"/>
-                <link rel="stylesheet" type="text/css" href="http://www.lnst-project.org/files/result_xslt/xml_to_html.css"/>
-                <script type="text/javascript" src="http://www.lnst-project.org/files/result_xslt/xml_to_html.js"></script>
-            </head>
-            <body>
-                <h2>LNST results</h2>
-                <xsl:apply-templates select="results/recipe"/>
-            </body>
-        </html>
+        <xsl:choose>
+            <xsl:when test="$fragment = 'recipe'">
+                <xsl:apply-templates select="results/recipe" mode="head"/>
+            </xsl:when>
+            <xsl:when test="$fragment = 'results_header'">
+                <xsl:call-template name="results_header"/>
+            </xsl:when>
+            <xsl:when test="$fragment = 'tasks'">
+                <xsl:apply-templates select="results/recipe/task"/>
+            </xsl:when>
+            <xsl:otherwise>
+                <html>
+                    <head>
+                        <title>LNST results</title>
+                        <meta charset="utf-8"/>
+                        <link rel="stylesheet" type="text/css" href="http://www.lnst-project.org/files/result_xslt/xml_to_html.css"/>
+                        <script type="text/javascript" src="http://www.lnst-project.org/files/result_xslt/xml_to_html.js"></script>
+                    </head>
+                    <body>
+                        <h2>LNST results</h2>
+                        <xsl:apply-templates select="results/recipe"/>
+                    </body>
+                </html>
+            </xsl:otherwise>
+        </xsl:choose>
     </xsl:template>
 
     <xsl:template match="recipe">
-        <h3><xsl:value-of select="@name"/> match <xsl:value-of select="@match_num"/></h3>
-        <xsl:apply-templates select="pool_match"/>
+        <xsl:apply-templates select="." mode="head"/>
         <table class="lnst_results">
-            <tr><th colspan="5">Task</th></tr>
-            <tr><th>Host</th><th>Bg ID</th><th>Command</th><th>Result</th><th>Result message</th><th>Description</th></tr>
+            <xsl:call-template name="results_header"/>
             <xsl:apply-templates select="task"/>
         </table>
     </xsl:template>
 
+    <xsl:template match="recipe" mode="head">
+        <h3><xsl:value-of select="@name"/> match <xsl:value-of select="@match_num"/></h3>
+        <xsl:apply-templates select="pool_match"/>
+    </xsl:template>
+
+    <xsl:template name="results_header">
+        <tr><th colspan="5">Task</th></tr>
+        <tr><th>Host</th><th>Bg ID</th><th>Command</th><th>Result</th><th>Result message</th><th>Description</th></tr>
+    </xsl:template>
+
     <xsl:template match="pool_match">
         <table class="match_description">
             <tr><th colspan="3">Match description</th></tr>
@@ -75,9 +103,22 @@
     </xsl:template>
 
     <xsl:template match="task">
-        <tr class="task_header"><th colspan="6">Task <xsl:value-of select="position()"/></th></tr>
+        <xsl:variable name="task_id">
+            <xsl:choose>
+                <xsl:when test="@id">
+                    <xsl:value-of select="@id"/>
+                </xsl:when>
+                <xsl:otherwise>
+                    <xsl:value-of select="position()"/>
+                </xsl:otherwise>
+            </xsl:choose>
+        </xsl:variable>
+        <!-- commands of long tasks are rendered in several parts -->
+        <xsl:if test="not(@continued)">
+            <tr class="task_header"><th colspan="6">Task <xsl:value-of select="$task_id"/></th></tr>
+        </xsl:if>
         <xsl:apply-templates select="command">
-            <xsl:with-param name="task_id" select="position()"/>
+            <xsl:with-param name="task_id" select="$task_id"/>
         </xsl:apply-templates>
     </xsl:template>
 